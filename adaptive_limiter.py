@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+"""Adaptive concurrency limit for requests submitted to Thoth APIs.
+
+The limit follows the additive increase/multiplicative decrease (AIMD) scheme.
+Once a window of requests completes with p95 latency and error rate under the
+target, while the limit was fully used, the limit is raised by one. It is cut
+by a constant factor as soon as the server signals overload - it responds with
+HTTP 429 or 5xx, or the request times out or the connection fails. Overload
+signals of requests started before the last cut are ignored so that a single
+burst of failures cuts the limit only once.
+
+The current limit, number of requests in flight, throughput and latency are
+logged periodically and exported as gauges with other instrumentation metrics.
+"""
+
+import math
+import time
+import logging
+import functools
+import threading
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import click
+import requests
+
+from instrumentation import set_gauge
+
+_LOGGER = logging.getLogger(__name__)
+
+OVERLOAD_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+
+
+def classify(status_code: Optional[int] = None, exc: Optional[BaseException] = None) -> Tuple[bool, bool]:
+    """Classify outcome of a request given its status code or the exception raised, return (failed, overloaded)."""
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status_code = exc.response.status_code
+    elif isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True, True
+    elif exc is not None:
+        return True, False
+
+    if status_code is None:
+        return False, False
+
+    return status_code >= 400, status_code in OVERLOAD_STATUS_CODES
+
+
+def _p95(latencies: List[float]) -> Optional[float]:
+    """Compute p95 of the given latencies using the nearest-rank method."""
+    if not latencies:
+        return None
+    latencies = sorted(latencies)
+    return latencies[max(math.ceil(0.95 * len(latencies)), 1) - 1]
+
+
+class AdaptiveLimiter:
+    """A concurrency limit adapted to latency and errors observed, safe to be shared across threads."""
+
+    def __init__(
+        self,
+        *,
+        initial_limit: int = 1,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        target_latency: float = 5.0,
+        max_error_rate: float = 0.05,
+        decrease_factor: float = 0.5,
+        min_window: int = 10,
+        report_interval: float = 10.0,
+    ) -> None:
+        """Initialize the limiter."""
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError(
+                f"Limits must satisfy 1 <= min_limit ({min_limit}) <= initial_limit ({initial_limit}) "
+                f"<= max_limit ({max_limit})"
+            )
+
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.min_window = min_window
+        self.report_interval = report_interval
+
+        self._condition = threading.Condition()
+        self._limit = initial_limit
+        self._in_flight = 0
+        self._last_decrease = time.monotonic()
+
+        # Samples of the current window, used to decide about increasing the limit.
+        self._window_latencies: List[float] = []
+        self._window_failed = 0
+        self._window_saturated = False
+
+        # Samples since the last report.
+        self._report_start = time.monotonic()
+        self._report_latencies: List[float] = []
+        self._report_failed = 0
+
+        self.completed = 0
+        self.failed = 0
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        """Get the current concurrency limit."""
+        return self._limit
+
+    @property
+    def in_flight(self) -> int:
+        """Get number of requests in flight."""
+        return self._in_flight
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> Optional[float]:
+        """Wait until a request can be sent, return a token to be passed to release; None if stopped meanwhile."""
+        with self._condition:
+            while self._in_flight >= self._limit:
+                if stop is not None and stop.is_set():
+                    return None
+                self._condition.wait(timeout=0.5)
+
+            self._in_flight += 1
+            if self._in_flight >= self._limit:
+                self._window_saturated = True
+
+        return time.monotonic()
+
+    def release(
+        self,
+        token: float,
+        *,
+        status_code: Optional[int] = None,
+        exc: Optional[BaseException] = None,
+        sample: bool = True,
+    ) -> None:
+        """Release a slot acquired for a request and adapt the limit to the request outcome.
+
+        Pass sample=False if the slot was not used to send a request.
+        """
+        now = time.monotonic()
+        failed, overloaded = classify(status_code, exc)
+
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+            if not sample:
+                return
+
+            latency = now - token
+            self.completed += 1
+            self.failed += int(failed)
+            self._report_latencies.append(latency)
+            self._report_failed += int(failed)
+
+            if overloaded:
+                if token >= self._last_decrease:
+                    self._decrease(now)
+            else:
+                self._window_latencies.append(latency)
+                self._window_failed += int(failed)
+                if len(self._window_latencies) >= max(self.min_window, self._limit):
+                    self._evaluate_window()
+
+            if now - self._report_start >= self.report_interval:
+                self._report(now)
+
+    def _decrease(self, now: float) -> None:
+        """Cut the limit multiplicatively, called with the lock held."""
+        previous = self._limit
+        self._limit = max(self.min_limit, int(self._limit * self.decrease_factor))
+        self._last_decrease = now
+        self.decreases += 1
+        self._reset_window()
+        _LOGGER.warning("Server is overloaded, concurrency limit decreased from %d to %d", previous, self._limit)
+        set_gauge("concurrency_limit", self._limit)
+
+    def _evaluate_window(self) -> None:
+        """Raise the limit additively if the window met the targets, called with the lock held."""
+        p95 = _p95(self._window_latencies)
+        error_rate = self._window_failed / len(self._window_latencies)
+        if (
+            self._window_saturated
+            and self._limit < self.max_limit
+            and p95 <= self.target_latency
+            and error_rate <= self.max_error_rate
+        ):
+            self._limit += 1
+            _LOGGER.debug("Concurrency limit increased to %d (p95 %.3fs)", self._limit, p95)
+            set_gauge("concurrency_limit", self._limit)
+            self._condition.notify()
+
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        """Start a new window of samples, called with the lock held."""
+        self._window_latencies = []
+        self._window_failed = 0
+        self._window_saturated = self._in_flight >= self._limit
+
+    def _report(self, now: float) -> None:
+        """Log and export current state of the limiter, called with the lock held."""
+        elapsed = now - self._report_start
+        count = len(self._report_latencies)
+        throughput = count / elapsed if elapsed else 0.0
+        p95 = _p95(self._report_latencies)
+        _LOGGER.info(
+            "Concurrency limit %d, in flight %d, throughput %.2f req/s, p95 latency %s, errors %d/%d",
+            self._limit,
+            self._in_flight,
+            throughput,
+            f"{p95:.3f}s" if p95 is not None else "n/a",
+            self._report_failed,
+            count,
+        )
+        set_gauge("concurrency_limit", self._limit)
+        set_gauge("requests_in_flight", self._in_flight)
+        set_gauge("throughput_requests_per_second", throughput)
+
+        self._report_start = now
+        self._report_latencies = []
+        self._report_failed = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get a summary of the limiter state."""
+        with self._condition:
+            return {
+                "limit": self._limit,
+                "in_flight": self._in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "decreases": self.decreases,
+            }
+
+
+def limiter_options(func: Callable) -> Callable:
+    """Add options to a click command which configure an adaptive limiter passed to it as `limiter'."""
+
+    @click.option(
+        "--initial-concurrency",
+        type=int,
+        default=1,
+        show_default=True,
+        help="Number of requests sent concurrently at start, raised as long as the server copes.",
+    )
+    @click.option(
+        "--max-concurrency",
+        type=int,
+        default=16,
+        show_default=True,
+        help="Maximum number of requests sent concurrently.",
+    )
+    @click.option(
+        "--target-latency",
+        type=float,
+        default=5.0,
+        show_default=True,
+        help="Concurrency is raised only while p95 latency of requests in seconds stays under this target.",
+    )
+    @functools.wraps(func)
+    def wrapper(
+        *args: Any, initial_concurrency: int, max_concurrency: int, target_latency: float, **kwargs: Any
+    ) -> Any:
+        try:
+            limiter = AdaptiveLimiter(
+                initial_limit=initial_concurrency, max_limit=max_concurrency, target_latency=target_latency
+            )
+        except ValueError as exc:
+            raise click.BadParameter(str(exc))
+
+        return func(*args, limiter=limiter, **kwargs)
+
+    return wrapper
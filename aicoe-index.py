@@ -2,6 +2,11 @@
 
 """A simple script to test AICoE Python index structure.
 
+It can also find byte-identical wheels stored under several configurations.
+Wheels are grouped by size first, only wheels sharing their size are hashed.
+Duplicates can be replaced with hardlinks (or reflinks on filesystems
+supporting them) atomically, the served layout does not change.
+
 See the following PEP standards:
  * Simple Repository API:
     https://www.python.org/dev/peps/pep-0503/
@@ -14,13 +19,19 @@ See the following PEP standards:
 import os
 import sys
 import re
+import stat
+import hashlib
 import logging
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
 
 import click
 import daiquiri
 
-daiquiri.setup()
-
 _LOGGER = logging.getLogger(__name__)
 
 # Adjusted based on: https://www.python.org/dev/peps/pep-0427/
@@ -28,6 +39,10 @@ _WHEEL_RE = re.compile(
     "(?P<distribution>.+)-(?P<version>.+)(-(?P<build_tag>.+))?-(?P<python_tag>.+)-(?P<abi_tag>.+)-(?P<platform_tag>.+).whl"
 )
 
+_HASH_CHUNK_SIZE = 1024 * 1024
+# ioctl(2) request cloning a file on filesystems supporting reflinks (Btrfs, XFS), see ioctl_ficlone(2).
+_FICLONE = 0x40049409
+
 
 def _check_python_artifacts(package_dir: str) -> bool:
     """Check Python artifacts present in the corresponding package directory."""
@@ -142,6 +157,148 @@ def _check_platform_dir(path: str) -> bool:
     return any_error
 
 
+def _iter_wheels(path: str) -> Iterator[Tuple[str, os.stat_result]]:
+    """Iterate over wheels stored in platform/configuration/simple/package directories."""
+    for platform in sorted(os.listdir(path)):
+        platform_path = os.path.join(path, platform)
+        if not os.path.isdir(platform_path):
+            continue
+
+        for configuration in sorted(os.listdir(platform_path)):
+            simple_path = os.path.join(platform_path, configuration, "simple")
+            if not os.path.isdir(simple_path):
+                continue
+
+            for package in sorted(os.listdir(simple_path)):
+                package_dir = os.path.join(simple_path, package)
+                if not os.path.isdir(package_dir):
+                    continue
+
+                for entry in sorted(os.scandir(package_dir), key=lambda entry: entry.name):
+                    if entry.name.endswith(".whl") and entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+
+
+def _hash_file(path: str) -> str:
+    """Compute SHA-256 of the given file, reading it in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as artifact_file:
+        for chunk in iter(lambda: artifact_file.read(_HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _find_duplicates(path: str, jobs: int) -> List[List[List[Tuple[str, os.stat_result]]]]:
+    """Find byte-identical wheels, return groups of them with paths hardlinked to each wheel."""
+    # Wheels can be hardlinked only within a filesystem, group candidates by device and size.
+    candidates: Dict[Tuple[int, int], Dict[int, List[Tuple[str, os.stat_result]]]] = {}
+    for wheel_path, wheel_stat in _iter_wheels(path):
+        group = candidates.setdefault((wheel_stat.st_dev, wheel_stat.st_size), {})
+        group.setdefault(wheel_stat.st_ino, []).append((wheel_path, wheel_stat))
+
+    to_hash = [links for group in candidates.values() if len(group) > 1 for links in group.values()]
+    _LOGGER.info("Hashing %d wheels sharing their size with another wheel", len(to_hash))
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        digests = executor.map(_hash_file, (links[0][0] for links in to_hash))
+        groups: Dict[Tuple[int, str], List[List[Tuple[str, os.stat_result]]]] = {}
+        for links, digest in zip(to_hash, digests):
+            groups.setdefault((links[0][1].st_dev, digest), []).append(links)
+
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def _reflink(source: str, destination: str) -> None:
+    """Create destination sharing data blocks with source, fail if destination exists."""
+    import fcntl
+
+    with open(source, "rb") as source_file, open(destination, "xb") as destination_file:
+        try:
+            fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+        except BaseException:
+            os.unlink(destination)
+            raise
+
+
+def _check_unchanged(path: str, hashed_stat: os.stat_result) -> None:
+    """Check the given file was not replaced nor modified since it was hashed."""
+    current_stat = os.stat(path, follow_symlinks=False)
+    if (current_stat.st_ino, current_stat.st_size, current_stat.st_mtime_ns) != (
+        hashed_stat.st_ino,
+        hashed_stat.st_size,
+        hashed_stat.st_mtime_ns,
+    ):
+        raise RuntimeError(f"File {path!r} changed since it was hashed")
+
+
+def _replace_with_link(
+    source: str, source_stat: os.stat_result, duplicate: str, duplicate_stat: os.stat_result, link: str
+) -> None:
+    """Atomically replace duplicate with a hardlink or a reflink of source."""
+    _check_unchanged(source, source_stat)
+    _check_unchanged(duplicate, duplicate_stat)
+
+    directory, name = os.path.split(duplicate)
+    while True:
+        # Never reuse a file left behind by someone else, it is not ours to replace nor to remove.
+        tmp_path = os.path.join(directory, f".{name}.{secrets.token_hex(4)}.dedup")
+        try:
+            if link == "hardlink":
+                os.link(source, tmp_path)
+            else:
+                _reflink(source, tmp_path)
+        except FileExistsError:
+            continue
+        break
+
+    try:
+        if link != "hardlink":
+            os.chmod(tmp_path, stat.S_IMODE(duplicate_stat.st_mode))
+        os.replace(tmp_path, duplicate)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _deduplicate(path: str, jobs: int, link: str = None) -> bool:
+    """Report byte-identical wheels and the space reclaimable, optionally replace them with links."""
+    any_error = False
+    reclaimable = 0
+    reclaimed = 0
+    for group in _find_duplicates(path, jobs):
+        (source, source_stat), *_ = group[0]
+        reclaimable += source_stat.st_size * (len(group) - 1)
+        _LOGGER.info(
+            "Wheel %r (%d bytes) has %d duplicates: %r",
+            source,
+            source_stat.st_size,
+            len(group) - 1,
+            [duplicate for links in group[1:] for duplicate, _ in links],
+        )
+
+        if not link:
+            continue
+
+        for links in group[1:]:
+            # Space is reclaimed once all paths hardlinked to the duplicate are replaced.
+            replaced = True
+            for duplicate, duplicate_stat in links:
+                try:
+                    _replace_with_link(source, source_stat, duplicate, duplicate_stat, link)
+                except (OSError, RuntimeError) as exc:
+                    _LOGGER.error("Failed to replace %r with a %s: %s", duplicate, link, exc)
+                    any_error = True
+                    replaced = False
+
+            if replaced:
+                reclaimed += source_stat.st_size
+
+    _LOGGER.info("Duplicate wheels take %d bytes (%.1f MiB)", reclaimable, reclaimable / 1024 ** 2)
+    if link:
+        _LOGGER.info("Reclaimed %d bytes (%.1f MiB) using %ss", reclaimed, reclaimed / 1024 ** 2, link)
+
+    return any_error
+
+
 @click.command()
 @click.option(
     "--path",
@@ -149,9 +306,32 @@ def _check_platform_dir(path: str) -> bool:
     required=True,
     help="Path to a directory for which AICoE index should be checked.",
 )
-def cli(path: str):
+@click.option(
+    "--duplicates",
+    is_flag=True,
+    help="Report byte-identical wheels and space they take instead of checking the index structure.",
+)
+@click.option(
+    "--link",
+    type=click.Choice(["hardlink", "reflink"]),
+    help="Replace duplicate wheels found with hardlinks or reflinks, implies --duplicates.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    type=int,
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Number of wheels hashed in parallel.",
+)
+def cli(path: str, duplicates: bool, link: str, jobs: int):
     """A simple script to test AICoE Python index structure."""
-    any_error = _check_platform_dir(path)
+    if duplicates or link:
+        daiquiri.setup(level=logging.INFO)
+        any_error = _deduplicate(path, jobs, link)
+    else:
+        daiquiri.setup()
+        any_error = _check_platform_dir(path)
     sys.exit(1 if any_error else 0)
 
 
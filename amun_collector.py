@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+"""Collect results of scheduled Amun inspections.
+
+Inspections are polled concurrently with bounded concurrency. Each inspection
+keeps its own polling interval which grows while the inspection state does not
+change and is reset once a change is observed. Finished inspections are
+written to the output directory as soon as they complete, in the same format as
+inspection results stored in examples/runtime-environment.
+"""
+
+import os
+import sys
+import json
+import heapq
+import time
+import logging
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+import click
+import daiquiri
+
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
+from job_queue import JobQueue
+from job_queue import STATE_DONE
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_AMUN_API_URL = "http://amun-api-thoth-amun-api-stage.cloud.paas.psi.redhat.com/api/v1/inspect"
+
+_MIN_POLL_INTERVAL = 10.0
+_MAX_POLL_INTERVAL = 300.0
+_BACKOFF_FACTOR = 1.5
+
+
+def _inspection_url(amun_api_url: str, inspection_id: str, *parts: str) -> str:
+    """Construct URL to an inspection related endpoint."""
+    return "/".join([amun_api_url.rstrip("/"), inspection_id, *parts])
+
+
+def is_finished(status: Dict[str, Any]) -> bool:
+    """Check whether the inspection reached its final state based on status reported."""
+    job = status.get("job") or {}
+    if job.get("state") == "terminated":
+        return True
+
+    # The job is never run if the build fails.
+    build = status.get("build") or {}
+    return build.get("state") == "terminated" and build.get("exit_code") not in (0, None)
+
+
+def _get_json(url: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """Retrieve JSON from the given URL, return None if the resource is not available (yet)."""
+    response = get_client().get(url, timeout=timeout, retries=0)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
+def obtain_inspection_status(amun_api_url: str, inspection_id: str, *, timeout: float = 30.0) -> Dict[str, Any]:
+    """Obtain status of the given inspection."""
+    # Failures are not retried by the client, the collector backs off polling of the inspection instead.
+    response = get_client().get(_inspection_url(amun_api_url, inspection_id, "status"), timeout=timeout, retries=0)
+    response.raise_for_status()
+    return response.json().get("status") or {}
+
+
+def obtain_inspection_result(amun_api_url: str, inspection_id: str, *, timeout: float = 30.0) -> Dict[str, Any]:
+    """Obtain result of a finished inspection."""
+    status = obtain_inspection_status(amun_api_url, inspection_id, timeout=timeout)
+    build_log = _get_json(_inspection_url(amun_api_url, inspection_id, "build", "log"), timeout=timeout) or {}
+    job_log = _get_json(_inspection_url(amun_api_url, inspection_id, "job", "log"), timeout=timeout) or {}
+    specification = _get_json(_inspection_url(amun_api_url, inspection_id, "specification"), timeout=timeout) or {}
+
+    return {
+        "build_log": build_log.get("log"),
+        "inspection_id": inspection_id,
+        "job_log": job_log.get("log"),
+        "specification": specification.get("specification"),
+        "status": status,
+    }
+
+
+def store_inspection_result(output_dir: str, result: Dict[str, Any]) -> str:
+    """Store inspection result atomically into the output directory, return path to the stored file."""
+    path = os.path.join(output_dir, f"{result['inspection_id']}.json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as output_file:
+        json.dump(result, output_file, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    """Obtain Retry-After header value in seconds from an HTTP error, if any."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class _PollState:
+    """Polling state kept for an inspection being collected."""
+
+    __slots__ = ("inspection_id", "min_interval", "interval", "last_status", "errors")
+
+    def __init__(self, inspection_id: str, interval: float) -> None:
+        """Initialize polling state for the given inspection."""
+        self.inspection_id = inspection_id
+        self.min_interval = interval
+        self.interval = interval
+        self.last_status: Optional[Dict[str, Any]] = None
+        self.errors = 0
+
+
+@span("poll")
+def _poll(amun_api_url: str, output_dir: str, state: _PollState, timeout: float) -> bool:
+    """Poll the given inspection, store its result if finished; return True if the inspection is finished."""
+    status = obtain_inspection_status(amun_api_url, state.inspection_id, timeout=timeout)
+    changed = status != state.last_status
+    state.last_status = status
+    state.errors = 0
+
+    if not is_finished(status):
+        if changed:
+            state.interval = state.min_interval
+        else:
+            state.interval = min(state.interval * _BACKOFF_FACTOR, _MAX_POLL_INTERVAL)
+        return False
+
+    result = obtain_inspection_result(amun_api_url, state.inspection_id, timeout=timeout)
+    path = store_inspection_result(output_dir, result)
+    _LOGGER.info("Inspection %r finished, result stored in %r", state.inspection_id, path)
+    return True
+
+
+def collect_inspection_results(
+    amun_api_url: str,
+    inspection_ids: Iterable[str],
+    output_dir: str,
+    *,
+    concurrency: int = 16,
+    poll_interval: float = _MIN_POLL_INTERVAL,
+    max_errors: int = 10,
+    timeout: float = 30.0,
+) -> List[str]:
+    """Poll the given inspections until they finish, return inspection ids that failed to be collected."""
+    os.makedirs(output_dir, exist_ok=True)
+
+    queue = []
+    for inspection_id in dict.fromkeys(inspection_ids):
+        if os.path.exists(os.path.join(output_dir, f"{inspection_id}.json")):
+            _LOGGER.info("Result of inspection %r already collected, skipping", inspection_id)
+            continue
+        queue.append((time.monotonic(), inspection_id, _PollState(inspection_id, poll_interval)))
+    heapq.heapify(queue)
+
+    total = len(queue)
+    finished = 0
+    failed = []
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while queue or running:
+            now = time.monotonic()
+            while queue and queue[0][0] <= now and len(running) < concurrency:
+                _, _, state = heapq.heappop(queue)
+                future = executor.submit(_poll, amun_api_url, output_dir, state, timeout)
+                running[future] = state
+
+            wait_time = None
+            if queue and len(running) < concurrency:
+                wait_time = max(queue[0][0] - now, 0.0)
+
+            if not running:
+                time.sleep(wait_time or 0.0)
+                continue
+
+            done, _ = wait(running, timeout=wait_time, return_when=FIRST_COMPLETED)
+            for future in done:
+                state = running.pop(future)
+                try:
+                    if future.result():
+                        finished += 1
+                        _LOGGER.info("Collected %d/%d inspection results", finished, total)
+                        continue
+                except Exception as exc:
+                    state.errors += 1
+                    if state.errors >= max_errors:
+                        _LOGGER.error(
+                            "Giving up on inspection %r after %d errors: %s", state.inspection_id, state.errors, exc
+                        )
+                        failed.append(state.inspection_id)
+                        continue
+
+                    state.interval = max(
+                        _retry_after(exc) or 0.0, min(state.interval * 2, _MAX_POLL_INTERVAL)
+                    )
+                    _LOGGER.warning(
+                        "Failed to poll inspection %r (retrying in %.1fs): %s",
+                        state.inspection_id,
+                        state.interval,
+                        exc,
+                    )
+
+                heapq.heappush(queue, (time.monotonic() + state.interval, state.inspection_id, state))
+
+    return failed
+
+
+def read_inspection_ids(path: str) -> List[str]:
+    """Read inspection ids stored one per line in the given file."""
+    with open(path) as input_file:
+        return [line.strip() for line in input_file if line.strip()]
+
+
+def read_queued_inspection_ids(queue_path: str) -> List[str]:
+    """Read ids of inspections scheduled by draining a job queue."""
+    result = []
+    with JobQueue(queue_path) as job_queue:
+        for job in job_queue.iter_jobs(STATE_DONE):
+            content = json.loads(job["result"]) if job["result"] else None
+            if isinstance(content, dict) and "inspection_id" in content:
+                result.append(content["inspection_id"])
+
+    return result
+
+
+@click.command()
+@click.option(
+    "--amun-api-url",
+    "-a",
+    type=str,
+    default=DEFAULT_AMUN_API_URL,
+    show_default=True,
+    help="Amun API URL to talk to.",
+)
+@click.option(
+    "--inspection-ids-file",
+    "-i",
+    type=str,
+    help="A file with inspection ids to collect, one per line.",
+)
+@click.option(
+    "--queue",
+    "-q",
+    "queue_path",
+    type=str,
+    help="Collect inspections scheduled by draining the given job queue.",
+)
+@click.option(
+    "--output-dir",
+    "-o",
+    required=True,
+    type=str,
+    help="Directory where inspection results should be stored.",
+)
+@click.option(
+    "--concurrency",
+    "-c",
+    type=int,
+    default=16,
+    show_default=True,
+    help="Maximum number of inspections polled at the same time.",
+)
+@click.option(
+    "--poll-interval",
+    type=float,
+    default=_MIN_POLL_INTERVAL,
+    show_default=True,
+    help="Initial interval in seconds between status checks of an inspection.",
+)
+@click.argument("inspection_ids", nargs=-1)
+@instrumentation_options
+def cli(
+    amun_api_url: str,
+    inspection_ids_file: Optional[str],
+    queue_path: Optional[str],
+    output_dir: str,
+    concurrency: int,
+    poll_interval: float,
+    inspection_ids: List[str],
+):
+    """Poll scheduled inspections until they finish and store their results."""
+    daiquiri.setup(level=logging.INFO)
+    inspection_ids = list(inspection_ids)
+    if inspection_ids_file:
+        inspection_ids.extend(read_inspection_ids(inspection_ids_file))
+    if queue_path:
+        inspection_ids.extend(read_queued_inspection_ids(queue_path))
+
+    failed = collect_inspection_results(
+        amun_api_url,
+        inspection_ids,
+        output_dir,
+        concurrency=concurrency,
+        poll_interval=poll_interval,
+    )
+    get_client().metrics.log_summary()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+"""Generate load on Amun API inspect endpoint and measure its latency.
+
+Two modes are supported:
+ * closed-loop - a fixed number of workers submit inspections back to back
+ * open-loop - inspections are submitted at a fixed arrival rate regardless of
+   how fast the API responds; latency is measured from the scheduled submission
+   time so queueing on the client side is accounted for
+"""
+
+import sys
+import json
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import requests
+import click
+import daiquiri
+
+from http_client import HTTPClient
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_AMUN_API_URL = "http://amun-api-thoth-amun-api-stage.cloud.paas.psi.redhat.com/api/v1/inspect"
+
+# Upper bounds of latency histogram buckets in seconds.
+_HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+
+class LoadStatistics:
+    """Latencies and outcomes of requests sent during a load test."""
+
+    def __init__(self) -> None:
+        """Initialize empty statistics."""
+        self._lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.errors: Counter = Counter()
+        self.succeeded = 0
+
+    def record(self, latency: float, error: Optional[str] = None) -> None:
+        """Record outcome of a single request."""
+        with self._lock:
+            self.latencies.append(latency)
+            if error:
+                self.errors[error] += 1
+            else:
+                self.succeeded += 1
+
+    @staticmethod
+    def percentile(sorted_values: List[float], percent: float) -> Optional[float]:
+        """Compute percentile of the given sorted values using the nearest-rank method."""
+        if not sorted_values:
+            return None
+        rank = max(math.ceil(percent / 100 * len(sorted_values)), 1)
+        return sorted_values[rank - 1]
+
+    def to_dict(self, elapsed: float) -> Dict[str, Any]:
+        """Summarize statistics into a report."""
+        latencies = sorted(self.latencies)
+        histogram = []
+        count = 0
+        for bound in _HISTOGRAM_BUCKETS:
+            while count < len(latencies) and latencies[count] <= bound:
+                count += 1
+            histogram.append({"le": "+Inf" if bound == math.inf else bound, "count": count})
+
+        total = len(latencies)
+        return {
+            "requests": total,
+            "succeeded": self.succeeded,
+            "failed": total - self.succeeded,
+            "errors": dict(self.errors),
+            "elapsed": elapsed,
+            "throughput": total / elapsed if elapsed else None,
+            "latency": {
+                "min": latencies[0] if latencies else None,
+                "mean": sum(latencies) / total if total else None,
+                "p50": self.percentile(latencies, 50),
+                "p95": self.percentile(latencies, 95),
+                "p99": self.percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None,
+                "histogram": histogram,
+            },
+        }
+
+
+def _submit(client: HTTPClient, amun_api_url: str, specification: Dict[str, Any], timeout: float) -> Optional[str]:
+    """Submit a single inspection, return a description of the error if the request failed."""
+    try:
+        response = client.post(amun_api_url, json=specification, timeout=timeout)
+    except requests.RequestException as exc:
+        return exc.__class__.__name__
+
+    if response.status_code >= 400:
+        return f"HTTP {response.status_code}"
+
+    return None
+
+
+def run_closed_loop(
+    amun_api_url: str, specification: Dict[str, Any], *, requests_count: int, concurrency: int, timeout: float
+) -> Dict[str, Any]:
+    """Run a closed-loop load test: each worker sends a new request once the previous one is answered."""
+    statistics = LoadStatistics()
+    client = HTTPClient(retries=0, pool_size=concurrency)
+    remaining = iter(range(requests_count))
+    remaining_lock = threading.Lock()
+
+    def worker() -> None:
+        while True:
+            with remaining_lock:
+                if next(remaining, None) is None:
+                    return
+
+            start = time.monotonic()
+            error = _submit(client, amun_api_url, specification, timeout)
+            statistics.record(time.monotonic() - start, error)
+
+    start = time.monotonic()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return statistics.to_dict(time.monotonic() - start)
+
+
+def run_open_loop(
+    amun_api_url: str,
+    specification: Dict[str, Any],
+    *,
+    requests_count: int,
+    rate: float,
+    concurrency: int,
+    timeout: float,
+) -> Dict[str, Any]:
+    """Run an open-loop load test: requests arrive at a fixed rate, at most `concurrency' are in flight."""
+    statistics = LoadStatistics()
+    client = HTTPClient(retries=0, pool_size=concurrency)
+
+    def send(scheduled_at: float) -> None:
+        error = _submit(client, amun_api_url, specification, timeout)
+        statistics.record(time.monotonic() - scheduled_at, error)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for idx in range(requests_count):
+            scheduled_at = start + idx / rate
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, scheduled_at)
+
+    return statistics.to_dict(time.monotonic() - start)
+
+
+@click.command()
+@click.option(
+    "--amun-api-url",
+    "-a",
+    type=str,
+    default=DEFAULT_AMUN_API_URL,
+    show_default=True,
+    help="Amun API URL to talk to.",
+)
+@click.option(
+    "--specification",
+    "-s",
+    type=str,
+    default="./inspection.json",
+    show_default=True,
+    help="Inspection specification to be submitted.",
+)
+@click.option(
+    "--requests",
+    "-n",
+    "requests_count",
+    type=int,
+    default=301,
+    show_default=True,
+    help="Number of inspections to be submitted.",
+)
+@click.option(
+    "--concurrency",
+    "-c",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Number of workers (closed-loop) or maximum number of requests in flight (open-loop).",
+)
+@click.option(
+    "--rate",
+    "-r",
+    type=float,
+    help="Submit inspections at the given rate per second (open-loop mode); closed-loop mode is used if not set.",
+)
+@click.option(
+    "--timeout",
+    type=float,
+    default=60.0,
+    show_default=True,
+    help="Timeout in seconds for a single request.",
+)
+@click.option(
+    "--report",
+    "-o",
+    type=str,
+    help="Write the JSON report to the given file instead of standard output.",
+)
+def cli(
+    amun_api_url: str,
+    specification: str,
+    requests_count: int,
+    concurrency: int,
+    rate: Optional[float],
+    timeout: float,
+    report: Optional[str],
+):
+    """Measure how Amun API inspect endpoint copes with the given load."""
+    daiquiri.setup(level=logging.INFO)
+    with open(specification) as specification_file:
+        specification_content = json.load(specification_file)
+
+    if rate:
+        _LOGGER.info("Submitting %d inspections at %.2f/s to %r (open-loop)", requests_count, rate, amun_api_url)
+        result = run_open_loop(
+            amun_api_url,
+            specification_content,
+            requests_count=requests_count,
+            rate=rate,
+            concurrency=concurrency,
+            timeout=timeout,
+        )
+    else:
+        _LOGGER.info(
+            "Submitting %d inspections using %d workers to %r (closed-loop)", requests_count, concurrency, amun_api_url
+        )
+        result = run_closed_loop(
+            amun_api_url,
+            specification_content,
+            requests_count=requests_count,
+            concurrency=concurrency,
+            timeout=timeout,
+        )
+
+    result["mode"] = "open-loop" if rate else "closed-loop"
+    result["concurrency"] = concurrency
+    result["rate"] = rate
+    _LOGGER.info(
+        "Finished %d requests (%d failed), p50=%s p95=%s p99=%s",
+        result["requests"],
+        result["failed"],
+        result["latency"]["p50"],
+        result["latency"]["p95"],
+        result["latency"]["p99"],
+    )
+
+    if report:
+        with open(report, "w") as report_file:
+            json.dump(result, report_file, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+
+"""Benchmarks of hot paths of scripts in this repository.
+
+Benchmarks run on synthetic data generated on the fly so results are comparable
+across machines and revisions. Results are stored as JSON and two result files
+can be compared to spot regressions.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import logging
+import platform
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Tuple
+
+import click
+import daiquiri
+
+_LOGGER = logging.getLogger(__name__)
+
+_HERE = Path(__file__).resolve().parent
+
+# Registered benchmarks: name -> function preparing data and returning the callable to be timed.
+_BENCHMARKS: Dict[str, Callable[[str, bool], Callable[[], Any]]] = {}
+
+
+def benchmark(name: str) -> Callable:
+    """Register a benchmark; the decorated function prepares data and returns the callable to be timed."""
+
+    def wrapper(func: Callable[[str, bool], Callable[[], Any]]) -> Callable[[str, bool], Callable[[], Any]]:
+        _BENCHMARKS[name] = func
+        return func
+
+    return wrapper
+
+
+def load_script(file_name: str) -> Any:
+    """Load a script from this repository as a module, scripts can have names which are not valid identifiers."""
+    module_name = file_name[: -len(".py")].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(module_name, str(_HERE / file_name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _random_name(rnd: random.Random, length: int = 8) -> str:
+    """Generate a random package-like name."""
+    return "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(length))
+
+
+def _random_version(rnd: random.Random) -> str:
+    """Generate a random version string."""
+    return f"{rnd.randint(0, 9)}.{rnd.randint(0, 30)}.{rnd.randint(0, 20)}"
+
+
+def generate_wheel_names(count: int, seed: int = 42) -> List[str]:
+    """Generate wheel file names, roughly one in ten carries a build tag or a non-manylinux platform tag."""
+    rnd = random.Random(seed)
+    result = []
+    for _ in range(count):
+        build_tag = f"-{rnd.randint(1, 9)}" if rnd.random() < 0.1 else ""
+        platform_tag = "manylinux1_x86_64" if rnd.random() < 0.9 else "linux_x86_64"
+        result.append(
+            f"{_random_name(rnd)}-{_random_version(rnd)}{build_tag}-cp36-cp36m-{platform_tag}.whl"
+        )
+    return result
+
+
+def generate_aicoe_index(path: str, platforms: int, configurations: int, wheels: int, seed: int = 42) -> None:
+    """Generate an AICoE index tree with the given number of platforms, configurations and wheels per package."""
+    rnd = random.Random(seed)
+    for platform_idx in range(platforms):
+        for config_idx in range(configurations):
+            simple_dir = os.path.join(path, f"platform{platform_idx}", f"config{config_idx}", "simple")
+            for package_idx in range(max(wheels // 4, 1)):
+                package_dir = os.path.join(simple_dir, f"package{package_idx}")
+                os.makedirs(package_dir, exist_ok=True)
+                for _ in range(4):
+                    file_name = f"package{package_idx}-{_random_version(rnd)}-cp36-cp36m-manylinux1_x86_64.whl"
+                    Path(package_dir, file_name).touch()
+
+
+def generate_pipfile(packages: int, seed: int = 42) -> str:
+    """Generate Pipfile content with the given number of packages."""
+    rnd = random.Random(seed)
+    lines = [
+        "[[source]]",
+        'url = "https://pypi.org/simple"',
+        "verify_ssl = true",
+        'name = "pypi"',
+        "",
+        "[packages]",
+    ]
+    lines.extend(f'{_random_name(rnd)}{idx} = "=={_random_version(rnd)}"' for idx in range(packages))
+    lines.extend(["", "[dev-packages]", "", "[requires]", 'python_version = "3.6"', ""])
+    return "\n".join(lines)
+
+
+def generate_pipfile_lock(packages: int, seed: int = 42) -> Dict[str, Any]:
+    """Generate Pipfile.lock content with the given number of packages."""
+    rnd = random.Random(seed)
+    default = {}
+    for idx in range(packages):
+        default[f"{_random_name(rnd)}{idx}"] = {
+            "hashes": [f"sha256:{rnd.getrandbits(256):064x}" for _ in range(rnd.randint(1, 10))],
+            "index": "pypi",
+            "version": f"=={_random_version(rnd)}",
+        }
+
+    return {
+        "_meta": {
+            "hash": {"sha256": f"{rnd.getrandbits(256):064x}"},
+            "pipfile-spec": 6,
+            "requires": {"python_version": "3.6"},
+            "sources": [{"name": "pypi", "url": "https://pypi.org/simple", "verify_ssl": True}],
+        },
+        "default": default,
+        "develop": {},
+    }
+
+
+@contextmanager
+def _working_directory(path: str) -> Iterator[None]:
+    """Temporarily change working directory."""
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+@benchmark("aicoe_index_validation")
+def _bench_aicoe_index(tmp_dir: str, quick: bool) -> Callable[[], Any]:
+    """Validate a generated AICoE index tree."""
+    aicoe_index = load_script("aicoe-index.py")
+    index_path = os.path.join(tmp_dir, "index")
+    generate_aicoe_index(index_path, platforms=2 if quick else 5, configurations=5 if quick else 10, wheels=40)
+    return lambda: aicoe_index._check_platform_dir(index_path)
+
+
+def _bench_pipfile2dict(tmp_dir: str, packages: int, lock: bool) -> Callable[[], Any]:
+    """Convert a generated Pipfile or Pipfile.lock."""
+    pipefile2json = load_script("pipefile2json.py")
+    if lock:
+        path = os.path.join(tmp_dir, f"Pipfile-{packages}.lock")
+        with open(path, "w") as lock_file:
+            json.dump(generate_pipfile_lock(packages), lock_file, indent=4)
+    else:
+        path = os.path.join(tmp_dir, f"Pipfile-{packages}")
+        with open(path, "w") as pipfile:
+            pipfile.write(generate_pipfile(packages))
+
+    return lambda: pipefile2json.pipfile2dict(path)
+
+
+for _packages in (10, 100, 1000):
+    benchmark(f"pipfile2dict_pipfile_{_packages}")(
+        lambda tmp_dir, quick, _packages=_packages: _bench_pipfile2dict(tmp_dir, _packages, lock=False)
+    )
+    benchmark(f"pipfile2dict_lock_{_packages}")(
+        lambda tmp_dir, quick, _packages=_packages: _bench_pipfile2dict(tmp_dir, _packages, lock=True)
+    )
+
+
+@benchmark("wheel_re_match")
+def _bench_wheel_re(tmp_dir: str, quick: bool) -> Callable[[], Any]:
+    """Match generated wheel file names."""
+    aicoe_index = load_script("aicoe-index.py")
+    names = generate_wheel_names(10000 if quick else 100000)
+    return lambda: [aicoe_index._WHEEL_RE.fullmatch(name) for name in names]
+
+
+@benchmark("create_amun_api_input")
+def _bench_create_amun_api_input(tmp_dir: str, quick: bool) -> Callable[[], Any]:
+    """Build Amun specification, pipenv install is stubbed out."""
+    schedule = load_script("schedule_performance_benchmarks.py")
+    work_dir = os.path.join(tmp_dir, "spec")
+    os.makedirs(os.path.join(work_dir, "amun"), exist_ok=True)
+    shutil.copy(str(_HERE / "inspection.json"), work_dir)
+
+    def create_pipfile_and_pipfile_lock_inputs(
+        framework: str,
+        framework_version: str,
+        index_url: str,
+        lock_only: bool = False,
+        find_links: str = None,
+        on_locked: Callable[[dict], bool] = None,
+    ) -> bool:
+        # Stands in for pipenv lock and install, only the Pipfile and a generated Pipfile.lock are created.
+        amun_dir = os.path.join(work_dir, "amun")
+        schedule.create_pipfile(
+            index_url=index_url,
+            framework=framework,
+            framework_version=framework_version,
+            pipfile_path=os.path.join(amun_dir, "Pipfile"),
+        )
+        requirements_locked = generate_pipfile_lock(20)
+        with open(os.path.join(amun_dir, "Pipfile.lock"), "w") as lock_file:
+            json.dump(requirements_locked, lock_file)
+
+        if on_locked and not on_locked(requirements_locked):
+            return False
+        return True
+
+    schedule.create_pipfile_and_pipfile_lock_inputs = create_pipfile_and_pipfile_lock_inputs
+
+    def run() -> Any:
+        with _working_directory(work_dir):
+            return schedule.create_amun_api_input(
+                name_inspection="benchmark",
+                base_image="fedora:28",
+                native_packages="which,gcc",
+                python_packages="pipenv",
+                framework="tensorflow",
+                framework_version="1.13.1",
+                index_url="https://tensorflow.pypi.thoth-station.ninja/index/fedora28/jemalloc/simple",
+                benchmark="https://raw.githubusercontent.com/thoth-station/performance/master/tensorflow/matmul.py",
+            )
+
+    return run
+
+
+@benchmark("spec_validation")
+def _bench_spec_validation(tmp_dir: str, quick: bool) -> Callable[[], Any]:
+    """Validate a batch of Amun specifications differing in their Pipfile.lock."""
+    spec_validator = load_script("spec_validator.py")
+    with open(_HERE / "inspection.json") as specification_file:
+        template = specification_file.read()
+
+    specifications = []
+    for idx in range(1000 if quick else 10000):
+        specification = json.loads(template)
+        specification["python"]["requirements_locked"] = generate_pipfile_lock(20, seed=idx % 100)
+        specifications.append(specification)
+
+    return lambda: spec_validator.validate_specifications(specifications)
+
+
+@benchmark("inspection_result_parsing")
+def _bench_inspection_parsing(tmp_dir: str, quick: bool) -> Callable[[], Any]:
+    """Parse inspection results stored in examples."""
+    paths = sorted((_HERE / "examples" / "runtime-environment").glob("*.json"))
+
+    def run() -> Any:
+        result = []
+        for path in paths:
+            with open(path) as inspection_file:
+                result.append(json.load(inspection_file)["job_log"]["stdout"])
+        return result
+
+    return run
+
+
+def _bench_startup(args: List[str]) -> Callable[[], Any]:
+    """Start a new interpreter with the given arguments."""
+    return lambda: subprocess.run([sys.executable, *args], cwd=str(_HERE), stdout=subprocess.DEVNULL, check=True)
+
+
+# Bare interpreter start serves as a baseline for the startup benchmarks below.
+benchmark("startup_python")(lambda tmp_dir, quick: _bench_startup(["-c", "pass"]))
+benchmark("startup_misc_help")(lambda tmp_dir, quick: _bench_startup(["misc.py", "--help"]))
+benchmark("startup_misc_pipfile2json_help")(
+    lambda tmp_dir, quick: _bench_startup(["misc.py", "pipfile2json", "--help"])
+)
+benchmark("startup_misc_schedule_performance_benchmarks_help")(
+    lambda tmp_dir, quick: _bench_startup(["misc.py", "schedule-performance-benchmarks", "--help"])
+)
+
+
+def _time(func: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Time the given function, return statistics of the measured times in seconds."""
+    func()  # Warm up caches and lazy initialization.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+
+def run_benchmarks(names: List[str], repeat: int, quick: bool) -> Dict[str, Any]:
+    """Run the given benchmarks, return a report."""
+    results = {}
+    previous_disable = logging.root.manager.disable
+    logging.disable(logging.WARNING)
+    try:
+        for name in names:
+            with tempfile.TemporaryDirectory(prefix="thoth-bench-") as tmp_dir:
+                func = _BENCHMARKS[name](tmp_dir, quick)
+                results[name] = _time(func, repeat)
+            _LOGGER.warning("%s: median %.6fs", name, results[name]["median"])
+    finally:
+        logging.disable(previous_disable)
+
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "benchmarks": results,
+    }
+
+
+def compare_results(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Compare median times of two benchmark reports, return all comparisons and those considered regressions."""
+    comparisons = []
+    regressions = []
+    for name, result in current["benchmarks"].items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            continue
+
+        ratio = result["median"] / base["median"] if base["median"] else float("inf")
+        comparison = {"name": name, "baseline": base["median"], "current": result["median"], "ratio": ratio}
+        comparisons.append(comparison)
+        if ratio > 1 + threshold:
+            regressions.append(comparison)
+
+    return comparisons, regressions
+
+
+@click.group()
+def cli():
+    """Benchmark hot paths of scripts in this repository."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("list")
+def cli_list():
+    """List available benchmarks."""
+    for name in _BENCHMARKS:
+        print(name)
+
+
+@cli.command("run")
+@click.option("--output", "-o", type=str, help="Store results in the given file instead of printing them.")
+@click.option("--repeat", "-r", type=int, default=5, show_default=True, help="Number of timed runs of a benchmark.")
+@click.option("--quick", is_flag=True, help="Use smaller synthetic data sets.")
+@click.argument("names", nargs=-1)
+def cli_run(output: str, repeat: int, quick: bool, names: List[str]):
+    """Run benchmarks, all of them if no names are given."""
+    unknown = set(names) - set(_BENCHMARKS)
+    if unknown:
+        raise click.BadParameter(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = run_benchmarks(list(names) or list(_BENCHMARKS), repeat=repeat, quick=quick)
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+@cli.command("compare")
+@click.option(
+    "--threshold",
+    "-t",
+    type=float,
+    default=0.1,
+    show_default=True,
+    help="Relative slowdown of the median time considered a regression.",
+)
+@click.argument("baseline", type=str)
+@click.argument("current", type=str)
+def cli_compare(threshold: float, baseline: str, current: str):
+    """Compare two benchmark results, exit with non-zero status on regressions."""
+    with open(baseline) as baseline_file, open(current) as current_file:
+        comparisons, regressions = compare_results(json.load(baseline_file), json.load(current_file), threshold)
+
+    for comparison in comparisons:
+        flag = "REGRESSION" if comparison in regressions else ""
+        print(
+            f"{comparison['name']:<36} {comparison['baseline']:>12.6f}s {comparison['current']:>12.6f}s "
+            f"{comparison['ratio']:>7.2f}x {flag}"
+        )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    cli()
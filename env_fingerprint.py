@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""Fingerprints of locked software stacks used by inspections.
+
+A fingerprint identifies a locked environment - it is the sha256 of sorted
+`name==version@index_url' entries of packages in Pipfile.lock (the default
+section which is installed), with names canonicalized and indexes resolved to
+their URLs so that arbitrary source names do not matter. Fingerprints of
+inspection results are kept in an SQLite index mapping fingerprints to
+inspection ids; grouping inspections by stack is a lookup in that index and two
+stacks can be diffed package by package without loading inspection results.
+
+An inspection is considered measured by an earlier one only if, besides the
+environment, also the base image, native and Python packages installed into it,
+the script and the resources (including hardware) requested for the build and
+the run are the same.
+"""
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import hashlib
+import logging
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import click
+import daiquiri
+from packaging.utils import canonicalize_name
+
+from inspection_archive import iter_metadata
+from wave_scheduler import parse_cpu
+from wave_scheduler import parse_memory
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS environments (
+    fingerprint TEXT PRIMARY KEY,
+    entries TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inspections (
+    inspection_id TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL REFERENCES environments (fingerprint),
+    base TEXT,
+    packages TEXT NOT NULL,
+    script TEXT,
+    python_packages TEXT,
+    requests TEXT
+);
+CREATE INDEX IF NOT EXISTS inspections_fingerprint ON inspections (fingerprint);
+"""
+
+
+def environment_entries(requirements_locked: Dict[str, Any]) -> List[str]:
+    """Get sorted `name==version@index_url' entries of packages installed from Pipfile.lock."""
+    sources = {
+        source["name"]: source["url"].rstrip("/") for source in requirements_locked.get("_meta", {}).get("sources", [])
+    }
+    # Packages without an explicit index are installed from the first source.
+    default_index = next(iter(sources.values()), "")
+
+    entries = []
+    for name, entry in requirements_locked.get("default", {}).items():
+        version = (entry.get("version") or "*").lstrip("=")
+        index_url = sources.get(entry["index"], entry["index"]) if "index" in entry else default_index
+        entries.append(f"{canonicalize_name(name)}=={version}@{index_url}")
+
+    return sorted(entries)
+
+
+def fingerprint(entries: Iterable[str]) -> str:
+    """Compute fingerprint of an environment given its sorted entries."""
+    return hashlib.sha256("\n".join(entries).encode()).hexdigest()
+
+
+def environment_fingerprint(requirements_locked: Dict[str, Any]) -> str:
+    """Compute fingerprint of the environment locked in Pipfile.lock."""
+    return fingerprint(environment_entries(requirements_locked))
+
+
+def _parse_entry(entry: str) -> Tuple[str, str, str]:
+    """Split an entry into package name, version and index URL."""
+    name, _, rest = entry.partition("==")
+    version, _, index_url = rest.partition("@")
+    return name, version, index_url
+
+
+def diff_entries(old: Iterable[str], new: Iterable[str]) -> List[Dict[str, Optional[str]]]:
+    """List packages which were added, removed or changed their version or index between two environments."""
+    old_packages = {name: (version, index_url) for name, version, index_url in map(_parse_entry, old)}
+    new_packages = {name: (version, index_url) for name, version, index_url in map(_parse_entry, new)}
+
+    changes = []
+    for name in sorted(old_packages.keys() | new_packages.keys()):
+        old_version, old_index = old_packages.get(name, (None, None))
+        new_version, new_index = new_packages.get(name, (None, None))
+        if (old_version, old_index) != (new_version, new_index):
+            changes.append(
+                {
+                    "package_name": name,
+                    "old_version": old_version,
+                    "new_version": new_version,
+                    "old_index": old_index,
+                    "new_index": new_index,
+                }
+            )
+
+    return changes
+
+
+def _normalize_requests(requests: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize resources requested so that equal quantities written differently (e.g. 1 and 1000m) match."""
+    requests = dict(requests)
+    for key, parse in (("cpu", parse_cpu), ("memory", parse_memory)):
+        if key in requests:
+            try:
+                requests[key] = parse(requests[key])
+            except ValueError:
+                pass
+    return requests
+
+
+def _context(specification: Dict[str, Any]) -> Tuple[Optional[str], str, Optional[str], str, str]:
+    """Get base image, native packages, script, Python packages and resources requested, besides environment."""
+    packages = json.dumps(sorted(specification.get("packages") or []))
+    python_packages = json.dumps(sorted(specification.get("python_packages") or []))
+    requests = json.dumps(
+        {
+            phase: _normalize_requests((specification.get(phase) or {}).get("requests") or {})
+            for phase in ("build", "run")
+        },
+        sort_keys=True,
+    )
+    return specification.get("base"), packages, specification.get("script"), python_packages, requests
+
+
+class FingerprintIndex:
+    """An index of inspections by fingerprint of their locked environment; not to be shared across threads."""
+
+    def __init__(self, path: str) -> None:
+        """Open (and create if needed) the index stored in the given database file."""
+        self.path = path
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._connection.close()
+
+    def __enter__(self) -> "FingerprintIndex":
+        """Use the index as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the index when leaving the context."""
+        self.close()
+
+    def add_results(self, results: Iterable[Dict[str, Any]], batch_size: int = 1000) -> int:
+        """Index inspection results in batches, return number of inspections newly added."""
+        added = 0
+        batch = []
+        for result in results:
+            specification = result.get("specification") or {}
+            requirements_locked = (specification.get("python") or {}).get("requirements_locked")
+            if not requirements_locked:
+                _LOGGER.warning("Inspection %r has no locked requirements, skipping", result.get("inspection_id"))
+                continue
+
+            entries = environment_entries(requirements_locked)
+            digest = fingerprint(entries)
+            batch.append((result["inspection_id"], digest, entries, *_context(specification)))
+            if len(batch) >= batch_size:
+                added += self._add_batch(batch)
+                batch = []
+
+        if batch:
+            added += self._add_batch(batch)
+
+        return added
+
+    def _add_batch(self, batch: List[Tuple[Any, ...]]) -> int:
+        """Add a batch of inspections in a single transaction."""
+        self._connection.execute("BEGIN")
+        try:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO environments (fingerprint, entries) VALUES (?, ?)",
+                {(digest, json.dumps(entries)) for _, digest, entries, *_ in batch},
+            )
+            before = self._connection.total_changes
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO inspections "
+                "(inspection_id, fingerprint, base, packages, script, python_packages, requests) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(inspection_id, digest, *context) for inspection_id, digest, _, *context in batch],
+            )
+            added = self._connection.total_changes - before
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+
+        return added
+
+    def resolve(self, prefix: str) -> str:
+        """Get the full fingerprint given its unambiguous prefix."""
+        if not re.fullmatch(r"[0-9a-fA-F]+", prefix):
+            raise KeyError(f"Fingerprint prefix {prefix!r} is not hexadecimal")
+        rows = self._connection.execute(
+            "SELECT fingerprint FROM environments WHERE fingerprint GLOB ? LIMIT 2", (prefix.lower() + "*",)
+        ).fetchall()
+        if len(rows) != 1:
+            raise KeyError(f"Fingerprint prefix {prefix!r} is {'ambiguous' if rows else 'unknown'}")
+        return rows[0][0]
+
+    def entries(self, digest: str) -> List[str]:
+        """Get entries of the environment with the given fingerprint."""
+        row = self._connection.execute("SELECT entries FROM environments WHERE fingerprint = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(f"Fingerprint {digest!r} is unknown")
+        return json.loads(row[0])
+
+    def inspections(self, digest: str) -> List[str]:
+        """Get ids of inspections run in the environment with the given fingerprint."""
+        return [
+            row[0]
+            for row in self._connection.execute(
+                "SELECT inspection_id FROM inspections WHERE fingerprint = ? ORDER BY inspection_id", (digest,)
+            )
+        ]
+
+    def measured(self, specification: Dict[str, Any]) -> List[str]:
+        """Get ids of inspections run with the same environment, packages, script and resources requested."""
+        digest = environment_fingerprint(specification["python"]["requirements_locked"])
+        return [
+            row[0]
+            for row in self._connection.execute(
+                "SELECT inspection_id FROM inspections WHERE fingerprint = ? AND base IS ? AND packages IS ? "
+                "AND script IS ? AND python_packages IS ? AND requests IS ? ORDER BY inspection_id",
+                (digest, *_context(specification)),
+            )
+        ]
+
+    def groups(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over fingerprints and numbers of inspections run in them, most used first."""
+        yield from self._connection.execute(
+            "SELECT fingerprint, COUNT(*) AS count FROM inspections GROUP BY fingerprint ORDER BY count DESC"
+        )
+
+
+def _iter_results(paths: Iterable[str], archive: Optional[str]) -> Iterator[Dict[str, Any]]:
+    """Iterate over inspection results stored in files, directories of files or in an inspection archive."""
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json"))
+        else:
+            files = [path]
+
+        for file_path in files:
+            with open(file_path) as result_file:
+                yield json.load(result_file)
+
+    if archive:
+        for record in iter_metadata(archive):
+            yield record["result"]
+
+
+@click.group()
+def cli():
+    """Fingerprint locked environments of inspections and group inspections by them."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("index")
+@click.option("--index", "-i", "index_path", required=True, type=str, help="Path to the fingerprint index database.")
+@click.option("--archive", "-a", type=str, help="Index inspection results stored in an inspection archive.")
+@click.argument("paths", nargs=-1)
+def cli_index(index_path: str, archive: Optional[str], paths: List[str]):
+    """Index inspection results stored in JSON files or directories with them."""
+    with FingerprintIndex(index_path) as index:
+        added = index.add_results(_iter_results(paths, archive))
+    _LOGGER.info("Added %d inspections to index %r", added, index_path)
+
+
+@cli.command("fingerprint")
+@click.argument("path", type=str)
+def cli_fingerprint(path: str):
+    """Print fingerprint of an inspection result or a Pipfile.lock."""
+    with open(path) as input_file:
+        content = json.load(input_file)
+    if "specification" in content:
+        content = content["specification"]["python"]["requirements_locked"]
+    print(environment_fingerprint(content))
+
+
+@cli.command("groups")
+@click.option("--index", "-i", "index_path", required=True, type=str, help="Path to the fingerprint index database.")
+def cli_groups(index_path: str):
+    """Print fingerprints and numbers of inspections run in them, as JSON lines."""
+    with FingerprintIndex(index_path) as index:
+        for digest, count in index.groups():
+            print(json.dumps({"fingerprint": digest, "inspections": count}))
+
+
+@cli.command("lookup")
+@click.option("--index", "-i", "index_path", required=True, type=str, help="Path to the fingerprint index database.")
+@click.argument("fingerprint_prefix", type=str)
+def cli_lookup(index_path: str, fingerprint_prefix: str):
+    """Print ids of inspections run in the environment with the given fingerprint (or its prefix)."""
+    with FingerprintIndex(index_path) as index:
+        for inspection_id in index.inspections(index.resolve(fingerprint_prefix)):
+            print(inspection_id)
+
+
+@cli.command("diff")
+@click.option("--index", "-i", "index_path", required=True, type=str, help="Path to the fingerprint index database.")
+@click.argument("old", type=str)
+@click.argument("new", type=str)
+def cli_diff(index_path: str, old: str, new: str):
+    """Print packages which differ between two environments given by their fingerprints (or prefixes)."""
+    with FingerprintIndex(index_path) as index:
+        changes = diff_entries(index.entries(index.resolve(old)), index.entries(index.resolve(new)))
+    json.dump(changes, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -26,9 +26,39 @@ class NotInstalledIndexException(ScheduleInspectionException):
     """An exception raised if the packages was installed from a different source than requested."""
 
 
+class NotInstalledVersionException(ScheduleInspectionException):
+    """An exception raised if the package was installed in a different version than requested."""
+
+
+class PackageNotInstalledException(ScheduleInspectionException):
+    """An exception raised if the package or the virtual environment it should be installed in was not found."""
+
+
 class FileCreationException(ScheduleInspectionException):
     """An exception raised if the file was not found."""
 
 
 class ScriptFrameworkIncompatibilityException(ScheduleInspectionException):
     """An exception raised if the file was not found."""
+
+
+class ResolutionException(ScheduleInspectionException):
+    """An exception raised if dependencies cannot be resolved when creating Pipfile.lock."""
+
+
+class InvalidSpecificationException(ScheduleInspectionException):
+    """An exception raised if an inspection specification does not conform to the schema of Amun API."""
+
+
+class UnschedulableInspectionException(ScheduleInspectionException):
+    """An exception raised if resources requested by an inspection do not fit quotas declared."""
+
+
+class WaveSchedulingException(ScheduleInspectionException):
+    """An exception raised if inspections scheduled in waves were not all submitted or did not finish in time."""
+
+    def __init__(self, message: str, inspection_ids: list, unfinished: list) -> None:
+        """Keep ids of inspections scheduled and of the ones that did not finish, so results can be collected."""
+        super().__init__(message)
+        self.inspection_ids = inspection_ids
+        self.unfinished = unfinished
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""A shared HTTP client used by scripts talking to remote services.
+
+The client keeps connections alive in a pool, applies a default timeout to
+every request, retries failed requests with jittered exponential backoff
+(respecting Retry-After sent by the server) and records latency and status
+codes of requests per endpoint.
+
+Requests using methods which are not idempotent (e.g. POST scheduling an
+inspection) are retried only if the server certainly did not act on them - the
+connection could not be established, or the server asked to retry later with
+429 or with 503 carrying Retry-After. Otherwise a retry could create a second
+inspection or solver run. Callers can declare a request safe to repeat (passing
+idempotent=True) for endpoints where acting on it twice does no harm.
+"""
+
+import time
+import random
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = (10.0, 60.0)
+RETRY_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+class RequestMetrics:
+    """Latency and status codes of requests recorded per endpoint."""
+
+    def __init__(self) -> None:
+        """Initialize empty metrics."""
+        self._lock = threading.Lock()
+        self._endpoints: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def record(self, method: str, endpoint: str, status: str, duration: float) -> None:
+        """Record a single request (attempt) sent to the given endpoint."""
+        with self._lock:
+            entry = self._endpoints.get((method, endpoint))
+            if entry is None:
+                entry = self._endpoints[(method, endpoint)] = {
+                    "count": 0,
+                    "total_time": 0.0,
+                    "max_time": 0.0,
+                    "status": {},
+                }
+
+            entry["count"] += 1
+            entry["total_time"] += duration
+            entry["max_time"] = max(entry["max_time"], duration)
+            entry["status"][status] = entry["status"].get(status, 0) + 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Get a summary of recorded metrics."""
+        with self._lock:
+            return {
+                f"{method} {endpoint}": {
+                    **entry,
+                    "status": dict(entry["status"]),
+                    "mean_time": entry["total_time"] / entry["count"],
+                }
+                for (method, endpoint), entry in self._endpoints.items()
+            }
+
+    def log_summary(self, logger: logging.Logger = _LOGGER) -> None:
+        """Log a summary of recorded metrics."""
+        for endpoint, entry in sorted(self.to_dict().items()):
+            logger.info(
+                "%s: %d requests, mean %.3fs, max %.3fs, status codes %r",
+                endpoint,
+                entry["count"],
+                entry["mean_time"],
+                entry["max_time"],
+                entry["status"],
+            )
+
+
+def _endpoint(url: str) -> str:
+    """Get endpoint used as a key in metrics - URL without query string."""
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse Retry-After header value - either number of seconds or an HTTP date."""
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def not_sent(exc: requests.RequestException) -> bool:
+    """Check whether a request failed before it was sent, i.e. the connection could not be established."""
+    if isinstance(exc, requests.ConnectTimeout):
+        return True
+
+    # Connection refused or name not resolved - urllib3 NewConnectionError is a ConnectTimeoutError.
+    reason = getattr(exc.args[0], "reason", None) if exc.args else None
+    return isinstance(reason, ConnectTimeoutError)
+
+
+def retry_later(response: requests.Response) -> bool:
+    """Check whether the server refused to act on a request and asked to send it again later."""
+    return response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers)
+
+
+class HTTPClient:
+    """A pooled HTTP client with timeouts, retries and per-endpoint metrics."""
+
+    def __init__(
+        self,
+        *,
+        timeout: Any = DEFAULT_TIMEOUT,
+        retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 60.0,
+        retry_status_codes: Iterable[int] = RETRY_STATUS_CODES,
+        pool_size: int = 32,
+        metrics: Optional[RequestMetrics] = None,
+    ) -> None:
+        """Initialize the client."""
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_status_codes = frozenset(retry_status_codes)
+        self.metrics = metrics if metrics is not None else RequestMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Compute time to wait before the given retry attempt using exponential backoff with full jitter."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        retries: Optional[int] = None,
+        limiter: Any = None,
+        idempotent: Optional[bool] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """Send a request, retrying on connection errors and retryable status codes.
+
+        Requests using methods which are not idempotent are retried only if they were not acted on, unless
+        the caller states the request is idempotent.
+        The last response is returned even if its status code denotes an error, callers are expected to
+        call raise_for_status on it. If an adaptive limiter (see adaptive_limiter.py) is given, each attempt
+        waits for a free slot and reports its outcome to the limiter.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        retries = self.retries if retries is None else retries
+        endpoint = _endpoint(url)
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            token = limiter.acquire() if limiter is not None else None
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                self.metrics.record(method, endpoint, exc.__class__.__name__, time.monotonic() - start)
+                if token is not None:
+                    limiter.release(token, exc=exc)
+                if attempt >= retries or not (idempotent or not_sent(exc)):
+                    raise
+
+                delay = self.backoff(attempt)
+                _LOGGER.warning("Request %s %s failed (%s), retrying in %.2fs", method, endpoint, exc, delay)
+            except BaseException:
+                if token is not None:
+                    limiter.release(token, sample=False)
+                raise
+            else:
+                self.metrics.record(method, endpoint, str(response.status_code), time.monotonic() - start)
+                if token is not None:
+                    limiter.release(token, status_code=response.status_code)
+                if response.status_code not in self.retry_status_codes or attempt >= retries:
+                    return response
+                if not (idempotent or retry_later(response)):
+                    return response
+
+                delay = self.backoff(attempt, _parse_retry_after(response.headers.get("Retry-After")))
+                _LOGGER.warning(
+                    "Request %s %s responded with %d, retrying in %.2fs",
+                    method,
+                    endpoint,
+                    response.status_code,
+                    delay,
+                )
+
+            attempt += 1
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """Send a GET request."""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        """Send a POST request."""
+        return self.request("POST", url, **kwargs)
+
+    def head(self, url: str, **kwargs: Any) -> requests.Response:
+        """Send a HEAD request."""
+        return self.request("HEAD", url, **kwargs)
+
+
+_CLIENT: Optional[HTTPClient] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> HTTPClient:
+    """Get the HTTP client shared by all scripts in the process."""
+    global _CLIENT
+
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = HTTPClient()
+        return _CLIENT
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""Store inspection results in a compact archive with deduplicated build logs.
+
+Build logs make the vast majority of an inspection result and they are nearly
+identical across inspections run on the same base image. The archive keeps one
+reference build log and stores every other build log as a line-level delta
+against it. The rest of an inspection result is kept uncompressed in a JSON
+lines file which can be memory-mapped and scanned without touching the logs.
+
+Archive layout:
+  metadata.jsonl      - one inspection result per line, build_log left out
+  reference.log.xz    - the reference build log
+  logs/<id>.delta.xz  - build log of an inspection encoded against the reference
+
+Logs are stored byte for byte, line endings (e.g. carriage returns of progress
+bars) are kept as they are.
+"""
+
+import os
+import sys
+import json
+import lzma
+import mmap
+import bisect
+import hashlib
+import logging
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import click
+import daiquiri
+
+_LOGGER = logging.getLogger(__name__)
+
+_METADATA_FILE = "metadata.jsonl"
+_REFERENCE_FILE = "reference.log.xz"
+_LOGS_DIR = "logs"
+
+
+def encode_log(log: str, reference_lines: List[str]) -> List[list]:
+    """Encode log as a list of operations copying line ranges from the reference or inserting new lines."""
+    positions: Dict[str, List[int]] = {}
+    for idx, line in enumerate(reference_lines):
+        positions.setdefault(line, []).append(idx)
+
+    operations: List[list] = []
+    ref_pos = 0
+    for line in log.splitlines(keepends=True):
+        last = operations[-1] if operations else None
+        if last and last[0] == "c" and ref_pos < len(reference_lines) and reference_lines[ref_pos] == line:
+            last[2] += 1
+            ref_pos += 1
+            continue
+
+        candidates = positions.get(line)
+        if candidates:
+            # Prefer the closest occurrence after the current position to keep copies long.
+            idx = bisect.bisect_left(candidates, ref_pos)
+            ref_pos = candidates[idx] if idx < len(candidates) else candidates[0]
+            operations.append(["c", ref_pos, 1])
+            ref_pos += 1
+        elif last and last[0] == "i":
+            last[1].append(line)
+        else:
+            operations.append(["i", [line]])
+
+    return operations
+
+
+def decode_log(operations: List[list], reference_lines: List[str]) -> str:
+    """Reconstruct log from operations produced by encode_log."""
+    parts = []
+    for operation in operations:
+        if operation[0] == "c":
+            parts.extend(reference_lines[operation[1] : operation[1] + operation[2]])
+        else:
+            parts.extend(operation[1])
+
+    return "".join(parts)
+
+
+def _log_path(archive_path: str, inspection_id: str) -> str:
+    """Get path to a stored build log delta of an inspection."""
+    return os.path.join(archive_path, _LOGS_DIR, f"{inspection_id}.delta.xz")
+
+
+def _load_reference_lines(archive_path: str) -> Optional[List[str]]:
+    """Load lines of the reference build log, return None if no reference is stored yet."""
+    reference_path = os.path.join(archive_path, _REFERENCE_FILE)
+    if not os.path.exists(reference_path):
+        return None
+
+    with lzma.open(reference_path, "rt", newline="") as reference_file:
+        return reference_file.read().splitlines(keepends=True)
+
+
+def _store_reference(archive_path: str, log: str) -> List[str]:
+    """Store the given build log as the reference log of the archive."""
+    reference_path = os.path.join(archive_path, _REFERENCE_FILE)
+    with lzma.open(reference_path, "wt", preset=9 | lzma.PRESET_EXTREME, newline="") as reference_file:
+        reference_file.write(log)
+
+    return log.splitlines(keepends=True)
+
+
+def iter_metadata(archive_path: str) -> Iterator[Dict[str, Any]]:
+    """Iterate over inspection results stored in the archive, without their build logs."""
+    metadata_path = os.path.join(archive_path, _METADATA_FILE)
+    if not os.path.exists(metadata_path) or os.path.getsize(metadata_path) == 0:
+        return
+
+    with open(metadata_path, "rb") as metadata_file, mmap.mmap(
+        metadata_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as content:
+        for line in iter(content.readline, b""):
+            yield json.loads(line)
+
+
+def archive_inspection_results(archive_path: str, results: Iterable[Dict[str, Any]]) -> int:
+    """Add inspection results to the archive, return number of results added."""
+    os.makedirs(os.path.join(archive_path, _LOGS_DIR), exist_ok=True)
+    archived = {record["inspection_id"] for record in iter_metadata(archive_path)}
+    reference_lines = _load_reference_lines(archive_path)
+
+    added = 0
+    with open(os.path.join(archive_path, _METADATA_FILE), "a") as metadata_file:
+        for result in results:
+            inspection_id = result["inspection_id"]
+            if inspection_id in archived:
+                _LOGGER.info("Inspection %r is already archived, skipping", inspection_id)
+                continue
+
+            build_log = result.get("build_log")
+            log_sha256 = None
+            if build_log is not None:
+                if reference_lines is None:
+                    _LOGGER.info("Using build log of inspection %r as the reference log", inspection_id)
+                    reference_lines = _store_reference(archive_path, build_log)
+
+                operations = encode_log(build_log, reference_lines)
+                if decode_log(operations, reference_lines) != build_log:
+                    raise ValueError(f"Build log of inspection {inspection_id!r} cannot be reconstructed")
+
+                with lzma.open(_log_path(archive_path, inspection_id), "wt", newline="") as log_file:
+                    json.dump(operations, log_file, separators=(",", ":"))
+
+                log_sha256 = hashlib.sha256(build_log.encode()).hexdigest()
+
+            # Keep the key in place so the original key order is preserved on extraction.
+            metadata = dict(result)
+            if "build_log" in metadata:
+                metadata["build_log"] = None
+
+            record = {"inspection_id": inspection_id, "build_log_sha256": log_sha256, "result": metadata}
+            metadata_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            archived.add(inspection_id)
+            added += 1
+
+    return added
+
+
+def extract_inspection_result(archive_path: str, inspection_id: str) -> Dict[str, Any]:
+    """Reconstruct the original inspection result stored in the archive."""
+    for record in iter_metadata(archive_path):
+        if record["inspection_id"] == inspection_id:
+            break
+    else:
+        raise KeyError(f"Inspection {inspection_id!r} not found in archive {archive_path!r}")
+
+    result = record["result"]
+    if record["build_log_sha256"] is None:
+        return result
+
+    with lzma.open(_log_path(archive_path, inspection_id), "rt", newline="") as log_file:
+        operations = json.load(log_file)
+
+    build_log = decode_log(operations, _load_reference_lines(archive_path))
+    if hashlib.sha256(build_log.encode()).hexdigest() != record["build_log_sha256"]:
+        raise ValueError(f"Build log of inspection {inspection_id!r} does not match the stored digest")
+
+    result["build_log"] = build_log
+    return result
+
+
+def _load_results(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Load inspection results from the given files."""
+    for path in paths:
+        with open(path) as input_file:
+            yield json.load(input_file)
+
+
+@click.group()
+def cli():
+    """Work with archives of inspection results."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("add")
+@click.option("--archive", "-a", required=True, type=str, help="Path to the archive directory.")
+@click.argument("paths", nargs=-1, required=True)
+def cli_add(archive: str, paths: List[str]):
+    """Add inspection results stored in JSON files to the archive."""
+    added = archive_inspection_results(archive, _load_results(paths))
+    _LOGGER.info("Added %d inspection results to archive %r", added, archive)
+
+
+@cli.command("extract")
+@click.option("--archive", "-a", required=True, type=str, help="Path to the archive directory.")
+@click.argument("inspection_id", type=str)
+def cli_extract(archive: str, inspection_id: str):
+    """Print the original inspection result stored in the archive."""
+    json.dump(extract_inspection_result(archive, inspection_id), sys.stdout, indent=2)
+
+
+@cli.command("list")
+@click.option("--archive", "-a", required=True, type=str, help="Path to the archive directory.")
+def cli_list(archive: str):
+    """List inspections stored in the archive."""
+    for record in iter_metadata(archive):
+        print(record["inspection_id"])
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+"""Timing of phases of scheduling scripts and export of collected metrics.
+
+Phases are timed using span() which can be used as a context manager or as a
+decorator. Collected timings, together with HTTP request metrics recorded by
+the shared HTTP client and gauges set using set_gauge(), are written at exit
+either in Prometheus text exposition format or as JSON. Optionally, the whole
+run can be profiled using cProfile.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import cProfile
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+
+import click
+
+from http_client import get_client
+
+_LOGGER = logging.getLogger(__name__)
+
+_METRIC_PREFIX = "thoth_misc"
+
+
+class PhaseTimings:
+    """Durations of instrumented phases."""
+
+    def __init__(self) -> None:
+        """Initialize empty timings."""
+        self._lock = threading.Lock()
+        self._phases: Dict[str, Dict[str, float]] = {}
+
+    def record(self, phase: str, duration: float, failed: bool = False) -> None:
+        """Record a single run of a phase."""
+        with self._lock:
+            entry = self._phases.get(phase)
+            if entry is None:
+                entry = self._phases[phase] = {
+                    "count": 0,
+                    "failed": 0,
+                    "total_time": 0.0,
+                    "min_time": duration,
+                    "max_time": 0.0,
+                }
+
+            entry["count"] += 1
+            entry["failed"] += int(failed)
+            entry["total_time"] += duration
+            entry["min_time"] = min(entry["min_time"], duration)
+            entry["max_time"] = max(entry["max_time"], duration)
+
+    def to_dict(self) -> Dict[str, Dict[str, float]]:
+        """Get a copy of recorded timings."""
+        with self._lock:
+            return {phase: dict(entry) for phase, entry in self._phases.items()}
+
+
+_TIMINGS = PhaseTimings()
+
+_GAUGES: Dict[str, float] = {}
+_GAUGES_LOCK = threading.Lock()
+
+
+def get_timings() -> PhaseTimings:
+    """Get timings of phases recorded in the process."""
+    return _TIMINGS
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Set current value of a gauge exported with other metrics."""
+    with _GAUGES_LOCK:
+        _GAUGES[name] = value
+
+
+@contextmanager
+def _span(phase: str) -> Iterator[None]:
+    """Time the enclosed block."""
+    start = time.monotonic()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        _TIMINGS.record(phase, time.monotonic() - start, failed=failed)
+
+
+class span:
+    """Time a phase, usable as a context manager or as a function decorator."""
+
+    def __init__(self, phase: str) -> None:
+        """Create a span for the given phase."""
+        self.phase = phase
+        self._context = None
+
+    def __enter__(self) -> None:
+        """Start timing."""
+        self._context = _span(self.phase)
+        self._context.__enter__()
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Stop timing."""
+        self._context.__exit__(*exc_info)
+
+    def __call__(self, func: Callable) -> Callable:
+        """Time each call of the decorated function."""
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with _span(self.phase):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    """Format Prometheus labels."""
+    return ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items())
+
+
+def metrics_to_dict(script: str) -> Dict[str, Any]:
+    """Get all metrics collected in the process."""
+    return {
+        "script": script,
+        "timestamp": time.time(),
+        "phases": _TIMINGS.to_dict(),
+        "http": get_client().metrics.to_dict(),
+        "gauges": dict(_GAUGES),
+    }
+
+
+def metrics_to_prometheus(script: str) -> str:
+    """Format all metrics collected in the process in Prometheus text exposition format."""
+    metrics = metrics_to_dict(script)
+    lines = []
+
+    name = f"{_METRIC_PREFIX}_phase_duration_seconds"
+    lines.append(f"# HELP {name} Time spent in instrumented phases.")
+    lines.append(f"# TYPE {name} summary")
+    for phase, entry in sorted(metrics["phases"].items()):
+        labels = _labels(script=script, phase=phase)
+        lines.append(f"{name}_count{{{labels}}} {entry['count']}")
+        lines.append(f"{name}_sum{{{labels}}} {entry['total_time']}")
+
+    name = f"{_METRIC_PREFIX}_phase_failures_total"
+    lines.append(f"# HELP {name} Number of instrumented phases which ended with an exception.")
+    lines.append(f"# TYPE {name} counter")
+    for phase, entry in sorted(metrics["phases"].items()):
+        lines.append(f"{name}{{{_labels(script=script, phase=phase)}}} {entry['failed']}")
+
+    name = f"{_METRIC_PREFIX}_http_request_duration_seconds"
+    lines.append(f"# HELP {name} Time spent in HTTP requests per endpoint.")
+    lines.append(f"# TYPE {name} summary")
+    for endpoint, entry in sorted(metrics["http"].items()):
+        method, url = endpoint.split(" ", maxsplit=1)
+        labels = _labels(script=script, method=method, endpoint=url)
+        lines.append(f"{name}_count{{{labels}}} {entry['count']}")
+        lines.append(f"{name}_sum{{{labels}}} {entry['total_time']}")
+
+    name = f"{_METRIC_PREFIX}_http_requests_total"
+    lines.append(f"# HELP {name} Number of HTTP requests per endpoint and status.")
+    lines.append(f"# TYPE {name} counter")
+    for endpoint, entry in sorted(metrics["http"].items()):
+        method, url = endpoint.split(" ", maxsplit=1)
+        for status, count in sorted(entry["status"].items()):
+            lines.append(f"{name}{{{_labels(script=script, method=method, endpoint=url, status=status)}}} {count}")
+
+    for gauge, value in sorted(metrics["gauges"].items()):
+        name = f"{_METRIC_PREFIX}_{gauge}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name}{{{_labels(script=script)}}} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def export_metrics(path: str, script: Optional[str] = None) -> None:
+    """Write collected metrics to the given file, Prometheus text format is used unless the file ends with .json."""
+    script = script or os.path.basename(sys.argv[0])
+    if path.endswith(".json"):
+        content = json.dumps(metrics_to_dict(script), indent=2)
+    else:
+        content = metrics_to_prometheus(script)
+
+    # Write atomically so that a collector (e.g. node exporter textfile collector) never reads a partial file.
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as metrics_file:
+        metrics_file.write(content)
+    os.replace(tmp_path, path)
+    _LOGGER.info("Metrics written to %r", path)
+
+
+def setup_instrumentation(metrics_file: Optional[str] = None, profile_file: Optional[str] = None) -> None:
+    """Export metrics and profiling data, if requested, at exit."""
+    if profile_file:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def _dump_profile() -> None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+            _LOGGER.info("Profiling data written to %r", profile_file)
+
+        atexit.register(_dump_profile)
+
+    if metrics_file:
+        atexit.register(export_metrics, metrics_file)
+
+
+def instrumentation_options(func: Callable) -> Callable:
+    """Add options to a click command which turn on metrics export and profiling."""
+
+    @click.option(
+        "--metrics-file",
+        type=str,
+        envvar="THOTH_METRICS_FILE",
+        help="Write phase timings and HTTP metrics at exit, as JSON if the file ends with .json, "
+        "in Prometheus text format otherwise.",
+    )
+    @click.option(
+        "--profile",
+        "profile_file",
+        type=str,
+        envvar="THOTH_PROFILE_FILE",
+        help="Profile the run using cProfile and store profiling data in the given file.",
+    )
+    @functools.wraps(func)
+    def wrapper(*args: Any, metrics_file: Optional[str], profile_file: Optional[str], **kwargs: Any) -> Any:
+        setup_instrumentation(metrics_file=metrics_file, profile_file=profile_file)
+        return func(*args, **kwargs)
+
+    return wrapper
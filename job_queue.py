@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+"""A durable local job queue backed by SQLite and a worker pool draining it.
+
+Schedulers enqueue jobs instead of submitting requests directly. Each job
+carries an idempotency key so enqueueing the same work twice (e.g. when a
+scheduler is re-run after a crash) is a no-op. Workers claim jobs with a lease,
+so jobs claimed by a worker which died are picked up again once the lease
+expires. Each claim gets a token, a worker whose job was claimed again in the
+meantime cannot complete nor fail it. Failed jobs are retried with exponential
+backoff and moved to the dead-letter state once they run out of attempts.
+
+Jobs are delivered at least once - a job whose worker died or outlived its
+lease is run again. HTTP jobs sending requests which are not idempotent (e.g.
+POST scheduling an inspection) are therefore retried only if the request was
+certainly not acted on. If it may have been (a read timeout, a 5xx response),
+the job is dead-lettered rather than retried, to be requeued by hand once it is
+known the request did not take effect. Payloads of requests safe to repeat can
+state "idempotent": true to be retried as usual.
+Number of jobs run at the same time is adapted to latency and errors observed
+by an adaptive limiter.
+"""
+
+import sys
+import json
+import time
+import random
+import secrets
+import sqlite3
+import logging
+import threading
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+import click
+import daiquiri
+import requests
+
+from adaptive_limiter import AdaptiveLimiter
+from adaptive_limiter import limiter_options
+from http_client import IDEMPOTENT_METHODS
+from http_client import get_client
+from http_client import not_sent
+from http_client import retry_later
+from instrumentation import instrumentation_options
+from instrumentation import span
+
+_LOGGER = logging.getLogger(__name__)
+
+STATE_PENDING = "pending"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_DEAD = "dead"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    lease_token TEXT,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state_available_at ON jobs (state, available_at);
+"""
+
+# Job kind -> function executing the job payload and returning a JSON serializable result.
+_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+
+
+class PermanentJobError(Exception):
+    """An exception raised by job handlers if retrying the job cannot help."""
+
+
+def job_handler(kind: str) -> Callable:
+    """Register a handler for jobs of the given kind."""
+
+    def wrapper(func: Callable[[Dict[str, Any]], Any]) -> Callable[[Dict[str, Any]], Any]:
+        _HANDLERS[kind] = func
+        return func
+
+    return wrapper
+
+
+@job_handler("http")
+def _run_http_job(payload: Dict[str, Any]) -> Any:
+    """Send an HTTP request described by the job payload."""
+    method = payload.get("method", "POST")
+    idempotent = payload.get("idempotent")
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+
+    # The queue retries jobs itself, a single attempt is made per job run.
+    try:
+        response = get_client().request(
+            method,
+            payload["url"],
+            json=payload.get("json"),
+            params=payload.get("params"),
+            headers=payload.get("headers"),
+            retries=0,
+            idempotent=idempotent,
+        )
+    except (requests.ConnectionError, requests.Timeout) as exc:
+        if idempotent or not_sent(exc):
+            raise
+        raise PermanentJobError(f"{method} request may have been acted on, not retried: {exc}") from exc
+
+    if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+        raise PermanentJobError(f"HTTP {response.status_code}: {response.text[:500]}")
+    if response.status_code >= 500 and not (idempotent or retry_later(response)):
+        raise PermanentJobError(
+            f"{method} request may have been acted on, not retried: HTTP {response.status_code}: {response.text[:500]}"
+        )
+    response.raise_for_status()
+
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+class JobQueue:
+    """A job queue stored in an SQLite database; an instance must not be shared across threads."""
+
+    def __init__(self, path: str, *, lease: float = 300.0, backoff_base: float = 5.0, backoff_max: float = 600.0):
+        """Open (and create if needed) the queue stored in the given database file."""
+        self.path = path
+        self.lease = lease
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._connection = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._connection.close()
+
+    def __enter__(self) -> "JobQueue":
+        """Use the queue as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the queue when leaving the context."""
+        self.close()
+
+    def enqueue(self, idempotency_key: str, kind: str, payload: Dict[str, Any], *, max_attempts: int = 5) -> bool:
+        """Add a job to the queue, return False if a job with the same idempotency key was already enqueued."""
+        if kind not in _HANDLERS:
+            raise ValueError(f"No handler registered for jobs of kind {kind!r}")
+
+        now = time.time()
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO jobs "
+            "(idempotency_key, kind, payload, state, max_attempts, available_at, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (idempotency_key, kind, json.dumps(payload), STATE_PENDING, max_attempts, now, now, now),
+        )
+        return cursor.rowcount == 1
+
+    def claim(self) -> Optional[sqlite3.Row]:
+        """Claim a job ready to be run, return None if there is no such job.
+
+        The job returned carries the token of the claim, it is needed to complete or fail the job.
+        """
+        now = time.time()
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE (state = ? AND available_at <= ?) OR (state = ? AND lease_until < ?) "
+                "ORDER BY available_at LIMIT 1",
+                (STATE_PENDING, now, STATE_RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, lease_until = ?, lease_token = ?, "
+                    "updated_at = ? WHERE id = ?",
+                    (STATE_RUNNING, now + self.lease, secrets.token_hex(16), now, row["id"]),
+                )
+                row = self._connection.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+
+        return row
+
+    def complete(self, job: sqlite3.Row, result: Any) -> bool:
+        """Mark the given claimed job as done, return False if the claim was lost to another worker."""
+        cursor = self._connection.execute(
+            "UPDATE jobs SET state = ?, result = ?, lease_until = NULL, lease_token = NULL, last_error = NULL, "
+            "updated_at = ? WHERE id = ? AND state = ? AND lease_token = ?",
+            (STATE_DONE, json.dumps(result), time.time(), job["id"], STATE_RUNNING, job["lease_token"]),
+        )
+        return cursor.rowcount == 1
+
+    def fail(self, job: sqlite3.Row, error: str, *, permanent: bool = False) -> Optional[str]:
+        """Record failure of the given claimed job, return its new state or None if the claim was lost."""
+        now = time.time()
+        if permanent or job["attempts"] >= job["max_attempts"]:
+            state, available_at = STATE_DEAD, now
+        else:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (job["attempts"] - 1))
+            state, available_at = STATE_PENDING, now + random.uniform(delay / 2, delay)
+
+        cursor = self._connection.execute(
+            "UPDATE jobs SET state = ?, available_at = ?, lease_until = NULL, lease_token = NULL, last_error = ?, "
+            "updated_at = ? WHERE id = ? AND state = ? AND lease_token = ?",
+            (state, available_at, error, now, job["id"], STATE_RUNNING, job["lease_token"]),
+        )
+        return state if cursor.rowcount == 1 else None
+
+    def next_available_at(self) -> Optional[float]:
+        """Get time at which the next job becomes ready, None if there is no job left to be run."""
+        row = self._connection.execute(
+            "SELECT MIN(CASE WHEN state = ? THEN available_at ELSE lease_until END) FROM jobs WHERE state IN (?, ?)",
+            (STATE_PENDING, STATE_PENDING, STATE_RUNNING),
+        ).fetchone()
+        return row[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Get number of jobs in each state."""
+        rows = self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def iter_jobs(self, state: Optional[str] = None) -> Iterator[sqlite3.Row]:
+        """Iterate over jobs, optionally only over jobs in the given state."""
+        if state:
+            yield from self._connection.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id", (state,))
+        else:
+            yield from self._connection.execute("SELECT * FROM jobs ORDER BY id")
+
+    def requeue_dead(self) -> int:
+        """Move dead-lettered jobs back to the queue with a fresh attempt budget, return their number."""
+        cursor = self._connection.execute(
+            "UPDATE jobs SET state = ?, attempts = 0, available_at = ?, updated_at = ? WHERE state = ?",
+            (STATE_PENDING, time.time(), time.time(), STATE_DEAD),
+        )
+        return cursor.rowcount
+
+
+def run_job(job: sqlite3.Row) -> Tuple[Any, Optional[Exception]]:
+    """Run the given job, return a tuple (result, exception raised by the job handler if it failed)."""
+    handler = _HANDLERS.get(job["kind"])
+    if handler is None:
+        return None, PermanentJobError(f"No handler registered for jobs of kind {job['kind']!r}")
+
+    try:
+        with span(f"job_{job['kind']}"):
+            return handler(json.loads(job["payload"])), None
+    except Exception as exc:
+        return None, exc
+
+
+def _worker(
+    path: str, stop: threading.Event, keep_running: bool, poll_interval: float, limiter: Optional[AdaptiveLimiter]
+) -> None:
+    """Claim and run jobs until the queue is drained or the worker is stopped."""
+    with JobQueue(path) as queue:
+        while not stop.is_set():
+            token = limiter.acquire(stop) if limiter is not None else None
+            if limiter is not None and token is None:
+                return
+
+            job = queue.claim()
+            if job is None:
+                if token is not None:
+                    limiter.release(token, sample=False)
+                next_available_at = queue.next_available_at()
+                if next_available_at is None and not keep_running:
+                    return
+                delay = poll_interval if next_available_at is None else next_available_at - time.time()
+                stop.wait(min(max(delay, 0.01), poll_interval))
+                continue
+
+            result, exc = run_job(job)
+            if token is not None:
+                limiter.release(token, exc=exc)
+
+            if exc is None:
+                if queue.complete(job, result):
+                    _LOGGER.info("Job %r finished", job["idempotency_key"])
+                else:
+                    _LOGGER.error(
+                        "Job %r finished after its lease expired and it was claimed again, result discarded: %r",
+                        job["idempotency_key"],
+                        result,
+                    )
+                continue
+
+            error = str(exc) if isinstance(exc, PermanentJobError) else f"{exc.__class__.__name__}: {exc}"
+            state = queue.fail(job, error, permanent=isinstance(exc, PermanentJobError))
+            if state is None:
+                _LOGGER.warning(
+                    "Job %r failed after its lease expired and it was claimed again: %s", job["idempotency_key"], error
+                )
+                continue
+            log = _LOGGER.error if state == STATE_DEAD else _LOGGER.warning
+            log("Job %r failed (attempt %d, now %s): %s", job["idempotency_key"], job["attempts"], state, error)
+
+
+def drain(
+    path: str,
+    *,
+    workers: int = 4,
+    keep_running: bool = False,
+    poll_interval: float = 1.0,
+    limiter: Optional[AdaptiveLimiter] = None,
+) -> Dict[str, int]:
+    """Run jobs stored in the queue using a pool of workers, return number of jobs in each state once finished.
+
+    If an adaptive limiter is given, it bounds the number of workers running a job at the same time.
+    """
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_worker, args=(path, stop, keep_running, poll_interval, limiter), daemon=True)
+        for _ in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1.0)
+    except KeyboardInterrupt:
+        _LOGGER.warning("Interrupted, waiting for running jobs to finish")
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    with JobQueue(path) as queue:
+        return queue.stats()
+
+
+@click.group()
+def cli():
+    """Work with a durable queue of scheduling jobs."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("drain")
+@click.option("--queue", "-q", "queue_path", required=True, type=str, help="Path to the queue database.")
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    help="Number of workers running jobs, the adaptive limit never exceeds it; defaults to --max-concurrency.",
+)
+@click.option("--keep-running", is_flag=True, help="Wait for new jobs instead of exiting once the queue is drained.")
+@limiter_options
+@instrumentation_options
+def cli_drain(queue_path: str, workers: Optional[int], keep_running: bool, limiter: AdaptiveLimiter):
+    """Run jobs stored in the queue, as many at the same time as the server copes with."""
+    stats = drain(queue_path, workers=workers or limiter.max_limit, keep_running=keep_running, limiter=limiter)
+    _LOGGER.info("Queue drained: %r, adaptive limiter: %r", stats, limiter.to_dict())
+    get_client().metrics.log_summary()
+    sys.exit(1 if stats.get(STATE_DEAD) else 0)
+
+
+@cli.command("stats")
+@click.option("--queue", "-q", "queue_path", required=True, type=str, help="Path to the queue database.")
+def cli_stats(queue_path: str):
+    """Print number of jobs in each state."""
+    with JobQueue(queue_path) as queue:
+        json.dump(queue.stats(), sys.stdout, indent=2)
+
+
+@cli.command("list")
+@click.option("--queue", "-q", "queue_path", required=True, type=str, help="Path to the queue database.")
+@click.option(
+    "--state",
+    "-s",
+    type=click.Choice([STATE_PENDING, STATE_RUNNING, STATE_DONE, STATE_DEAD]),
+    help="List only jobs in the given state.",
+)
+def cli_list(queue_path: str, state: Optional[str]):
+    """Print jobs as JSON lines, including their results or last errors."""
+    with JobQueue(queue_path) as queue:
+        for job in queue.iter_jobs(state):
+            print(
+                json.dumps(
+                    {
+                        "idempotency_key": job["idempotency_key"],
+                        "kind": job["kind"],
+                        "state": job["state"],
+                        "attempts": job["attempts"],
+                        "last_error": job["last_error"],
+                        "result": json.loads(job["result"]) if job["result"] else None,
+                    }
+                )
+            )
+
+
+@cli.command("requeue-dead")
+@click.option("--queue", "-q", "queue_path", required=True, type=str, help="Path to the queue database.")
+def cli_requeue_dead(queue_path: str):
+    """Move dead-lettered jobs back to the queue."""
+    with JobQueue(queue_path) as queue:
+        _LOGGER.info("Requeued %d dead-lettered jobs", queue.requeue_dead())
+
+
+if __name__ == "__main__":
+    cli()
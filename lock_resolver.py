@@ -0,0 +1,748 @@
+#!/usr/bin/env python3
+
+"""Create Pipfile.lock from index metadata, without installing anything.
+
+Only what is needed to resolve dependencies is fetched - simple index pages of
+projects (PEP 691 JSON or PEP 503 HTML) and core metadata of a single wheel per
+pinned version. Core metadata is taken from the .metadata file served next to
+the wheel (PEP 658) if the index provides one; otherwise just the METADATA file
+is read out of the remote wheel using HTTP range requests. Releases without a
+suitable wheel are resolved using metadata stored in their source distribution
+(PKG-INFO or egg-info requires.txt), without building it. Index pages are
+cached for a while, metadata files are cached forever as released
+distributions do not change.
+
+Dependencies are resolved for a single target environment given by the Python
+version required in Pipfile. The resolver picks the newest version satisfying
+all constraints, re-picks versions once a constraint added later rules out the
+picked one and fetches each layer of newly discovered dependencies in parallel.
+It does not backtrack through older versions of already picked packages to
+satisfy conflicting constraints, such a conflict is reported as an error.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import tarfile
+import zipfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import HeaderParser
+from html.parser import HTMLParser
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from urllib.parse import urldefrag
+from urllib.parse import urljoin
+from urllib.parse import urlparse
+
+import click
+import daiquiri
+import toml
+from packaging.requirements import Requirement
+from packaging.specifiers import SpecifierSet
+from packaging.tags import Tag
+from packaging.utils import canonicalize_name
+from packaging.utils import parse_wheel_filename
+from packaging.version import InvalidVersion
+from packaging.version import Version
+
+from exceptions import ResolutionException
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
+
+_LOGGER = logging.getLogger(__name__)
+
+_SIMPLE_JSON = "application/vnd.pypi.simple.v1+json"
+_SIMPLE_ACCEPT = f"{_SIMPLE_JSON}, application/vnd.pypi.simple.v1+html;q=0.2, text/html;q=0.1"
+
+DEFAULT_CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or "~/.cache", "thoth-misc", "lock")
+
+
+class TargetEnvironment:
+    """Environment dependencies are resolved for - a CPython interpreter of the given version on x86_64 Linux."""
+
+    def __init__(self, python_version: str) -> None:
+        """Create the target environment for the given Python version (e.g. 3.6)."""
+        self.python_version = python_version
+        self.python = Version(python_version)
+        major, minor = self.python.release[:2]
+        self.markers = {
+            "implementation_name": "cpython",
+            "implementation_version": f"{major}.{minor}.0",
+            "os_name": "posix",
+            "platform_machine": "x86_64",
+            "platform_python_implementation": "CPython",
+            "platform_release": "",
+            "platform_system": "Linux",
+            "platform_version": "",
+            "python_full_version": f"{major}.{minor}.0",
+            "python_version": f"{major}.{minor}",
+            "sys_platform": "linux",
+        }
+        self._interpreters = {f"cp{major}{minor}", f"py{major}{minor}", f"py{major}"}
+        self._abis = {f"cp{major}{minor}", f"cp{major}{minor}m", "abi3", "none"}
+        # Requires-Python value -> whether it is satisfied, files of a project mostly share the same value.
+        self._requires_python: Dict[str, bool] = {}
+
+    def evaluate(self, requirement: Requirement, extra: str = "") -> bool:
+        """Check whether the requirement applies to the environment, given the extra requested."""
+        return requirement.marker is None or requirement.marker.evaluate({**self.markers, "extra": extra})
+
+    def supports_python(self, requires_python: Optional[str]) -> bool:
+        """Check whether the Python version of the environment satisfies Requires-Python."""
+        if not requires_python:
+            return True
+
+        result = self._requires_python.get(requires_python)
+        if result is None:
+            try:
+                result = SpecifierSet(requires_python).contains(self.python, prereleases=True)
+            except ValueError:
+                # Some old releases declare Requires-Python which is not a valid specifier, ignore it as pip does.
+                result = True
+            self._requires_python[requires_python] = result
+
+        return result
+
+    def _supports_tag(self, tag: Tag) -> bool:
+        """Check whether a wheel tag is installable in the environment."""
+        platform_supported = tag.platform == "any" or (
+            tag.platform.startswith(("manylinux", "linux")) and tag.platform.endswith("x86_64")
+        )
+        return tag.interpreter in self._interpreters and tag.abi in self._abis and platform_supported
+
+    def supports_wheel(self, tags: Iterable[Tag]) -> bool:
+        """Check whether a wheel with the given tags is installable in the environment."""
+        return any(self._supports_tag(tag) for tag in tags)
+
+
+class _LinkParser(HTMLParser):
+    """Parse links to distribution files from a PEP 503 simple index page."""
+
+    def __init__(self) -> None:
+        """Initialize the parser."""
+        super().__init__()
+        self.links: List[Dict[str, Optional[str]]] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        """Record attributes of an anchor."""
+        if tag == "a":
+            self.links.append(dict(attrs))
+
+
+def _parse_html_page(page_url: str, content: str) -> List[Dict[str, Any]]:
+    """Parse distribution files listed in a PEP 503 simple index page."""
+    parser = _LinkParser()
+    parser.feed(content)
+
+    files = []
+    for link in parser.links:
+        if not link.get("href"):
+            continue
+        url, fragment = urldefrag(urljoin(page_url, link["href"]))
+        hashes = {}
+        if "=" in fragment:
+            algorithm, value = fragment.split("=", maxsplit=1)
+            hashes[algorithm] = value
+
+        core_metadata = link.get("data-core-metadata", link.get("data-dist-info-metadata"))
+        files.append(
+            {
+                "filename": os.path.basename(urlparse(url).path),
+                "url": url,
+                "hashes": hashes,
+                "requires_python": link.get("data-requires-python"),
+                "yanked": "data-yanked" in link,
+                "core_metadata": _parse_core_metadata(core_metadata),
+            }
+        )
+
+    return files
+
+
+def _parse_json_page(page_url: str, content: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Parse distribution files listed in a PEP 691 simple index JSON response."""
+    files = []
+    for entry in content.get("files", []):
+        core_metadata = entry.get("core-metadata", entry.get("dist-info-metadata", False))
+        if isinstance(core_metadata, dict):
+            core_metadata = core_metadata or True
+        files.append(
+            {
+                "filename": entry["filename"],
+                "url": urljoin(page_url, entry["url"]),
+                "hashes": entry.get("hashes", {}),
+                "requires_python": entry.get("requires-python"),
+                "yanked": bool(entry.get("yanked")),
+                "core_metadata": core_metadata or None,
+            }
+        )
+
+    return files
+
+
+def _parse_core_metadata(value: Optional[str]) -> Any:
+    """Parse availability of core metadata announced in an HTML simple page - True or a dictionary of hashes."""
+    if value is None or value == "false":
+        return None
+    if "=" in value:
+        algorithm, digest = value.split("=", maxsplit=1)
+        return {algorithm: digest}
+    return True
+
+
+class _HTTPRangeFile(io.RawIOBase):
+    """A read-only remote file, read using HTTP range requests."""
+
+    def __init__(self, url: str, size: int) -> None:
+        """Open the remote file of the given size."""
+        super().__init__()
+        self.url = url
+        self.size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        """The file is readable."""
+        return True
+
+    def seekable(self) -> bool:
+        """The file is seekable."""
+        return True
+
+    def tell(self) -> int:
+        """Get the current position."""
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """Move the current position."""
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self.size + offset
+        return self._position
+
+    def readinto(self, buffer: Any) -> int:
+        """Read data from the current position using a range request."""
+        if self._position >= self.size or not len(buffer):
+            return 0
+
+        end = min(self._position + len(buffer), self.size) - 1
+        response = get_client().get(self.url, headers={"Range": f"bytes={self._position}-{end}"})
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise OSError(f"Server does not support range requests for {self.url!r}")
+
+        content = response.content
+        buffer[: len(content)] = content
+        self._position += len(content)
+        return len(content)
+
+
+def read_wheel_metadata(wheel: zipfile.ZipFile) -> str:
+    """Read METADATA out of an opened wheel."""
+    for name in wheel.namelist():
+        parts = name.split("/")
+        if len(parts) == 2 and parts[0].endswith(".dist-info") and parts[1] == "METADATA":
+            return wheel.read(name).decode("utf-8")
+
+    raise ResolutionException("No METADATA found in wheel")
+
+
+def _requires_txt_to_metadata(content: str) -> str:
+    """Convert egg-info requires.txt into Requires-Dist entries of core metadata."""
+    lines = []
+    extra, marker = "", ""
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("[") and line.endswith("]"):
+            extra, _, marker = line[1:-1].partition(":")
+            continue
+
+        markers = [f"({marker})"] if marker else []
+        if extra:
+            markers.append(f'extra == "{extra}"')
+        lines.append(f"Requires-Dist: {line}" + (f"; {' and '.join(markers)}" if markers else ""))
+
+    return "\n".join(lines) + "\n"
+
+
+def _read_sdist_metadata(sdist_file: Any, filename: str) -> str:
+    """Read dependencies out of a downloaded source distribution, as core metadata."""
+    if filename.endswith(".zip"):
+        with zipfile.ZipFile(sdist_file) as archive:
+            return _sdist_metadata(archive.namelist(), archive.read)
+
+    with tarfile.open(fileobj=sdist_file) as archive:
+        members = {member.name: member for member in archive.getmembers() if member.isfile()}
+        return _sdist_metadata(list(members), lambda name: archive.extractfile(members[name]).read())
+
+
+def _sdist_metadata(names: List[str], read: Callable[[str], bytes]) -> str:
+    """Find dependencies in files of a source distribution."""
+    pkg_info = next((name for name in names if name.count("/") == 1 and name.endswith("/PKG-INFO")), None)
+    if pkg_info is not None:
+        content = read(pkg_info).decode("utf-8", errors="replace")
+        metadata = HeaderParser().parsestr(content)
+        dynamic = {field.lower() for field in metadata.get_all("Dynamic") or []}
+        # Since metadata 2.2 (PEP 643) dependencies in PKG-INFO are reliable unless marked as dynamic.
+        if Version(metadata.get("Metadata-Version", "1.0")) >= Version("2.2") and "requires-dist" not in dynamic:
+            return content
+
+    requires = next((name for name in names if name.endswith(".egg-info/requires.txt")), None)
+    if requires is not None:
+        return _requires_txt_to_metadata(read(requires).decode("utf-8", errors="replace"))
+
+    # Distributions declaring no dependencies cannot be told apart from ones computing them in setup.py.
+    _LOGGER.warning("No dependency information found in source distribution, assuming it has no dependencies")
+    return ""
+
+
+class IndexClient:
+    """Fetch simple index pages and core metadata of distributions, caching them on disk."""
+
+    def __init__(self, sources: List[Dict[str, Any]], cache_dir: str, page_ttl: float = 3600.0) -> None:
+        """Initialize the client for the given Pipfile sources."""
+        self.sources = sources
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.page_ttl = page_ttl
+        os.makedirs(os.path.join(self.cache_dir, "pages"), exist_ok=True)
+        os.makedirs(os.path.join(self.cache_dir, "metadata"), exist_ok=True)
+
+    def _cache_path(self, kind: str, url: str) -> str:
+        """Get path to a cache entry of the given URL."""
+        return os.path.join(self.cache_dir, kind, hashlib.sha256(url.encode()).hexdigest())
+
+    def _cache_get(self, kind: str, url: str, ttl: Optional[float] = None) -> Optional[str]:
+        """Get a cached entry, None if not cached or expired."""
+        path = self._cache_path(kind, url)
+        try:
+            if ttl is not None and time.time() - os.path.getmtime(path) > ttl:
+                return None
+            with open(path) as cache_file:
+                return cache_file.read()
+        except OSError:
+            return None
+
+    def _cache_put(self, kind: str, url: str, content: str) -> None:
+        """Store an entry in the cache atomically."""
+        path = self._cache_path(kind, url)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False) as cache_file:
+            cache_file.write(content)
+        os.replace(cache_file.name, path)
+
+    @span("lock_fetch_page")
+    def _fetch_page(self, source_url: str, project_name: str) -> Optional[List[Dict[str, Any]]]:
+        """Fetch distribution files of a project listed on an index, None if the index does not know the project."""
+        page_url = f"{source_url.rstrip('/')}/{project_name}/"
+        cached = self._cache_get("pages", page_url, self.page_ttl)
+        if cached is not None:
+            return json.loads(cached)
+
+        response = get_client().get(page_url, headers={"Accept": _SIMPLE_ACCEPT})
+        if response.status_code == 404:
+            files = None
+        else:
+            response.raise_for_status()
+            if response.headers.get("Content-Type", "").startswith(_SIMPLE_JSON):
+                files = _parse_json_page(response.url, response.json())
+            else:
+                files = _parse_html_page(response.url, response.text)
+
+        self._cache_put("pages", page_url, json.dumps(files))
+        return files
+
+    def project_files(
+        self, project_name: str, index: Optional[str] = None
+    ) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Get distribution files of a project from the first source listing it, or from the given source only."""
+        sources = [source for source in self.sources if index is None or source["name"] == index]
+        if not sources:
+            raise ResolutionException(f"Index {index!r} used by {project_name!r} is not listed in Pipfile sources")
+
+        for source in sources:
+            files = self._fetch_page(source["url"], project_name)
+            if files is not None:
+                return source, files
+
+        raise ResolutionException(f"Project {project_name!r} was not found on any of the indexes")
+
+    @span("lock_fetch_metadata")
+    def core_metadata(self, file: Dict[str, Any]) -> str:
+        """Get core metadata (METADATA file content) of a wheel, or dependencies of a source distribution."""
+        cached = self._cache_get("metadata", file["url"])
+        if cached is not None:
+            return cached
+
+        if file["core_metadata"]:
+            response = get_client().get(file["url"] + ".metadata")
+            response.raise_for_status()
+            expected = file["core_metadata"].get("sha256") if isinstance(file["core_metadata"], dict) else None
+            if expected and hashlib.sha256(response.content).hexdigest() != expected:
+                raise ResolutionException(f"Metadata of {file['filename']!r} do not match their digest")
+            metadata = response.content.decode("utf-8")
+        elif file["filename"].endswith(".whl"):
+            metadata = self._read_remote_wheel_metadata(file["url"])
+        else:
+            with tempfile.TemporaryFile() as sdist_file:
+                self._download(file["url"], sdist_file)
+                metadata = _read_sdist_metadata(sdist_file, file["filename"])
+
+        self._cache_put("metadata", file["url"], metadata)
+        return metadata
+
+    @staticmethod
+    def _download(url: str, output_file: Any) -> None:
+        """Download the given file into an opened file."""
+        response = get_client().get(url, stream=True)
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            output_file.write(chunk)
+        output_file.seek(0)
+
+    def _read_remote_wheel_metadata(self, url: str) -> str:
+        """Read METADATA out of a remote wheel, downloading only parts of the wheel if the server allows it."""
+        response = get_client().head(url, allow_redirects=True)
+        response.raise_for_status()
+        size = int(response.headers.get("Content-Length", 0))
+        if size and response.headers.get("Accept-Ranges") == "bytes":
+            try:
+                with zipfile.ZipFile(io.BufferedReader(_HTTPRangeFile(response.url, size), 256 * 1024)) as wheel:
+                    return read_wheel_metadata(wheel)
+            except OSError as exc:
+                _LOGGER.warning("Failed to read metadata of %r using range requests: %s", url, exc)
+
+        _LOGGER.warning("Downloading whole wheel %r to read its metadata", url)
+        with tempfile.TemporaryFile() as wheel_file:
+            self._download(url, wheel_file)
+            with zipfile.ZipFile(wheel_file) as wheel:
+                return read_wheel_metadata(wheel)
+
+
+class Candidate:
+    """A release of a project, installability in the target environment is evaluated lazily."""
+
+    def __init__(self, name: str, version: Version, source: Dict[str, Any]) -> None:
+        """Create an empty candidate, files are added later."""
+        self.name = name
+        self.version = version
+        self.source = source
+        self.files: List[Dict[str, Any]] = []
+        self.wheels: List[Dict[str, Any]] = []
+        self.wheel: Optional[Dict[str, Any]] = None
+        self.sdist: Optional[Dict[str, Any]] = None
+        self._installable: Optional[bool] = None
+
+    def installable(self, environment: TargetEnvironment) -> bool:
+        """Check whether any file of the release can be installed, pick files to read metadata from."""
+        if self._installable is not None:
+            return self._installable
+
+        for file in self.files:
+            if file["yanked"] or not environment.supports_python(file["requires_python"]):
+                continue
+            if not file["filename"].endswith(".whl"):
+                self.sdist = self.sdist or file
+                continue
+
+            try:
+                tags = parse_wheel_filename(file["filename"])[3]
+            except (ValueError, InvalidVersion):
+                continue
+            if environment.supports_wheel(tags):
+                self.wheels.append(file)
+
+        # Prefer wheels with core metadata served separately so the wheel itself is not touched.
+        self.wheel = next((file for file in self.wheels if file["core_metadata"]), next(iter(self.wheels), None))
+        self._installable = self.wheel is not None or self.sdist is not None
+        return self._installable
+
+    def installable_files(self, environment: TargetEnvironment) -> List[Dict[str, Any]]:
+        """Get files of the release installable in the environment, the source distribution only if no wheel is."""
+        if not self.installable(environment):
+            return []
+        return self.wheels or [self.sdist]
+
+
+def _file_version(filename: str) -> Optional[str]:
+    """Get version of a distribution file from its name, None if it is not a wheel or a source distribution."""
+    if filename.endswith(".whl"):
+        parts = filename.split("-")
+        return parts[1] if len(parts) >= 5 else None
+
+    for extension in (".tar.gz", ".zip"):
+        if filename.endswith(extension):
+            _, _, version = filename[: -len(extension)].rpartition("-")
+            return version or None
+
+    return None
+
+
+def _candidates(name: str, source: Dict[str, Any], files: List[Dict[str, Any]]) -> Dict[Version, Candidate]:
+    """Group distribution files of a project by release."""
+    candidates: Dict[str, Candidate] = {}
+    for file in files:
+        version = _file_version(file["filename"])
+        if version is None:
+            continue
+
+        candidate = candidates.get(version)
+        if candidate is None:
+            try:
+                candidate = candidates[version] = Candidate(name, Version(version), source)
+            except InvalidVersion:
+                continue
+        candidate.files.append(file)
+
+    # Different spellings of a version (e.g. 1.0 and 1.0.0) denote the same release.
+    result: Dict[Version, Candidate] = {}
+    for candidate in candidates.values():
+        if candidate.version in result:
+            result[candidate.version].files.extend(candidate.files)
+        else:
+            result[candidate.version] = candidate
+
+    return result
+
+
+class Resolver:
+    """Resolve dependencies of Pipfile packages using index metadata only."""
+
+    def __init__(self, client: IndexClient, environment: TargetEnvironment, *, workers: int = 16) -> None:
+        """Initialize the resolver."""
+        self.client = client
+        self.environment = environment
+        self.workers = workers
+        self._candidates: Dict[str, Dict[Version, Candidate]] = {}
+        self._dependencies: Dict[Tuple[str, Version], List[Requirement]] = {}
+        # Canonical name -> name as used in Pipfile.lock (lowercase, underscores replaced, as pipenv does).
+        self.lock_names: Dict[str, str] = {}
+
+    def _fetch_candidates(self, name: str, index: Optional[str]) -> None:
+        """Fetch releases of the given project."""
+        source, files = self.client.project_files(name, index)
+        self._candidates[name] = _candidates(name, source, files)
+
+    def _fetch_dependencies(self, candidate: Candidate) -> None:
+        """Fetch dependencies of the given release."""
+        metadata = HeaderParser().parsestr(self.client.core_metadata(candidate.wheel or candidate.sdist))
+        self._dependencies[(candidate.name, candidate.version)] = [
+            Requirement(requirement) for requirement in metadata.get_all("Requires-Dist") or []
+        ]
+
+    def _walk(
+        self, roots: List[Tuple[Requirement, Optional[str]]], pins: Dict[str, Version]
+    ) -> Tuple[Dict[str, List[Tuple[SpecifierSet, str]]], Dict[str, Optional[str]]]:
+        """Collect constraints of packages reachable from roots through currently pinned releases."""
+        constraints: Dict[str, List[Tuple[SpecifierSet, str]]] = {}
+        indexes: Dict[str, Optional[str]] = {}
+        extras: Dict[str, Set[str]] = {}
+        expanded: Set[Tuple[str, Version, str]] = set()
+
+        pending = [(requirement, "Pipfile", index) for requirement, index in roots]
+        while pending:
+            requirement, required_by, index = pending.pop()
+            name = canonicalize_name(requirement.name)
+            self.lock_names.setdefault(name, requirement.name.lower().replace("_", "-"))
+            constraints.setdefault(name, []).append((requirement.specifier, required_by))
+            indexes.setdefault(name, index)
+            extras.setdefault(name, {""}).update(requirement.extras)
+
+            version = pins.get(name)
+            if version is None or (name, version) not in self._dependencies:
+                continue
+
+            for extra in extras[name]:
+                if (name, version, extra) in expanded:
+                    continue
+                expanded.add((name, version, extra))
+                for dependency in self._dependencies[(name, version)]:
+                    if self.environment.evaluate(dependency, extra):
+                        pending.append((dependency, f"{name}=={version}", None))
+
+        return constraints, indexes
+
+    def _pick(self, name: str, constraints: List[Tuple[SpecifierSet, str]]) -> Candidate:
+        """Pick the newest installable release satisfying all constraints."""
+        candidates = self._candidates[name]
+        versions: Iterable[Version] = candidates
+        for specifier, _ in constraints:
+            versions = specifier.filter(versions)
+
+        for version in sorted(versions, reverse=True):
+            if candidates[version].installable(self.environment):
+                return candidates[version]
+
+        details = ", ".join(
+            f"{str(specifier) or '*'} (required by {required_by})" for specifier, required_by in constraints
+        )
+        raise ResolutionException(f"No installable release of {name!r} satisfies all constraints: {details}")
+
+    def resolve(self, roots: List[Tuple[Requirement, Optional[str]]], max_rounds: int = 100) -> List[Candidate]:
+        """Resolve the given root requirements (with the index they should be installed from)."""
+        pins: Dict[str, Version] = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in range(max_rounds):
+                constraints, indexes = self._walk(roots, pins)
+                to_pick = [
+                    name
+                    for name, name_constraints in constraints.items()
+                    if name not in pins
+                    or not all(specifier.contains(pins[name], prereleases=True) for specifier, _ in name_constraints)
+                ]
+                if not to_pick:
+                    return [self._candidates[name][pins[name]] for name in sorted(constraints)]
+
+                # Each round fetches the whole newly discovered layer of the dependency graph concurrently.
+                unknown = [name for name in to_pick if name not in self._candidates]
+                list(executor.map(lambda name: self._fetch_candidates(name, indexes[name]), unknown))
+
+                picked = []
+                for name in to_pick:
+                    candidate = self._pick(name, constraints[name])
+                    if name in pins:
+                        _LOGGER.debug("Re-picking %r: %s -> %s", name, pins[name], candidate.version)
+                    pins[name] = candidate.version
+                    if (name, candidate.version) not in self._dependencies:
+                        picked.append(candidate)
+
+                list(executor.map(self._fetch_dependencies, picked))
+
+        raise ResolutionException(f"Resolution did not converge in {max_rounds} rounds")
+
+
+def _root_requirements(packages: Dict[str, Any]) -> List[Tuple[Requirement, Optional[str]]]:
+    """Turn Pipfile packages into requirements together with the index they are pinned to."""
+    result = []
+    for name, entry in packages.items():
+        if isinstance(entry, str):
+            entry = {"version": entry}
+        if any(key in entry for key in ("git", "path", "file", "editable")):
+            raise ResolutionException(f"Package {name!r} is not installed from an index, it cannot be locked")
+
+        version = entry.get("version", "*")
+        extras = f"[{','.join(entry['extras'])}]" if entry.get("extras") else ""
+        markers = f"; {entry['markers']}" if entry.get("markers") else ""
+        specifier = "" if version == "*" else version
+        result.append((Requirement(f"{name}{extras}{specifier}{markers}"), entry.get("index")))
+
+    return result
+
+
+def pipfile_hash(pipfile: Dict[str, Any]) -> str:
+    """Compute hash of Pipfile content the same way pipenv does to detect an out of date Pipfile.lock."""
+    data = {
+        "_meta": {"sources": pipfile["source"], "requires": pipfile.get("requires", {})},
+        "default": pipfile.get("packages", {}),
+        "develop": pipfile.get("dev-packages", {}),
+    }
+    for section, values in pipfile.items():
+        if section not in ("source", "requires", "packages", "dev-packages", "pipenv", "scripts"):
+            data[section] = values
+
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf8")).hexdigest()
+
+
+def _lock_section(resolver: Resolver, packages: Dict[str, Any]) -> Dict[str, Any]:
+    """Resolve and lock a single section of Pipfile."""
+    roots = _root_requirements(packages)
+    if not roots:
+        return {}
+
+    section = {}
+    for candidate in resolver.resolve(roots):
+        hashes = sorted(
+            f"sha256:{file['hashes']['sha256']}" for file in candidate.files if "sha256" in file["hashes"]
+        )
+        section[resolver.lock_names[candidate.name]] = {
+            "hashes": hashes,
+            "index": candidate.source["name"],
+            "version": f"=={candidate.version}",
+        }
+
+    return section
+
+
+def lock_pipfile(
+    pipfile_path: str,
+    lock_path: Optional[str] = None,
+    *,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    page_ttl: float = 3600.0,
+    workers: int = 16,
+) -> Dict[str, Any]:
+    """Create Pipfile.lock for the given Pipfile without installing anything, return its content."""
+    with open(pipfile_path) as pipfile_file:
+        pipfile = toml.load(pipfile_file)
+
+    sources = pipfile.get("source") or [{"name": "pypi", "url": "https://pypi.org/simple", "verify_ssl": True}]
+    pipfile.setdefault("source", sources)
+    requires = pipfile.get("requires", {})
+    environment = TargetEnvironment(requires.get("python_version") or "%d.%d" % sys.version_info[:2])
+    resolver = Resolver(IndexClient(sources, cache_dir, page_ttl=page_ttl), environment, workers=workers)
+
+    with span("lock_resolve"):
+        lock = {
+            "_meta": {
+                "hash": {"sha256": pipfile_hash(pipfile)},
+                "pipfile-spec": 6,
+                "requires": requires,
+                "sources": sources,
+            },
+            "default": _lock_section(resolver, pipfile.get("packages", {})),
+            "develop": _lock_section(resolver, pipfile.get("dev-packages", {})),
+        }
+
+    if lock_path:
+        with open(lock_path, "w") as lock_file:
+            json.dump(lock, lock_file, indent=4, sort_keys=True)
+            lock_file.write("\n")
+
+    return lock
+
+
+@click.command()
+@click.option(
+    "--pipfile", "-p", "pipfile_path", type=str, default="Pipfile", show_default=True, help="Pipfile to lock."
+)
+@click.option(
+    "--output",
+    "-o",
+    type=str,
+    help="Write Pipfile.lock to the given file, defaults to Pipfile.lock next to the Pipfile.",
+)
+@click.option("--cache-dir", type=str, default=DEFAULT_CACHE_DIR, show_default=True, help="Cache of index metadata.")
+@click.option(
+    "--page-ttl",
+    type=float,
+    default=3600.0,
+    show_default=True,
+    help="Time in seconds for which cached simple index pages are considered fresh.",
+)
+@click.option("--workers", "-w", type=int, default=16, show_default=True, help="Number of concurrent requests.")
+@instrumentation_options
+def cli(pipfile_path: str, output: Optional[str], cache_dir: str, page_ttl: float, workers: int):
+    """Create Pipfile.lock from index metadata without installing anything."""
+    daiquiri.setup(level=logging.INFO)
+    output = output or os.path.join(os.path.dirname(os.path.abspath(pipfile_path)), "Pipfile.lock")
+    lock = lock_pipfile(pipfile_path, output, cache_dir=cache_dir, page_ttl=page_ttl, workers=workers)
+    _LOGGER.info("Locked %d packages into %r", len(lock["default"]) + len(lock["develop"]), output)
+    get_client().metrics.log_summary()
+
+
+if __name__ == "__main__":
+    cli()
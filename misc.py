@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""A single entry point to helper scripts in this repository.
+
+Each script is exposed as a subcommand. A script, together with its
+dependencies, is imported only when its subcommand is run so listing commands
+and running cheap ones stays fast.
+"""
+
+import os
+import sys
+import importlib
+import importlib.util
+from typing import Any
+from typing import List
+from typing import Optional
+
+import click
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Subcommand name -> (script file, click command in the script, short help).
+_COMMANDS = {
+    "aicoe-index": ("aicoe-index.py", "cli", "Check structure of an AICoE Python index or deduplicate its wheels."),
+    "amun-collector": ("amun_collector.py", "cli", "Collect results of scheduled Amun inspections."),
+    "amun-load": ("amun_load.py", "cli", "Generate load on Amun API and measure its latency."),
+    "benchmarks": ("benchmarks.py", "cli", "Benchmark hot paths of scripts in this repository."),
+    "env-fingerprint": ("env_fingerprint.py", "cli", "Index inspections by fingerprints of their locked environments."),
+    "inspection-archive": ("inspection_archive.py", "cli", "Work with archives of inspection results."),
+    "job-queue": ("job_queue.py", "cli", "Work with a durable queue of scheduling jobs."),
+    "lock-resolver": ("lock_resolver.py", "cli", "Create Pipfile.lock without installing anything."),
+    "negative-cache": ("negative_cache.py", "cli", "Track packages solvers are known to fail on."),
+    "pipfile2json": ("pipefile2json.py", "pipefile2json_cli", "Convert Pipfile or Pipfile.lock into JSON."),
+    "provenance": ("provenance.py", "cli", "Verify provenance of a package installed by pipenv."),
+    "ps2prescriptions": ("ps2prescriptions.py", "cli", "Create prescriptions out of predictable stacks."),
+    "python-repos": ("python_repos.py", "cli", "Trigger aggregation of build logs in Travis API."),
+    "radanalytics": ("radanalytics.py", "cli", "Submit analysis for Radanalytics images."),
+    "register-tf-indexes": ("register-tf-indexes.py", "cli", "Register AICoE indexes in Thoth's database."),
+    "schedule-most-popular": ("schedule_most_popular.py", "cli", "Schedule solvers for most popular packages."),
+    "schedule-performance-benchmarks": (
+        "schedule_performance_benchmarks.py",
+        "cli",
+        "Schedule performance benchmarks using Amun.",
+    ),
+    "solver-graph": ("solver_graph.py", "cli", "Query dependency graphs of thoth-solver results."),
+    "solver-store": ("solver_store.py", "cli", "Ingest thoth-solver results into a local SQLite store."),
+    "spec-validator": ("spec_validator.py", "cli", "Validate Amun inspection specifications."),
+    "stub-server": ("stub_server.py", "cli", "Run a local stand-in server for Thoth APIs."),
+    "wave-scheduler": ("wave_scheduler.py", "cli", "Show how many inspections fit quotas of hardware classes."),
+    "wheel-mirror": ("wheel_mirror.py", "cli", "Prefetch wheels of benchmarked frameworks into a local store."),
+}
+
+
+def load_script(file_name: str) -> Any:
+    """Import a script from this repository; scripts with names which are not valid identifiers are loaded by path."""
+    module_name = file_name[: -len(".py")]
+    if module_name.isidentifier():
+        return importlib.import_module(module_name)
+
+    module_name = module_name.replace("-", "_")
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(_HERE, file_name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class _LazyGroup(click.Group):
+    """A group which imports subcommands only when they are invoked."""
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        """List available subcommands without importing them."""
+        return sorted(_COMMANDS)
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        """Import the script implementing the given subcommand."""
+        if cmd_name not in _COMMANDS:
+            return None
+
+        file_name, attribute, _ = _COMMANDS[cmd_name]
+        return getattr(load_script(file_name), attribute)
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        """Write subcommands listing using static help texts so no script is imported."""
+        rows = [(name, _COMMANDS[name][2]) for name in self.list_commands(ctx)]
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=_LazyGroup)
+def cli():
+    """Helper scripts for Thoth that do not belong anywhere."""
+
+
+if __name__ == "__main__":
+    if _HERE not in sys.path:
+        sys.path.insert(0, _HERE)
+    cli()
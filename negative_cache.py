@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+"""A negative cache of packages solvers fail to solve, consulted before scheduling solver runs.
+
+Solver documents are scanned one at a time. Each failure recorded in errors or
+unresolved is classified into a failure kind and stored keyed by package name,
+version, index and solver environment (e.g. fedora-29-py36). A package which
+failed in a document without any of its versions solved is also stored as
+failing as a whole, under an empty version.
+
+Entries expire after a TTL given by their failure kind, counted from the time
+the failure was observed - failures such as a missing distribution are
+deterministic and kept long, network issues are retried soon. A version solved
+later removes its entry.
+
+A package (or its version) is considered failing on an index only if it is
+failing in all solver environments seen on that index, unless an environment
+is stated explicitly.
+"""
+
+import re
+import sys
+import json
+import time
+import sqlite3
+import logging
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import click
+import daiquiri
+from packaging.utils import canonicalize_name
+
+from solver_graph import iter_solver_documents
+
+_LOGGER = logging.getLogger(__name__)
+
+_DAY = 24 * 60 * 60
+
+# Failure kind -> pattern matched against error message and output, the first match wins.
+_FAILURE_KINDS = (
+    ("no_matching_distribution", re.compile(r"Could not find a version that satisfies|No matching distribution")),
+    ("python_incompatible", re.compile(r"requires Python|Requires-Python|SyntaxError")),
+    ("build_failed", re.compile(r"egg_info\" failed|Failed building wheel|error: command .* failed")),
+    ("timeout", re.compile(r"timed out|Timeout|TimeoutExpired", re.IGNORECASE)),
+    ("network", re.compile(r"ConnectionError|Connection refused|Max retries exceeded|Temporary failure")),
+)
+
+# Time to live of cache entries in seconds by failure kind.
+TTLS = {
+    "no_matching_distribution": 30 * _DAY,
+    "python_incompatible": 30 * _DAY,
+    "build_failed": 7 * _DAY,
+    "unresolved": 7 * _DAY,
+    "timeout": 6 * 60 * 60,
+    "network": 60 * 60,
+    "other": _DAY,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS failures (
+    package_name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    index_url TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    message TEXT,
+    observed_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (package_name, index_url, version, environment)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS failures_expires_at ON failures (expires_at);
+CREATE TABLE IF NOT EXISTS environments (
+    index_url TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    PRIMARY KEY (index_url, environment)
+) WITHOUT ROWID;
+"""
+
+
+def classify_error(error: Dict[str, Any]) -> str:
+    """Classify an error reported by solver into a failure kind."""
+    details = error.get("details") or {}
+    if isinstance(details, dict):
+        text = " ".join(str(details.get(key) or "") for key in ("message", "stderr", "stdout"))
+    else:
+        text = str(details)
+
+    for kind, pattern in _FAILURE_KINDS:
+        if pattern.search(text):
+            return kind
+
+    return "other"
+
+
+def solver_environment(metadata: Dict[str, Any]) -> str:
+    """Get name of the environment a solver document was produced in, e.g. fedora-29-py36."""
+    distribution = metadata.get("distribution") or {}
+    python = metadata.get("python") or {}
+    python_version = f"{python.get('major', '')}{python.get('minor', '')}"
+    return f"{distribution.get('id', '')}-{distribution.get('version', '')}-py{python_version}"
+
+
+def _error_message(error: Dict[str, Any]) -> str:
+    """Get the line of an error output explaining the failure, for humans reading the cache."""
+    details = error.get("details") or {}
+    text = (details.get("stderr") or details.get("message") or "") if isinstance(details, dict) else str(details)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return lines[-1][:500] if lines else ""
+
+
+def iter_failures(document: Dict[str, Any]) -> Iterator[Tuple[str, str, str, str, str, str]]:
+    """Iterate over (package, version, index, environment, kind, message) failures found in a solver document."""
+    metadata = document.get("metadata") or {}
+    result = document.get("result") or {}
+    environment = solver_environment(metadata)
+    default_index = ((metadata.get("arguments") or {}).get("pypi") or {}).get("index") or ""
+
+    solved = {canonicalize_name(entry["package_name"]) for entry in result.get("tree") or []}
+    solved.update(canonicalize_name(entry["package_name"]) for entry in result.get("environment") or [])
+
+    project_failures: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    for error in result.get("errors") or []:
+        package_name = canonicalize_name(error["package_name"])
+        index_url = (error.get("index") or default_index).rstrip("/")
+        kind = classify_error(error)
+        message = _error_message(error)
+        yield package_name, error.get("version") or "", index_url, environment, kind, message
+        project_failures.setdefault((package_name, index_url), (kind, message))
+
+    for entry in result.get("unresolved") or []:
+        package_name = canonicalize_name(entry["package_name"])
+        index_url = (entry.get("index") or default_index).rstrip("/")
+        project_failures.setdefault((package_name, index_url), ("unresolved", entry.get("version_spec") or ""))
+
+    for (package_name, index_url), (kind, message) in project_failures.items():
+        if package_name not in solved:
+            yield package_name, "", index_url, environment, kind, message
+
+
+class NegativeCache:
+    """A negative cache stored in an SQLite database; not to be shared across threads."""
+
+    def __init__(self, path: str, ttls: Optional[Dict[str, float]] = None) -> None:
+        """Open (and create if needed) the cache stored in the given database file."""
+        self.path = path
+        self.ttls = dict(TTLS, **(ttls or {}))
+        self._connection = sqlite3.connect(path, timeout=60.0, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._connection.close()
+
+    def __enter__(self) -> "NegativeCache":
+        """Use the cache as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the cache when leaving the context."""
+        self.close()
+
+    def _add_document(self, document: Dict[str, Any]) -> int:
+        """Record failures and successes found in a solver document, called within a transaction."""
+        metadata = document.get("metadata") or {}
+        observed_at = float(metadata.get("timestamp") or time.time())
+        environment = solver_environment(metadata)
+
+        failures = list(iter_failures(document))
+        self._connection.executemany(
+            "INSERT INTO failures "
+            "(package_name, version, index_url, environment, kind, message, observed_at, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (package_name, index_url, version, environment) DO UPDATE SET "
+            "kind = excluded.kind, message = excluded.message, "
+            "observed_at = excluded.observed_at, expires_at = excluded.expires_at "
+            "WHERE excluded.observed_at >= failures.observed_at",
+            [
+                (*failure, observed_at, observed_at + self.ttls.get(failure[4], self.ttls["other"]))
+                for failure in failures
+            ],
+        )
+
+        tree = (document.get("result") or {}).get("tree") or []
+        self._connection.executemany(
+            "DELETE FROM failures WHERE package_name = ? AND index_url = ? AND version IN (?, '') "
+            "AND environment = ? AND observed_at <= ?",
+            [
+                (
+                    canonicalize_name(entry["package_name"]),
+                    (entry.get("index_url") or "").rstrip("/"),
+                    entry["package_version"],
+                    environment,
+                    observed_at,
+                )
+                for entry in tree
+            ],
+        )
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO environments (index_url, environment) VALUES (?, ?)",
+            {(failure[2], environment) for failure in failures}
+            | {((entry.get("index_url") or "").rstrip("/"), environment) for entry in tree},
+        )
+        return len(failures)
+
+    def scan(self, documents: Iterable[Dict[str, Any]], batch_size: int = 100) -> int:
+        """Scan solver documents in batches, return number of failures recorded."""
+        recorded = 0
+        documents = iter(documents)
+        while True:
+            batch = [document for _, document in zip(range(batch_size), documents)]
+            if not batch:
+                break
+
+            self._connection.execute("BEGIN")
+            try:
+                for document in batch:
+                    if "metadata" not in document:
+                        _LOGGER.warning("Document without solver metadata skipped")
+                        continue
+                    recorded += self._add_document(document)
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+        return recorded
+
+    def _failing(self, package_name: str, index_url: str, environment: Optional[str], now: float) -> Dict[str, Set]:
+        """Map versions of a package with live failures to environments they are failing in."""
+        query = (
+            "SELECT version, environment FROM failures WHERE package_name = ? AND index_url = ? AND expires_at > ?"
+        )
+        parameters: List[Any] = [canonicalize_name(package_name), index_url.rstrip("/"), now]
+        if environment is not None:
+            query += " AND environment = ?"
+            parameters.append(environment)
+
+        versions: Dict[str, Set] = {}
+        for version, failing_environment in self._connection.execute(query, parameters):
+            versions.setdefault(version, set()).add(failing_environment)
+        return versions
+
+    def _environments(self, index_url: str, environment: Optional[str]) -> Set[str]:
+        """Get environments a failure must be observed in to be considered failing."""
+        if environment is not None:
+            return {environment}
+        rows = self._connection.execute(
+            "SELECT environment FROM environments WHERE index_url = ?", (index_url.rstrip("/"),)
+        )
+        return {row[0] for row in rows}
+
+    def failing_versions(
+        self, package_name: str, index_url: str, environment: Optional[str] = None, now: Optional[float] = None
+    ) -> Set[str]:
+        """Get versions of a package known to fail; an empty version stands for the package as a whole."""
+        environments = self._environments(index_url, environment)
+        failing = self._failing(package_name, index_url, environment, time.time() if now is None else now)
+        return {version for version, failing_environments in failing.items() if failing_environments >= environments}
+
+    def is_failing(
+        self, package_name: str, index_url: str, environment: Optional[str] = None, now: Optional[float] = None
+    ) -> bool:
+        """Check whether a package as a whole is known to fail."""
+        return "" in self.failing_versions(package_name, index_url, environment, now)
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Remove expired entries, return number of entries removed."""
+        cursor = self._connection.execute(
+            "DELETE FROM failures WHERE expires_at <= ?", (time.time() if now is None else now,)
+        )
+        return cursor.rowcount
+
+    def iter_entries(self, now: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """Iterate over live entries of the cache."""
+        cursor = self._connection.execute(
+            "SELECT package_name, version, index_url, environment, kind, message, observed_at, expires_at "
+            "FROM failures WHERE expires_at > ? ORDER BY package_name, version, environment",
+            (time.time() if now is None else now,),
+        )
+        columns = [column[0] for column in cursor.description]
+        for row in cursor:
+            yield dict(zip(columns, row))
+
+
+@click.group()
+def cli():
+    """Keep track of packages solvers fail to solve."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("scan")
+@click.option("--cache", "-c", "cache_path", required=True, type=str, help="Path to the negative cache database.")
+@click.argument("paths", nargs=-1, required=True)
+def cli_scan(cache_path: str, paths: List[str]):
+    """Record failures found in solver documents stored in JSON files or directories with them."""
+    with NegativeCache(cache_path) as cache:
+        recorded = cache.scan(iter_solver_documents(paths))
+        purged = cache.purge()
+    _LOGGER.info("Recorded %d failures, %d expired entries purged", recorded, purged)
+
+
+@cli.command("list")
+@click.option("--cache", "-c", "cache_path", required=True, type=str, help="Path to the negative cache database.")
+def cli_list(cache_path: str):
+    """Print live entries of the cache as JSON lines."""
+    with NegativeCache(cache_path) as cache:
+        for entry in cache.iter_entries():
+            sys.stdout.write(json.dumps(entry) + "\n")
+
+
+if __name__ == "__main__":
+    cli()
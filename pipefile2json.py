@@ -16,7 +16,6 @@ import toml
 import click
 import daiquiri
 
-daiquiri.setup(level=logging.INFO)
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -67,6 +66,8 @@ def pipfile2dict(pipfile_path: str):
 @click.command()
 @click.argument('pipfile_path', type=str)
 def pipefile2json_cli(pipfile_path: str):
+    """Convert Pipfile or Pipfile.lock file into JSON representation for Thoth services."""
+    daiquiri.setup(level=logging.INFO)
     json.dump(pipfile2dict(pipfile_path), sys.stdout, indent=2)
 
 
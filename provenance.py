@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+"""Verify provenance of a package installed into a pipenv managed virtual environment.
+
+Installed distributions are inspected by reading their dist-info directory in
+the virtual environment directly - METADATA gives exact name, version and
+author, RECORD lists installed files, INSTALLER names the installer used and
+direct_url.json (PEP 610) records a URL the distribution was installed from if
+it was not installed from an index.
+
+The index a package was installed from is not recorded by installers. pipenv
+installs (using pip) only artifacts matching hashes stated in Pipfile.lock, so
+the origin is verified locally by checking the package was installed by pip,
+not from a direct URL, and is locked with artifact hashes to the requested
+index. All of this is read from local files, no subprocess nor network request
+is made.
+
+Optionally, the origin can also be verified against the index itself by
+checking every artifact hash locked for the package is published by the
+requested index - the package can then only have been installed from a file the
+index serves. This fetches the index page of the package over the network.
+"""
+
+import os
+import re
+import sys
+import json
+import glob
+import base64
+import hashlib
+import logging
+from email.parser import HeaderParser
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import click
+import daiquiri
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion
+from packaging.version import Version
+
+from exceptions import NotInstalledIndexException
+from exceptions import NotInstalledVersionException
+from exceptions import PackageNotInstalledException
+
+_LOGGER = logging.getLogger(__name__)
+
+_DEFAULT_WORKON_HOME = "~/.local/share/virtualenvs"
+
+
+def _sanitize_virtualenv_name(name: str) -> str:
+    """Sanitize a project name the same way pipenv does when naming virtual environments."""
+    # pipenv limits the length to keep the shebang line in the virtual environment under the kernel limit.
+    return re.sub(r'[ &$`!*@"()\[\]\\\r\n\t]', "_", name)[0:42]
+
+
+def find_virtualenv(project_dir: str) -> str:
+    """Locate the virtual environment pipenv created for the project with Pipfile in the given directory."""
+    project_dir = os.path.abspath(project_dir)
+    in_project = os.path.join(project_dir, ".venv")
+    venv_in_project = os.environ.get("PIPENV_VENV_IN_PROJECT", "").lower() in ("1", "true", "yes", "on")
+    if venv_in_project or os.path.isdir(in_project):
+        if os.path.isdir(in_project):
+            return in_project
+        raise PackageNotInstalledException(f"No virtual environment found in {in_project!r}")
+
+    workon_home = os.path.expanduser(os.environ.get("WORKON_HOME") or _DEFAULT_WORKON_HOME)
+    pipfile_path = os.path.join(project_dir, "Pipfile")
+    name = _sanitize_virtualenv_name(os.path.basename(project_dir))
+    digest = base64.urlsafe_b64encode(hashlib.sha256(pipfile_path.encode()).digest()[:6]).decode()
+    path = os.path.join(workon_home, f"{name}-{digest}")
+    if os.path.isdir(path):
+        return path
+
+    # Fall back to the project file pipenv stores in each virtual environment (e.g. the project was moved).
+    for candidate in glob.glob(os.path.join(glob.escape(workon_home), f"{glob.escape(name)}-*")):
+        try:
+            with open(os.path.join(candidate, ".project")) as project_file:
+                if os.path.abspath(project_file.read().strip()) == project_dir:
+                    return candidate
+        except OSError:
+            continue
+
+    raise PackageNotInstalledException(f"No virtual environment found for project {project_dir!r} in {workon_home!r}")
+
+
+def find_dist_info(virtualenv_path: str, package_name: str) -> str:
+    """Find dist-info directory of the given package installed in the virtual environment."""
+    site_packages = glob.glob(os.path.join(glob.escape(virtualenv_path), "lib", "python*", "site-packages"))
+    site_packages.append(os.path.join(virtualenv_path, "Lib", "site-packages"))
+
+    package_name = canonicalize_name(package_name)
+    for directory in site_packages:
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.listdir(directory):
+            if not entry.endswith(".dist-info"):
+                continue
+            # Directory name is {name}-{version}.dist-info, name does not contain dashes once escaped.
+            if canonicalize_name(entry[: -len(".dist-info")].split("-", maxsplit=1)[0]) == package_name:
+                return os.path.join(directory, entry)
+
+    raise PackageNotInstalledException(f"Package {package_name!r} is not installed in {virtualenv_path!r}")
+
+
+def _read_optional(path: str) -> Optional[str]:
+    """Read content of a file, return None if it does not exist."""
+    try:
+        with open(path, encoding="utf-8") as input_file:
+            return input_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def _read_record(dist_info_path: str) -> Dict[str, Any]:
+    """Summarize files listed in RECORD of an installed distribution."""
+    content = _read_optional(os.path.join(dist_info_path, "RECORD")) or ""
+    site_packages = os.path.dirname(dist_info_path)
+    files = 0
+    missing: List[str] = []
+    for line in content.splitlines():
+        # Paths in RECORD may contain commas, hash and size are always the last two fields.
+        path = line.rsplit(",", maxsplit=2)[0]
+        if not path:
+            continue
+        files += 1
+        if not os.path.lexists(os.path.join(site_packages, path)):
+            missing.append(path)
+
+    return {"files": files, "missing": missing}
+
+
+def _locked_entry(lock_path: str, package_name: str) -> Tuple[Optional[str], List[str]]:
+    """Get URL of the index the package is locked to in Pipfile.lock and hashes of its artifacts locked."""
+    with open(lock_path) as lock_file:
+        lock = json.load(lock_file)
+
+    sources = {source["name"]: source["url"] for source in lock.get("_meta", {}).get("sources", [])}
+    package_name = canonicalize_name(package_name)
+    for section in ("default", "develop"):
+        for name, entry in lock.get(section, {}).items():
+            if canonicalize_name(name) != package_name:
+                continue
+            if "index" in entry:
+                index_url = sources.get(entry["index"])
+            else:
+                # Packages without explicit index are installed from the first source.
+                index_url = next(iter(sources.values()), None)
+            return index_url, list(entry.get("hashes") or [])
+
+    return None, []
+
+
+def _versions_equal(installed: Optional[str], requested: str) -> bool:
+    """Compare versions as defined in PEP 440 (2.1 equals 2.1.0), fall back to string comparison."""
+    try:
+        return installed is not None and Version(installed) == Version(requested)
+    except InvalidVersion:
+        return installed == requested
+
+
+def verify_locked_origin(package_name: str, provenance: Dict[str, Any], index_url: str) -> None:
+    """Verify the package was installed by pip from artifacts locked to the index, using local data only."""
+    if provenance["direct_url"] is not None:
+        raise NotInstalledIndexException(
+            f"Package {package_name!r} was installed from {provenance['direct_url'].get('url')!r}, "
+            f"not from index {index_url!r}"
+        )
+
+    if provenance["installer"] is not None and provenance["installer"] != "pip":
+        raise NotInstalledIndexException(
+            f"Package {package_name!r} was installed by {provenance['installer']!r}, not by pipenv using pip"
+        )
+
+    if (provenance["index_url"] or "").rstrip("/") != index_url.rstrip("/"):
+        raise NotInstalledIndexException(
+            f"Package {package_name!r} is locked to index {provenance['index_url']!r} in Pipfile.lock, "
+            f"requested index is {index_url!r}"
+        )
+
+    if not provenance["hashes"]:
+        raise NotInstalledIndexException(
+            f"No artifact hashes of package {package_name!r} are locked, any artifact could have been installed"
+        )
+
+
+def verify_index_origin(
+    package_name: str, locked_hashes: List[str], index_url: str, cache_dir: Optional[str] = None
+) -> None:
+    """Verify all artifacts of a package locked (and thus installable by pipenv) are published by the index.
+
+    The index page of the package is fetched over the network.
+    """
+    # Imported only when needed, verification using local files does not pay for the HTTP stack.
+    from lock_resolver import DEFAULT_CACHE_DIR
+    from lock_resolver import IndexClient
+
+    if not locked_hashes:
+        raise NotInstalledIndexException(
+            f"No artifact hashes of package {package_name!r} are locked, its origin cannot be verified"
+        )
+
+    client = IndexClient([{"name": "requested", "url": index_url}], cache_dir or DEFAULT_CACHE_DIR, page_ttl=0.0)
+    try:
+        _, files = client.project_files(canonicalize_name(package_name))
+    except Exception as exc:
+        raise NotInstalledIndexException(
+            f"Failed to obtain artifacts of package {package_name!r} published by index {index_url!r}: {exc}"
+        ) from exc
+
+    published = {
+        f"{algorithm}:{value}" for file in files for algorithm, value in (file.get("hashes") or {}).items()
+    }
+    foreign = sorted(set(locked_hashes) - published)
+    if foreign:
+        raise NotInstalledIndexException(
+            f"Package {package_name!r} could have been installed from artifacts not published by index "
+            f"{index_url!r}: {foreign}"
+        )
+
+
+def read_provenance(project_dir: str, package_name: str) -> Dict[str, Any]:
+    """Read provenance of a package installed in the virtual environment of a pipenv project."""
+    dist_info_path = find_dist_info(find_virtualenv(project_dir), package_name)
+    metadata = HeaderParser().parsestr(_read_optional(os.path.join(dist_info_path, "METADATA")) or "")
+
+    direct_url = _read_optional(os.path.join(dist_info_path, "direct_url.json"))
+    installer = _read_optional(os.path.join(dist_info_path, "INSTALLER"))
+    lock_path = os.path.join(project_dir, "Pipfile.lock")
+    index_url, hashes = _locked_entry(lock_path, package_name) if os.path.exists(lock_path) else (None, [])
+
+    return {
+        "name": metadata.get("Name"),
+        "version": metadata.get("Version"),
+        "author": metadata.get("Author"),
+        "author_email": metadata.get("Author-email"),
+        "home_page": metadata.get("Home-page"),
+        "installer": installer.strip() if installer else None,
+        "direct_url": json.loads(direct_url) if direct_url else None,
+        "index_url": index_url,
+        "hashes": hashes,
+        "record": _read_record(dist_info_path),
+        "dist_info": dist_info_path,
+    }
+
+
+def verify_provenance(
+    project_dir: str,
+    package_name: str,
+    version: str,
+    index_url: str,
+    author: Optional[str] = None,
+    check_index: bool = False,
+    cache_dir: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Verify the package is installed in the given version from the given index, return its provenance.
+
+    If an author is given, it has to be stated in Author or Author-email of the package metadata. The origin
+    is verified using local files only, unless checking the index is requested (see verify_index_origin).
+    """
+    provenance = read_provenance(project_dir, package_name)
+    _LOGGER.info("Provenance of %r: %s", package_name, json.dumps(provenance))
+
+    if not _versions_equal(provenance["version"], version):
+        raise NotInstalledVersionException(
+            f"Package {package_name!r} is installed in version {provenance['version']!r}, "
+            f"requested version is {version!r}"
+        )
+
+    verify_locked_origin(package_name, provenance, index_url)
+    if check_index:
+        verify_index_origin(package_name, provenance["hashes"], index_url, cache_dir=cache_dir)
+
+    if author is not None and not any(
+        author in (provenance[field] or "") for field in ("author", "author_email")
+    ):
+        raise NotInstalledIndexException(
+            f"Package {package_name!r} is authored by {provenance['author']!r} "
+            f"<{provenance['author_email']}>, expected author is {author!r}"
+        )
+
+    if provenance["record"]["missing"]:
+        _LOGGER.warning(
+            "%d files of package %r listed in RECORD are missing", len(provenance["record"]["missing"]), package_name
+        )
+
+    return provenance
+
+
+@click.command()
+@click.option(
+    "--project-dir",
+    "-p",
+    type=str,
+    default="./amun",
+    show_default=True,
+    help="Directory with Pipfile and Pipfile.lock of the pipenv project.",
+)
+@click.option("--package-name", "-n", required=True, type=str, help="Name of the package to be checked.")
+@click.option("--version", "-v", "package_version", type=str, help="Verify the package is installed in this version.")
+@click.option("--index-url", "-u", type=str, help="Verify the package was installed from this index.")
+@click.option("--author", type=str, help="Verify the package is authored by this author when verifying provenance.")
+@click.option(
+    "--check-index",
+    is_flag=True,
+    help="Also verify artifacts locked are published by the index, fetching its page over the network.",
+)
+def cli(
+    project_dir: str,
+    package_name: str,
+    package_version: Optional[str],
+    index_url: Optional[str],
+    author: Optional[str],
+    check_index: bool,
+):
+    """Print provenance of a package installed in a pipenv project, optionally verifying it."""
+    daiquiri.setup(level=logging.INFO)
+    if package_version and index_url:
+        provenance = verify_provenance(
+            project_dir, package_name, package_version, index_url, author=author, check_index=check_index
+        )
+    elif package_version or index_url:
+        raise click.UsageError("Both --version and --index-url are required to verify provenance")
+    else:
+        provenance = read_provenance(project_dir, package_name)
+
+    json.dump(provenance, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -17,14 +17,11 @@
 
 import os
 import logging
-import requests
 from typing import List
 
 import click
-from thoth.common import init_logging
-from thoth.python import Pipfile
 
-init_logging()
+from http_client import get_client
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -77,7 +74,7 @@ def _create_units(
     image_repo = f"https://quay.io/repository/thoth-station/{ps_name}"
     image = f"quay.io/thoth-station/{ps_name}"
 
-    response = requests.head(f"https://{image}", allow_redirects=True)
+    response = get_client().head(f"https://{image}", allow_redirects=True)
     if response.status_code != 200:
         _LOGGER.warning("Image %r is not accessible on Quay", image)
 
@@ -137,6 +134,12 @@ def cli(
     predictable_stack_abbreviation: str,
 ) -> None:
     """Create prescriptions out of a predictable stack repository."""
+    # Thoth libraries are expensive to import, load them only when the command is run.
+    from thoth.common import init_logging
+    from thoth.python import Pipfile
+
+    init_logging()
+
     if verbose:
         _LOGGER.setLevel(logging.DEBUG)
 
@@ -3,15 +3,16 @@
 import sys
 import logging
 
-import requests
 import daiquiri
 import click
 
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
+
 GITHUB_URL_BASE = "https://api.github.com/search/repositories"
 SELINON_API_URL = "http://selinon-api-fpokorny-thoth-dev.cloud.paas.psi.redhat.com/api/v1/run-flow"
 
-daiquiri.setup(level=logging.INFO)
-
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -26,28 +27,35 @@ _LOGGER = logging.getLogger(__name__)
               help="Number of pages to be considered when querying GitHub API.")
 @click.option('--offset', '-f', type=int, default=0, show_default=True,
               help="Offset for pages considered when querying GitHub API.")
+@instrumentation_options
 def cli(travis_token: str = None, github_token: str = None, selinon_api: str = None, pages: int = 1, offset: int = 0):
     """Trigger aggregation of build logs in Travis API."""
+    daiquiri.setup(level=logging.INFO)
+    client = get_client()
     for i in range(offset, offset + pages):
-        response = requests.get(
-            GITHUB_URL_BASE,
-            params={"q": "language:python", "sort": "stars", "order": "desc", "page": i},
-            headers={"Authorization": f"token {github_token}"},
-        )
-        response.raise_for_status()
-        content = response.json()
+        with span("fetch"):
+            response = client.get(
+                GITHUB_URL_BASE,
+                params={"q": "language:python", "sort": "stars", "order": "desc", "page": i},
+                headers={"Authorization": f"token {github_token}"},
+            )
+            response.raise_for_status()
+            content = response.json()
 
         for item in content['items']:
             org, repo = item["full_name"].split("/")
 
-            response = requests.post(
-                selinon_api,
-                params={"flow_name": "travis_repo_logs"},
-                json={"organization": org, "repo": repo, "token": travis_token},
-            )
-            response.raise_for_status()
+            with span("submit"):
+                response = client.post(
+                    selinon_api,
+                    params={"flow_name": "travis_repo_logs"},
+                    json={"organization": org, "repo": repo, "token": travis_token},
+                )
+                response.raise_for_status()
             _LOGGER.info("Submitted %s/%s" % (org, repo))
 
+    client.metrics.log_summary()
+
 
 if __name__ == "__main__":
     sys.exit(cli())
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
 
-import requests
 import click
 import logging
 import daiquiri
 
-daiquiri.setup(level=logging.INFO)
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
 
 _LOGGER = daiquiri.getLogger(__name__)
 
@@ -14,9 +15,10 @@ DOCKERHUB_API_URL = 'https://hub.docker.com/'
 THOTH_ANALYZER_NAME = 'fridex/thoth-package-extract'
 
 
+@span("fetch")
 def list_dockerhub_images(dockerhub_user: str, dockerhub_password: str, organization: str) -> list:
     """List images on docker hub in the given organization."""
-    response = requests.post(DOCKERHUB_API_URL + '/v2/users/login/', json={
+    response = get_client().post(DOCKERHUB_API_URL + '/v2/users/login/', json={
         'username': dockerhub_user,
         'password': dockerhub_password
     })
@@ -24,7 +26,7 @@ def list_dockerhub_images(dockerhub_user: str, dockerhub_password: str, organiza
     token = response.json()['token']
 
     # TODO: pagination
-    response = requests.get(
+    response = get_client().get(
         DOCKERHUB_API_URL + f'/v2/repositories/{organization}',
         headers={'Authorization': f'JWT {token}'},
         params={'page_size': 100}
@@ -34,10 +36,11 @@ def list_dockerhub_images(dockerhub_user: str, dockerhub_password: str, organiza
     return response.json()['results']
 
 
+@span("submit")
 def analyze_image(image: str, thoth_user_api: str) -> str:
     """Analyze the given image in Thoth."""
     _LOGGER.info(f"Requesting analysis of image {image}")
-    response = requests.post(thoth_user_api + '/api/v1/analyze', params={
+    response = get_client().post(thoth_user_api + '/api/v1/analyze', params={
         'image': image,
         'analyzer': THOTH_ANALYZER_NAME,
         'debug': True
@@ -72,8 +75,10 @@ def analyze_radanalytics_images(dockerhub_user: str, dockerhub_password: str, th
               help="A username of Dockerhub account to be used.")
 @click.option('--thoth-user-api', '-a', required=True, type=str,
               help="An URL to Thoth's user API.")
+@instrumentation_options
 def cli(ctx=None, verbose=0, dockerhub_user=None, dockerhub_password=None, thoth_user_api=None):
     """Submit analysis for Radanalytics images hosted on Dockerhub."""
+    daiquiri.setup(level=logging.INFO)
     if ctx:
         ctx.auto_envvar_prefix = 'THOTH_RADANALYTICS'
 
@@ -83,6 +88,7 @@ def cli(ctx=None, verbose=0, dockerhub_user=None, dockerhub_password=None, thoth
         _LOGGER.debug(f"Passed options: {locals()}")
 
     analyze_radanalytics_images(dockerhub_user, dockerhub_password, thoth_user_api)
+    get_client().metrics.log_summary()
 
 
 if __name__ == '__main__':
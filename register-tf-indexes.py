@@ -1,12 +1,14 @@
 import logging
 
-import requests
 import click
 from bs4 import BeautifulSoup
 import daiquiri
 
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
+from job_queue import JobQueue
 
-daiquiri.setup(level=logging.INFO)
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -17,7 +19,7 @@ def _get_build_configuration(index_base_url, distro) -> list:
     """Get available configration for a distro."""
     build_configuration_url = index_base_url + '/' + distro
 
-    response = requests.get(build_configuration_url)
+    response = get_client().get(build_configuration_url)
     soup = BeautifulSoup(response.text, 'lxml')
     table = soup.find('table')
     if not table:
@@ -36,10 +38,11 @@ def _get_build_configuration(index_base_url, distro) -> list:
     return configurations
 
 
+@span("fetch")
 def _list_available_indexes(index_base_url: str) -> list:
     """List available indexes on AICoE index."""
     _LOGGER.info("Listing available indexes on AICoE index %r.", index_base_url)
-    response = requests.get(index_base_url)
+    response = get_client().get(index_base_url)
     soup = BeautifulSoup(response.text, 'lxml')
 
     result = []
@@ -55,22 +58,32 @@ def _list_available_indexes(index_base_url: str) -> list:
     return result
 
 
-def _register_index(index: str, management_api_url: str, secret: str = None):
-    """Register the given index on management API."""
-    _LOGGER.info("Registering index %r on management API %r", index, management_api_url)
+@span("submit")
+def _register_index(index: str, management_api_url: str, secret: str = None, job_queue: JobQueue = None):
+    """Register the given index on management API, or enqueue the registration if a job queue is given."""
     if not management_api_url.endswith('/'):
         management_api_url += '/'
 
     endpoint = management_api_url + 'api/v1/register-python-package-index'
-    response = requests.post(
-            endpoint,
-            json={
-                'url': index,
-                'verify_ssl': False,
-                'warehouse_api_url': ''
-            },
-            params={'secret': secret}
-    )
+    request = {
+        'url': endpoint,
+        'json': {
+            'url': index,
+            'verify_ssl': False,
+            'warehouse_api_url': ''
+        },
+        'params': {'secret': secret},
+    }
+
+    if job_queue:
+        if job_queue.enqueue(f'register-index:{endpoint}:{index}', 'http', {'method': 'POST', **request}):
+            _LOGGER.info("Enqueued registration of index %r on management API %r", index, management_api_url)
+        else:
+            _LOGGER.info("Registration of index %r was already enqueued", index)
+        return
+
+    _LOGGER.info("Registering index %r on management API %r", index, management_api_url)
+    response = get_client().post(**request)
     print(response.text)
     response.raise_for_status()
 
@@ -84,10 +97,22 @@ def _register_index(index: str, management_api_url: str, secret: str = None):
               help="Management API where indexes should be registered.")
 @click.option('--secret', type=str,
               help="Management API where indexes should be registered.")
-def cli(verbose: bool = False, management_api_url: str = None, index_base_url: str = None, secret: str = None):
+@click.option('--queue', '-q', 'queue_path', type=str,
+              help="Enqueue registrations into the given job queue instead of submitting them directly.")
+@instrumentation_options
+def cli(verbose: bool = False, management_api_url: str = None, index_base_url: str = None, secret: str = None,
+        queue_path: str = None):
     """Register AICoE indexes in Thoth's database."""
+    daiquiri.setup(level=logging.INFO)
+    job_queue = JobQueue(queue_path) if queue_path else None
     for index in _list_available_indexes(index_base_url):
-        _register_index(index, management_api_url, secret)
+        _register_index(index, management_api_url, secret, job_queue)
+
+    if job_queue:
+        _LOGGER.info("Registrations enqueued into %r, drain the queue to submit them", queue_path)
+        job_queue.close()
+
+    get_client().metrics.log_summary()
 
 
 if __name__ == '__main__':
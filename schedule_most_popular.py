@@ -16,58 +16,109 @@
 
 """Schedule analysis of most popular Python packages on PyPI."""
 
-import requests
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import daiquiri
 
+from adaptive_limiter import AdaptiveLimiter
+from adaptive_limiter import limiter_options
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
+from job_queue import JobQueue
+from negative_cache import NegativeCache
 
-daiquiri.setup(level=logging.INFO)
 
 _LOGGER = logging.getLogger(__name__)
 
 _POPULAR_PYPI_PACKAGES = "https://hugovk.github.io/top-pypi-packages/top-pypi-packages-30-days.min.json"
-
-
-def schedule_most_popular(management_api_url: str, api_secret: str, *, offset: int, count: int) -> None:
-    """Schedule analysis of most popular Python packages present on PyPI."""
+_PYPI_INDEX_URL = "https://pypi.org/simple"
+
+
+def schedule_most_popular(
+    management_api_url: str,
+    api_secret: str,
+    *,
+    offset: int,
+    count: int,
+    popular_packages_url: str = _POPULAR_PYPI_PACKAGES,
+    queue_path: str = None,
+    limiter: AdaptiveLimiter = None,
+    negative_cache_path: str = None,
+) -> None:
+    """Schedule analysis of most popular Python packages present on PyPI, or enqueue it if a queue is given.
+
+    Solver runs are scheduled sequentially unless an adaptive limiter is given, in which case they are
+    scheduled concurrently as long as management API copes with it. If a negative cache is given, packages
+    known to fail are not scheduled and versions known to fail are excluded from solver runs.
+    """
     _LOGGER.info("Obtaining list of most popular Python packages...")
-    response = requests.get(_POPULAR_PYPI_PACKAGES)
-    response.raise_for_status()
-
+    client = get_client()
+    with span("fetch"):
+        response = client.get(popular_packages_url)
+        response.raise_for_status()
+
+    job_queue = JobQueue(queue_path) if queue_path else None
+    negative_cache = NegativeCache(negative_cache_path) if negative_cache_path else None
+    submitted = []
+    executor = ThreadPoolExecutor(max_workers=limiter.max_limit if limiter else 1)
     for idx, item in enumerate(response.json()["rows"][offset:offset + count]):
         project = item["project"]
         if project in ("wheel", "pip", "setuptools", "six"):
             _LOGGER.info("Omitting %d. most popular project %r", offset + idx, item["project"])
             continue
 
+        failing_versions = negative_cache.failing_versions(project, _PYPI_INDEX_URL) if negative_cache else set()
+        if "" in failing_versions:
+            _LOGGER.info("Omitting %d. most popular project %r, it is known to fail", offset + idx, project)
+            continue
+        elif failing_versions:
+            _LOGGER.info("Excluding versions of project %r known to fail: %s", project, sorted(failing_versions))
+
+        request = {
+            "url": f"{management_api_url}/solver/python",
+            "json": {
+                "package_name": project,
+                "version_specifier": ",".join(f"!={version}" for version in sorted(failing_versions))
+            },
+            "params": {
+                "secret": api_secret,
+                "debug": True,
+            }
+        }
+
+        if job_queue:
+            # Solver runs are safe to repeat, see _submit.
+            job = {"method": "POST", "idempotent": True, **request}
+            if job_queue.enqueue(f"solver:{management_api_url}:{project}", "http", job):
+                _LOGGER.info("Enqueued solver run for %d. most popular project %r", offset + idx, project)
+            else:
+                _LOGGER.info("Solver run for %d. most popular project %r was already enqueued", offset + idx, project)
+            continue
+
         _LOGGER.info("Scheduling solver run for %d. most popular project %r", offset + idx, item["project"])
+        submitted.append(executor.submit(_submit, request, limiter))
+
+    if negative_cache:
+        negative_cache.close()
+
+    with executor:
+        for future in submitted:
+            _LOGGER.info(future.result())
 
-        # A simple workaround for network issues in the cluster when talking to the graph database.
-        retries = 0
-        while True:
-            response = requests.post(
-                f"{management_api_url}/solver/python",
-                json={
-                    "package_name": project,
-                    "version_specifier": ""
-                },
-                params={
-                    "secret": api_secret,
-                    "debug": True,
-                }
-            )
-            try:
-                response.raise_for_status()
-            except Exception:
-                retries += 1
-                if retries == 3:
-                    raise
-
-            _LOGGER.info(response.json())
-            break
+
+@span("submit")
+def _submit(request: dict, limiter: AdaptiveLimiter = None) -> dict:
+    """Schedule a solver run on management API."""
+    # Scheduling a solver run twice only solves the package twice, so failed requests are retried like
+    # idempotent ones to work around network issues in the cluster when talking to the graph database;
+    # the limiter backs off when the cluster gets overloaded.
+    response = get_client().post(**request, limiter=limiter, idempotent=True)
+    response.raise_for_status()
+    return response.json()
 
 
 @click.command()
@@ -80,14 +131,38 @@ def schedule_most_popular(management_api_url: str, api_secret: str, *, offset: i
               help="Offset in the popularity package listing.")
 @click.option('--count', '-c', type=int, default=100, show_default=True,
               help="Number of packages to be scheduled.")
-def cli(api_secret: str, management_api_url: str, offset: int, count: int):
+@click.option('--popular-packages-url', type=str, default=_POPULAR_PYPI_PACKAGES, show_default=True,
+              help="URL to a listing of most popular Python packages.")
+@click.option('--queue', '-q', 'queue_path', type=str,
+              help="Enqueue solver runs into the given job queue instead of scheduling them directly; "
+                   "the queue stores the API secret.")
+@click.option('--negative-cache', 'negative_cache_path', type=str,
+              help="Negative cache (see negative_cache.py) of packages and versions solvers are known to fail on.")
+@limiter_options
+@instrumentation_options
+def cli(
+    api_secret: str,
+    management_api_url: str,
+    offset: int,
+    count: int,
+    popular_packages_url: str,
+    queue_path: str,
+    negative_cache_path: str,
+    limiter: AdaptiveLimiter,
+):
     """Trigger analysis of most popular Python packages on PyPI."""
+    daiquiri.setup(level=logging.INFO)
     schedule_most_popular(
         management_api_url,
         api_secret,
         offset=offset,
         count=count,
+        popular_packages_url=popular_packages_url,
+        queue_path=queue_path,
+        limiter=limiter,
+        negative_cache_path=negative_cache_path,
     )
+    get_client().metrics.log_summary()
 
 
 if __name__ == "__main__":
@@ -22,43 +22,60 @@ import logging
 import os
 import subprocess
 import json
-from thoth.python import Source
-from thoth.python import Project
-from thoth.python import PackageVersion
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from pathlib import Path
-from exceptions import NotInstalledIndexException
+from typing import Callable
 from exceptions import FileCreationException
 from exceptions import ScriptFrameworkIncompatibilityException
+from exceptions import WaveSchedulingException
 
 
 import click
 import daiquiri
 
+from adaptive_limiter import AdaptiveLimiter
+from adaptive_limiter import limiter_options
+from env_fingerprint import FingerprintIndex
+from lock_resolver import lock_pipfile
 from pipefile2json import pipfile2dict
-
-daiquiri.setup(level=logging.INFO)
+from spec_validator import check_specification
+from wave_scheduler import load_quotas
+from wave_scheduler import schedule_in_waves
+from wheel_mirror import find_links_path
+from provenance import verify_provenance
+from amun_collector import collect_inspection_results
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
+from job_queue import JobQueue
 
 _LOGGER = logging.getLogger(__name__)
 
+_PYPI_INDEX_URL = "https://pypi.org/simple"
+# Author stated in metadata of frameworks built by Red Hat AICoE Thoth Project and served by AICoE indexes.
+_AICOE_AUTHOR = "Red Hat Inc."
+
 
-def verify_framework_version_installed(framework_name: str, path: str, index_url: str):
+@span("verify_framework_version_installed")
+def verify_framework_version_installed(
+    framework_name: str, framework_version: str, path: str, index_url: str
+) -> dict:
     """Verify framework/version installed provenance."""
-    p = subprocess.Popen(
-        ["pipenv", "run", "pip", "show", framework_name],
-        cwd=path,
-        stdout=subprocess.PIPE,
+    provenance = verify_provenance(
+        path,
+        framework_name,
+        framework_version,
+        index_url,
+        author=None if index_url.rstrip("/") == _PYPI_INDEX_URL else _AICOE_AUTHOR,
     )
-    out, err = p.communicate()
-    _LOGGER.info(out.decode("utf-8"))
-    if not index_url == "https://pypi.org/simple":
-        if "Red Hat Inc." in out.decode("utf-8"):
-            _LOGGER.info(
-                "The index used for installation is from Red Hat AICoE Thoth Project"
-            )
-        else:
-            raise NotInstalledIndexException(
-                f"The index used for installation is not the one requested: {out}"
-            )
+    _LOGGER.info(
+        f"Framework {provenance['name']}=={provenance['version']} by {provenance['author']!r} "
+        f"was installed from an artifact locked to {index_url!r}"
+    )
+    return provenance
 
 
 def create_amun_api_input(
@@ -70,9 +87,16 @@ def create_amun_api_input(
     framework_version: str,
     index_url: str,
     benchmark: str,
+    lock_only: bool = False,
+    find_links: str = None,
+    on_locked: Callable[[dict], bool] = None,
 ) -> dict:
-    """Create specification for Amun API input."""
-    with open("./inspection.json") as json_file:
+    """Create specification for Amun API input.
+
+    The callback is called with the specification once requirements are locked; if it returns False,
+    packages are not installed, the template is kept untouched and None is returned.
+    """
+    with span("template_io"), open("./inspection.json") as json_file:
         specification = json.load(json_file)
 
     # Name of the inspection/s
@@ -89,24 +113,38 @@ def create_amun_api_input(
     else:
         python_packages = []
     specification["python_packages"] = python_packages
-    create_pipfile_and_pipfile_lock_inputs(
-        framework=framework, framework_version=framework_version, index_url=index_url
+    # Insert script for performance test
+    specification["script"] = benchmark
+
+    def locked(requirements_locked: dict) -> bool:
+        """Pass the specification with locked requirements to the callback."""
+        specification["python"]["requirements_locked"] = requirements_locked
+        return on_locked(specification)
+
+    installed = create_pipfile_and_pipfile_lock_inputs(
+        framework=framework,
+        framework_version=framework_version,
+        index_url=index_url,
+        lock_only=lock_only,
+        find_links=find_links,
+        on_locked=locked if on_locked else None,
     )
+    if not installed:
+        return None
+
     # Insert Pipfile and Pipfile.lock and make them str for input
     current_path = Path.cwd()
     new_dir_path = current_path.joinpath("amun")
     pipfile_path = new_dir_path.joinpath("Pipfile")
     pipfile_lock_path = new_dir_path.joinpath("Pipfile.lock")
 
-    specification["python"]["requirements"] = pipfile2dict(pipfile_path=pipfile_path)
-    with open(pipfile_lock_path) as json_file:
-        requirements_locked = json.load(json_file)
+    with span("template_io"):
+        specification["python"]["requirements"] = pipfile2dict(pipfile_path=pipfile_path)
+        with open(pipfile_lock_path) as json_file:
+            requirements_locked = json.load(json_file)
 
     specification["python"]["requirements_locked"] = requirements_locked
 
-    # Insert script for performance test
-    specification["script"] = benchmark
-
     update_json_specification(
         path_template_specification="./inspection.json", content=specification
     )
@@ -114,6 +152,7 @@ def create_amun_api_input(
     return specification
 
 
+@span("template_io")
 def update_json_specification(path_template_specification: str, content: object):
     """Update the json specification with new changes."""
     os.remove("{}".format(path_template_specification))
@@ -122,10 +161,16 @@ def update_json_specification(path_template_specification: str, content: object)
         json.dump(content, outfile, indent=4)
 
 
+@span("create_pipfile")
 def create_pipfile(
     index_url: str, framework: str, framework_version: str, pipfile_path: str
 ):
     """Create Pipfile from inputs."""
+    # thoth-python is expensive to import, load it only when a Pipfile is created.
+    from thoth.python import Source
+    from thoth.python import Project
+    from thoth.python import PackageVersion
+
     packages = [
         PackageVersion(
             name=f"{framework}",
@@ -147,9 +192,20 @@ def create_pipfile(
 
 
 def create_pipfile_and_pipfile_lock_inputs(
-    framework: str, framework_version: str, index_url: str
-):
-    """Create requirements and requirements_locked."""
+    framework: str,
+    framework_version: str,
+    index_url: str,
+    lock_only: bool = False,
+    find_links: str = None,
+    on_locked: Callable[[dict], bool] = None,
+) -> bool:
+    """Create requirements and requirements_locked, return False if packages were not to be installed.
+
+    In lock-only mode, Pipfile.lock is resolved from index metadata and nothing is installed. Otherwise
+    packages are installed using pipenv, preferring files from the given wheel store (see wheel_mirror.py).
+    The callback is called with Pipfile.lock content once it is resolved, packages are installed only if
+    it returns True.
+    """
     current_path = Path.cwd()
     new_dir_path = current_path.joinpath("amun")
     os.makedirs(new_dir_path, exist_ok=True)
@@ -178,17 +234,44 @@ def create_pipfile_and_pipfile_lock_inputs(
     else:
         raise FileCreationException("Pipfile was not created!")
 
-    _LOGGER.info(" ".join(["Running...", "pipenv", "install"]))
-    subprocess.call(["pipenv", "install"], cwd=new_dir_path)
-    verify_framework_version_installed(
-        framework_name=framework, path=new_dir_path, index_url=index_url
-    )
+    env = dict(os.environ)
+    if lock_only:
+        _LOGGER.info("Resolving Pipfile.lock without installing packages...")
+        lock_pipfile(str(pipfile_path), str(pipfile_lock_path))
+    else:
+        if find_links:
+            if os.path.isdir(find_links):
+                find_links = find_links_path(find_links)
+            _LOGGER.info(f"Using wheels found in {find_links!r}")
+            env["PIP_FIND_LINKS"] = find_links
+        # Lock first and install the locked packages only once it is known they are needed.
+        _LOGGER.info(" ".join(["Running...", "pipenv", "lock"]))
+        with span("pipenv_lock"):
+            subprocess.call(["pipenv", "lock"], cwd=new_dir_path, env=env)
 
     if os.path.exists(pipfile_lock_path):
         _LOGGER.info("Pipfile.lock was created!")
     else:
         raise FileCreationException("Pipfile.lock was not created!")
 
+    if on_locked:
+        with open(pipfile_lock_path) as json_file:
+            if not on_locked(json.load(json_file)):
+                return False
+
+    if not lock_only:
+        _LOGGER.info(" ".join(["Running...", "pipenv", "sync"]))
+        with span("pipenv_install"):
+            subprocess.call(["pipenv", "sync"], cwd=new_dir_path, env=env)
+        verify_framework_version_installed(
+            framework_name=framework,
+            framework_version=framework_version,
+            path=str(new_dir_path),
+            index_url=index_url,
+        )
+
+    return True
+
 
 def verify_script_framework_compatibility(framework: str, script: str):
     """Verify compatibility between framework and script to used for performances."""
@@ -203,6 +286,26 @@ def verify_script_framework_compatibility(framework: str, script: str):
         )
 
 
+@span("submit")
+def submit_inspection(amun_api_url: str, specification: dict, limiter: AdaptiveLimiter = None) -> str:
+    """Submit an inspection to Amun API, return its id."""
+    response = get_client().post(
+        amun_api_url,
+        json=specification,
+        headers={"Accept": "application/json"},
+        limiter=limiter,
+    )
+    response.raise_for_status()
+    return response.json()["inspection_id"]
+
+
+def _record_inspection_id(inspection_ids_file: str, inspection_id: str) -> None:
+    """Append id of a scheduled inspection to the given file, if any."""
+    if inspection_ids_file:
+        with open(inspection_ids_file, "a") as ids_file:
+            ids_file.write(inspection_id + "\n")
+
+
 def schedule_performance_benchmarks(
     amun_api_url: str,
     name_inspection: str,
@@ -215,9 +318,34 @@ def schedule_performance_benchmarks(
     index_url: str,
     count: int,
     dry_run: bool,
-):
-    """Schedule Performance benchmark."""
+    inspection_ids_file: str = None,
+    output_dir: str = None,
+    concurrency: int = 16,
+    queue_path: str = None,
+    limiter: AdaptiveLimiter = None,
+    lock_only: bool = False,
+    find_links: str = None,
+    fingerprint_index: str = None,
+    quota_path: str = None,
+    deadline: float = None,
+) -> list:
+    """Schedule Performance benchmark, return ids of scheduled inspections.
+
+    If a fingerprint index is given, inspections already run with the same specification count towards
+    the number of inspections requested, nothing is installed nor scheduled if there are enough of them.
+    Only results collected into the output directory are added to the index, results of inspections
+    enqueued or not collected can be added later using env_fingerprint.py index.
+    If a job queue is given, inspections are enqueued instead and scheduled once the queue is drained.
+    Inspections are submitted sequentially unless an adaptive limiter is given, in which case they are
+    submitted concurrently as long as Amun API copes with it.
+    If quotas of hardware classes are given (see wave_scheduler.py), inspections are submitted in waves
+    fitting them instead, each wave once inspections submitted before finish, giving up on inspections
+    still running once the deadline (in seconds) passes.
+    If scheduling some of the inspections fails, results of the ones scheduled are still collected into
+    the output directory before the error is raised.
+    """
     verify_script_framework_compatibility(framework=framework, script=benchmark)
+    quotas = load_quotas(quota_path) if quota_path else None
     _LOGGER.info(f"Platform/Base Image selected is {base_image}")
     _LOGGER.info(f"Native packages to be installed on base image: {native_packages}")
     _LOGGER.info(f"Python packages to be installed on base image: {python_packages}")
@@ -225,6 +353,14 @@ def schedule_performance_benchmarks(
     _LOGGER.info(f"Index source is: {index_url}")
     _LOGGER.info(f"Performance test selected is: {benchmark}")
     _LOGGER.info(f"Number of inspections requested is: {count}")
+    measured = []
+
+    def lookup_measured(specification: dict) -> bool:
+        """Look up inspections already run with the specification, return True if more are needed."""
+        with FingerprintIndex(fingerprint_index) as index:
+            measured.extend(index.measured(specification))
+        return len(measured) < count
+
     specification = create_amun_api_input(
         name_inspection=name_inspection,
         base_image=base_image,
@@ -234,27 +370,105 @@ def schedule_performance_benchmarks(
         framework_version=framework_version,
         index_url=index_url,
         benchmark=benchmark,
+        lock_only=lock_only,
+        find_links=find_links,
+        on_locked=lookup_measured if fingerprint_index else None,
     )
+    if measured:
+        _LOGGER.info(f"{len(measured)} inspections were already run with the same specification: {measured}")
+        count = max(count - len(measured), 0)
+        _LOGGER.info(f"Number of inspections to be scheduled is: {count}")
+    if specification is None:
+        _LOGGER.info("All inspections requested were already run, nothing to schedule")
+        return []
+
     _LOGGER.info(f"Scheduling inspection at {amun_api_url}")
     _LOGGER.info(f"Specification input for Amun API is: {specification}")
+    with span("validate"):
+        # Fail before any inspection is scheduled rather than once Amun has given it a build slot.
+        check_specification(specification)
+
+    inspection_ids = []
+    submitted = []
+    executor = ThreadPoolExecutor(max_workers=limiter.max_limit if limiter else 1)
+    job_queue = JobQueue(queue_path) if queue_path and not dry_run else None
+    specification_digest = hashlib.sha256(json.dumps(specification, sort_keys=True).encode()).hexdigest()
     for inspection_n in range(0, count):
         _LOGGER.info(inspection_n + 1)
-        if not dry_run:
-            subprocess.call(
-                [
-                    "curl",
-                    "-X",
-                    "POST",
-                    "--header",
-                    "Content-Type: application/json",
-                    "--header",
-                    "Accept: application/json",
-                    "-d",
-                    "@inspection.json",
-                    amun_api_url,
-                ]
+        if job_queue:
+            job_queue.enqueue(
+                f"inspect:{amun_api_url}:{specification_digest}:{inspection_n}",
+                "http",
+                {
+                    "method": "POST",
+                    "url": amun_api_url,
+                    "json": specification,
+                    "headers": {"Accept": "application/json"},
+                },
+            )
+        elif not dry_run and not quotas:
+            submitted.append(executor.submit(submit_inspection, amun_api_url, specification, limiter))
+
+    error = None
+    with executor:
+        for future in as_completed(submitted):
+            try:
+                inspection_id = future.result()
+            except Exception as exc:
+                _LOGGER.error(f"Failed to schedule inspection: {exc}")
+                error = error or exc
+                continue
+
+            _LOGGER.info(f"Scheduled inspection {inspection_id!r}")
+            inspection_ids.append(inspection_id)
+            _record_inspection_id(inspection_ids_file, inspection_id)
+
+    unfinished = []
+    if quotas and not dry_run and not job_queue:
+        # Results are stored as inspections finish, the collection below only picks up the ones missed.
+        try:
+            inspection_ids = schedule_in_waves(
+                amun_api_url,
+                [specification] * count,
+                quotas,
+                functools.partial(submit_inspection, amun_api_url, limiter=limiter),
+                on_scheduled=functools.partial(_record_inspection_id, inspection_ids_file),
+                output_dir=output_dir,
+                concurrency=concurrency,
+                deadline=deadline,
+            )
+        except WaveSchedulingException as exc:
+            # Inspections that did not finish by the deadline are not waited for again below.
+            inspection_ids = exc.inspection_ids
+            unfinished = exc.unfinished
+            error = exc
+
+    if job_queue:
+        _LOGGER.info(f"Inspections enqueued into {queue_path!r}, drain the queue to schedule them")
+        job_queue.close()
+
+    collected = [inspection_id for inspection_id in inspection_ids if inspection_id not in unfinished]
+    if output_dir and collected:
+        _LOGGER.info(f"Collecting results of {len(collected)} inspections into {output_dir!r}")
+        with span("collect"):
+            failed = collect_inspection_results(
+                amun_api_url, collected, output_dir, concurrency=concurrency
             )
 
+        if fingerprint_index:
+            results = []
+            for inspection_id in set(collected) - set(failed):
+                with open(os.path.join(output_dir, f"{inspection_id}.json")) as result_file:
+                    results.append(json.load(result_file))
+            with FingerprintIndex(fingerprint_index) as index:
+                index.add_results(results)
+
+    if error is not None:
+        # Ids of inspections scheduled successfully are already stored, they can be collected later.
+        raise error
+
+    return inspection_ids
+
 
 @click.command()
 @click.option(
@@ -340,6 +554,60 @@ def schedule_performance_benchmarks(
     show_default=True,
     help="Do not schedule inspections, just check all inputs are created.",
 )
+@click.option(
+    "--inspection-ids-file",
+    type=str,
+    help="A file to which ids of scheduled inspections are appended, one per line.",
+)
+@click.option(
+    "--output-dir",
+    "-o",
+    type=str,
+    help="Wait for scheduled inspections to finish and store their results in the given directory.",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    default=16,
+    show_default=True,
+    help="Maximum number of inspections polled at the same time when collecting results.",
+)
+@click.option(
+    "--queue",
+    "-q",
+    "queue_path",
+    type=str,
+    help="Enqueue inspections into the given job queue instead of scheduling them directly.",
+)
+@click.option(
+    "--lock-only",
+    is_flag=True,
+    help="Resolve Pipfile.lock from index metadata instead of installing the framework using pipenv.",
+)
+@click.option(
+    "--find-links",
+    type=str,
+    help="Wheel store (see wheel_mirror.py) or a find-links page to install the framework from when possible.",
+)
+@click.option(
+    "--fingerprint-index",
+    type=str,
+    help="Fingerprint index (see env_fingerprint.py) used to skip inspections already run with the same "
+    "specification, results collected into --output-dir are added to it.",
+)
+@click.option(
+    "--quota",
+    "quota_path",
+    type=str,
+    help="Quotas of hardware classes (see wave_scheduler.py) to submit inspections in waves fitting them.",
+)
+@click.option(
+    "--deadline",
+    type=float,
+    help="Seconds after which inspections submitted in waves (see --quota) and still running are given up on.",
+)
+@limiter_options
+@instrumentation_options
 def cli(
     amun_api_url: str,
     name_inspection: str,
@@ -352,8 +620,23 @@ def cli(
     index_url: str,
     count: int,
     dry_run: bool,
+    inspection_ids_file: str,
+    output_dir: str,
+    concurrency: int,
+    queue_path: str,
+    lock_only: bool,
+    find_links: str,
+    fingerprint_index: str,
+    quota_path: str,
+    deadline: float,
+    limiter: AdaptiveLimiter,
 ):
     """Trigger analysis of inspections for the selected platform/base_image, index_url and framework."""
+    daiquiri.setup(level=logging.INFO)
+    if quota_path and queue_path:
+        raise click.UsageError("Inspections enqueued cannot be submitted in waves, use either --queue or --quota")
+    if deadline is not None and not quota_path:
+        raise click.UsageError("Deadline applies only to inspections submitted in waves, use it with --quota")
     schedule_performance_benchmarks(
         amun_api_url=amun_api_url,
         name_inspection=name_inspection,
@@ -366,7 +649,18 @@ def cli(
         index_url=index_url,
         count=count,
         dry_run=dry_run,
+        inspection_ids_file=inspection_ids_file,
+        output_dir=output_dir,
+        concurrency=concurrency,
+        queue_path=queue_path,
+        limiter=limiter,
+        lock_only=lock_only,
+        find_links=find_links,
+        fingerprint_index=fingerprint_index,
+        quota_path=quota_path,
+        deadline=deadline,
     )
+    get_client().metrics.log_summary()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+
+"""Query dependency graphs of thoth-solver results held in compressed sparse row arrays.
+
+Packages found in solver documents are interned - each (name, version, index)
+triplet gets an integer node id and names, versions and indexes are stored
+once in string tables. Dependencies resolved by the solver become edges of the
+graph which are kept in compressed sparse row (CSR) form: neighbours of node n
+are indices[indptr[n]:indptr[n + 1]]. A reverse CSR is kept for dependents.
+Transitive queries expand a whole frontier of nodes at once using NumPy, so
+walking the graph does not go through Python objects per edge.
+
+Requirements of a package the solver could not resolve on an index, together
+with packages listed as unresolved by the solver, are kept in parallel arrays.
+
+A graph built from solver documents can be saved into a .npz file and loaded
+back without parsing the documents again.
+"""
+
+import os
+import sys
+import json
+import logging
+from array import array
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+
+import click
+import daiquiri
+import numpy as np
+from packaging.utils import canonicalize_name
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def iter_solver_documents(paths: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Iterate over solver documents stored in JSON files or directories with them."""
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+                if name.endswith(".json")
+            )
+        else:
+            files = [path]
+
+        for file_path in files:
+            with open(file_path) as document_file:
+                yield json.load(document_file)
+
+
+class _Interner:
+    """Assign consecutive integer ids to strings."""
+
+    def __init__(self) -> None:
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def __call__(self, value: str) -> int:
+        """Get id of the given string, assign a new one if the string was not seen yet."""
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return idx
+
+
+def _csr(sources: np.ndarray, targets: np.ndarray, node_count: int) -> Dict[str, np.ndarray]:
+    """Build CSR arrays out of edge lists, dropping duplicate edges; neighbours are sorted."""
+    keys = sources.astype(np.int64) * node_count + targets
+    keys.sort()
+    if len(keys):
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys // node_count, minlength=node_count), out=indptr[1:])
+    return {"indptr": indptr, "indices": (keys % node_count).astype(np.int32)}
+
+
+def _neighbours(indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+    """Gather neighbours of all the given nodes in one go."""
+    starts = indptr[nodes]
+    lengths = indptr[nodes + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int32)
+    # Position of each gathered edge: start of its node's row plus offset within the row.
+    row_offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[row_offsets + np.arange(total)]
+
+
+class SolverGraph:
+    """An immutable dependency graph of packages found in solver documents."""
+
+    _ARRAYS = (
+        "names",
+        "versions",
+        "indexes",
+        "node_name",
+        "node_version",
+        "node_index",
+        "indptr",
+        "indices",
+        "reverse_indptr",
+        "reverse_indices",
+        "unresolved_node",
+        "unresolved_name",
+        "unresolved_spec",
+        "unresolved_index",
+    )
+
+    def __init__(self, **arrays: np.ndarray) -> None:
+        """Create the graph out of its arrays, see GraphBuilder.build()."""
+        for name in self._ARRAYS:
+            setattr(self, name, arrays[name])
+        self._name_ids = {name: idx for idx, name in enumerate(self.names.tolist())}
+        self._version_ids = {version: idx for idx, version in enumerate(self.versions.tolist())}
+        self._index_ids = {index: idx for idx, index in enumerate(self.indexes.tolist())}
+
+    @property
+    def node_count(self) -> int:
+        """Get number of nodes (package, version, index triplets) in the graph."""
+        return len(self.node_name)
+
+    @property
+    def edge_count(self) -> int:
+        """Get number of dependency edges in the graph."""
+        return len(self.indices)
+
+    def save(self, path: str) -> None:
+        """Save arrays of the graph into an .npz file."""
+        np.savez(path, **{name: getattr(self, name) for name in self._ARRAYS})
+
+    @classmethod
+    def load(cls, path: str) -> "SolverGraph":
+        """Load a graph saved by save()."""
+        with np.load(path, allow_pickle=False) as arrays:
+            return cls(**{name: arrays[name] for name in cls._ARRAYS})
+
+    def find(self, package_name: str, version: Optional[str] = None, index_url: Optional[str] = None) -> np.ndarray:
+        """Get ids of nodes of the given package, optionally restricted to a version and an index."""
+        name_id = self._name_ids.get(canonicalize_name(package_name))
+        if name_id is None:
+            return np.empty(0, dtype=np.int64)
+
+        mask = self.node_name == name_id
+        if version is not None:
+            mask &= self.node_version == self._version_ids.get(version, -1)
+        if index_url is not None:
+            mask &= self.node_index == self._index_ids.get(index_url.rstrip("/"), -1)
+
+        return np.flatnonzero(mask)
+
+    def _walk(self, indptr: np.ndarray, indices: np.ndarray, nodes: np.ndarray, transitive: bool) -> np.ndarray:
+        """Get nodes reachable from the given nodes, in one step or transitively; the given nodes are left out."""
+        visited = np.zeros(self.node_count, dtype=bool)
+        visited[nodes] = True
+        reached = np.zeros(self.node_count, dtype=bool)
+        frontier = np.asarray(nodes)
+        while len(frontier):
+            neighbours = _neighbours(indptr, indices, frontier)
+            reached[neighbours] = True
+            if not transitive:
+                break
+            frontier = np.unique(neighbours[~visited[neighbours]])
+            visited[frontier] = True
+
+        reached[nodes] = False
+        return np.flatnonzero(reached)
+
+    def dependencies(self, nodes: np.ndarray, transitive: bool = False) -> np.ndarray:
+        """Get nodes the given nodes depend on."""
+        return self._walk(self.indptr, self.indices, nodes, transitive)
+
+    def dependents(self, nodes: np.ndarray, transitive: bool = False) -> np.ndarray:
+        """Get nodes which depend on the given nodes."""
+        return self._walk(self.reverse_indptr, self.reverse_indices, nodes, transitive)
+
+    def unresolved(self, index_url: Optional[str] = None) -> np.ndarray:
+        """Get positions of unresolved requirements, optionally only those not resolved on the given index."""
+        if index_url is None:
+            return np.arange(len(self.unresolved_name))
+        return np.flatnonzero(self.unresolved_index == self._index_ids.get(index_url.rstrip("/"), -1))
+
+    def describe_nodes(self, nodes: np.ndarray) -> List[Dict[str, str]]:
+        """Turn node ids into package names, versions and indexes."""
+        return [
+            {
+                "package_name": self.names[self.node_name[node]],
+                "package_version": self.versions[self.node_version[node]],
+                "index_url": self.indexes[self.node_index[node]],
+            }
+            for node in nodes.tolist()
+        ]
+
+    def describe_unresolved(self, positions: np.ndarray) -> List[Dict[str, Optional[str]]]:
+        """Turn positions of unresolved requirements into their description."""
+        result = []
+        for position in positions.tolist():
+            node = int(self.unresolved_node[position])
+            result.append(
+                {
+                    "package_name": self.names[self.unresolved_name[position]],
+                    "version_spec": self.versions[self.unresolved_spec[position]],
+                    "index_url": self.indexes[self.unresolved_index[position]],
+                    "required_by": self.describe_nodes(np.array([node]))[0] if node >= 0 else None,
+                }
+            )
+        return result
+
+
+class GraphBuilder:
+    """Accumulate solver documents into a SolverGraph."""
+
+    def __init__(self) -> None:
+        """Initialize an empty builder."""
+        self._names = _Interner()
+        self._versions = _Interner()
+        self._indexes = _Interner()
+        self._nodes: Dict[tuple, int] = {}
+        self._node_name = array("i")
+        self._node_version = array("i")
+        self._node_index = array("i")
+        self._sources = array("i")
+        self._targets = array("i")
+        self._unresolved: Dict[str, array] = {key: array("i") for key in ("node", "name", "spec", "index")}
+        self.documents = 0
+
+    def _node(self, package_name: str, version: str, index_url: Optional[str]) -> int:
+        """Get id of a node, create it if it does not exist."""
+        key = (
+            self._names(canonicalize_name(package_name)),
+            self._versions(version),
+            self._indexes((index_url or "").rstrip("/")),
+        )
+        node = self._nodes.get(key)
+        if node is None:
+            node = self._nodes[key] = len(self._node_name)
+            self._node_name.append(key[0])
+            self._node_version.append(key[1])
+            self._node_index.append(key[2])
+        return node
+
+    def _add_unresolved(
+        self, node: int, package_name: str, version_spec: Optional[str], index_url: Optional[str]
+    ) -> None:
+        """Record a requirement which could not be resolved."""
+        self._unresolved["node"].append(node)
+        self._unresolved["name"].append(self._names(canonicalize_name(package_name)))
+        self._unresolved["spec"].append(self._versions(version_spec or ""))
+        self._unresolved["index"].append(self._indexes((index_url or "").rstrip("/")))
+
+    def add(self, document: Dict[str, Any]) -> None:
+        """Add packages and dependencies found in a solver document."""
+        result = document.get("result") or {}
+        for entry in result.get("environment") or []:
+            self._node(entry["package_name"], entry["package_version"], None)
+
+        for entry in result.get("tree") or []:
+            node = self._node(entry["package_name"], entry["package_version"], entry.get("index_url"))
+            for dependency in entry.get("dependencies") or []:
+                targets = [
+                    self._node(dependency["package_name"], version, resolved_versions.get("index"))
+                    for resolved_versions in dependency.get("resolved_versions") or []
+                    for version in resolved_versions.get("versions") or []
+                ]
+                self._sources.extend([node] * len(targets))
+                self._targets.extend(targets)
+                if not targets:
+                    self._add_unresolved(
+                        node, dependency["package_name"], dependency.get("required_version"), entry.get("index_url")
+                    )
+
+        for entry in result.get("unresolved") or []:
+            self._add_unresolved(-1, entry["package_name"], entry.get("version_spec"), entry.get("index"))
+
+        self.documents += 1
+
+    def build(self) -> SolverGraph:
+        """Build the graph out of documents added so far."""
+        node_count = len(self._node_name)
+        # The same dependency is usually found in many documents, _csr() keeps each edge once.
+        sources = np.frombuffer(self._sources, dtype=np.int32)
+        targets = np.frombuffer(self._targets, dtype=np.int32)
+        forward = _csr(sources, targets, node_count)
+        reverse = _csr(targets, sources, node_count)
+        unresolved = {key: np.frombuffer(values, dtype=np.int32).copy() for key, values in self._unresolved.items()}
+        return SolverGraph(
+            names=np.array(self._names.values, dtype=str),
+            versions=np.array(self._versions.values, dtype=str),
+            indexes=np.array(self._indexes.values, dtype=str),
+            node_name=np.frombuffer(self._node_name, dtype=np.int32).copy(),
+            node_version=np.frombuffer(self._node_version, dtype=np.int32).copy(),
+            node_index=np.frombuffer(self._node_index, dtype=np.int32).copy(),
+            indptr=forward["indptr"],
+            indices=forward["indices"],
+            reverse_indptr=reverse["indptr"],
+            reverse_indices=reverse["indices"],
+            unresolved_node=unresolved["node"],
+            unresolved_name=unresolved["name"],
+            unresolved_spec=unresolved["spec"],
+            unresolved_index=unresolved["index"],
+        )
+
+
+def build_graph(documents: Iterable[Dict[str, Any]]) -> SolverGraph:
+    """Build a graph out of solver documents."""
+    builder = GraphBuilder()
+    for document in documents:
+        builder.add(document)
+    graph = builder.build()
+    _LOGGER.info(
+        "Built graph of %d documents with %d nodes and %d edges", builder.documents, graph.node_count, graph.edge_count
+    )
+    return graph
+
+
+def _print_nodes(nodes: List[Dict[str, Any]]) -> None:
+    """Print descriptions as JSON lines."""
+    for node in nodes:
+        sys.stdout.write(json.dumps(node) + "\n")
+
+
+@click.group()
+def cli():
+    """Build and query dependency graphs of thoth-solver results."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("build")
+@click.option("--output", "-o", required=True, type=str, help="Path to the .npz file the graph is saved to.")
+@click.argument("paths", nargs=-1, required=True)
+def cli_build(output: str, paths: List[str]):
+    """Build a graph out of solver documents stored in JSON files or directories with them."""
+    build_graph(iter_solver_documents(paths)).save(output)
+
+
+def _query_options(func):
+    """Add options selecting packages a query starts from."""
+    func = click.option("--transitive", "-t", is_flag=True, help="Follow dependencies transitively.")(func)
+    func = click.option("--index-url", "-u", type=str, help="Index the package was resolved on.")(func)
+    func = click.option("--version", "-v", "package_version", type=str, help="Version of the package.")(func)
+    func = click.argument("package_name", type=str)(func)
+    func = click.option("--graph", "-g", "graph_path", required=True, type=str, help="Path to a saved graph.")(func)
+    return func
+
+
+@cli.command("dependencies")
+@_query_options
+def cli_dependencies(
+    graph_path: str, package_name: str, package_version: Optional[str], index_url: Optional[str], transitive: bool
+):
+    """Print packages the given package depends on."""
+    graph = SolverGraph.load(graph_path)
+    nodes = graph.find(package_name, package_version, index_url)
+    _print_nodes(graph.describe_nodes(graph.dependencies(nodes, transitive=transitive)))
+
+
+@cli.command("dependents")
+@_query_options
+def cli_dependents(
+    graph_path: str, package_name: str, package_version: Optional[str], index_url: Optional[str], transitive: bool
+):
+    """Print packages which depend on the given package."""
+    graph = SolverGraph.load(graph_path)
+    nodes = graph.find(package_name, package_version, index_url)
+    _print_nodes(graph.describe_nodes(graph.dependents(nodes, transitive=transitive)))
+
+
+@cli.command("unresolved")
+@click.option("--graph", "-g", "graph_path", required=True, type=str, help="Path to a saved graph.")
+@click.option("--index-url", "-u", type=str, help="Print only requirements not resolved on this index.")
+def cli_unresolved(graph_path: str, index_url: Optional[str]):
+    """Print requirements the solver could not resolve."""
+    graph = SolverGraph.load(graph_path)
+    _print_nodes(graph.describe_unresolved(graph.unresolved(index_url)))
+
+
+if __name__ == "__main__":
+    cli()
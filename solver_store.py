@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+"""Ingest thoth-solver results into an embedded SQLite store.
+
+Solver documents are streamed into the store in batches, each batch in a single
+transaction. Package names, indexes and package versions are interned into
+their own tables so that the dependency, error and unresolved tables hold
+integer ids only. A solver document is identified by hostname and timestamp of
+its metadata - ingesting a document already stored is a no-op.
+
+Dependencies are stored once per package version and solver environment
+(operating system and Python version, e.g. fedora-29-py36) regardless of how
+many documents report them, as the same package version can resolve to
+different dependencies in different environments; packages solved in a
+document, errors and unresolved requirements are stored per document.
+"""
+
+import sys
+import json
+import sqlite3
+import logging
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import click
+import daiquiri
+from packaging.utils import canonicalize_name
+
+from negative_cache import solver_environment
+from solver_graph import iter_solver_documents
+
+_LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    hostname TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    analyzer_version TEXT,
+    os_name TEXT,
+    os_version TEXT,
+    python_version TEXT,
+    UNIQUE (hostname, timestamp)
+);
+CREATE TABLE IF NOT EXISTS package_names (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS indexes (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS environments (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS package_versions (
+    id INTEGER PRIMARY KEY,
+    name_id INTEGER NOT NULL REFERENCES package_names (id),
+    version TEXT NOT NULL,
+    index_id INTEGER NOT NULL REFERENCES indexes (id),
+    UNIQUE (name_id, version, index_id)
+);
+CREATE TABLE IF NOT EXISTS solved (
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    package_version_id INTEGER NOT NULL REFERENCES package_versions (id),
+    environment INTEGER NOT NULL,
+    PRIMARY KEY (document_id, package_version_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS solved_package_version ON solved (package_version_id);
+CREATE TABLE IF NOT EXISTS dependencies (
+    package_version_id INTEGER NOT NULL REFERENCES package_versions (id),
+    environment_id INTEGER NOT NULL REFERENCES environments (id),
+    dependency_id INTEGER NOT NULL REFERENCES package_versions (id),
+    required_version TEXT,
+    PRIMARY KEY (package_version_id, environment_id, dependency_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS dependencies_dependency ON dependencies (dependency_id);
+CREATE TABLE IF NOT EXISTS errors (
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    package_version_id INTEGER NOT NULL REFERENCES package_versions (id),
+    type TEXT,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS errors_package_version ON errors (package_version_id);
+CREATE TABLE IF NOT EXISTS unresolved (
+    document_id INTEGER NOT NULL REFERENCES documents (id),
+    name_id INTEGER NOT NULL REFERENCES package_names (id),
+    version_spec TEXT,
+    index_id INTEGER NOT NULL REFERENCES indexes (id)
+);
+CREATE INDEX IF NOT EXISTS unresolved_index ON unresolved (index_id, name_id);
+"""
+
+
+class SolverStore:
+    """A store of solver results kept in an SQLite database; not to be shared across threads."""
+
+    def __init__(self, path: str) -> None:
+        """Open (and create if needed) the store in the given database file."""
+        self.path = path
+        self._connection = sqlite3.connect(path, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(_SCHEMA)
+
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(dependencies)")}
+        if "environment_id" not in columns:
+            self._connection.close()
+            raise ValueError(
+                f"Store {path!r} keeps dependencies regardless of solver environments, they cannot be told apart "
+                "once stored; ingest solver documents into a new store"
+            )
+
+        self._load_caches()
+
+    def _load_caches(self) -> None:
+        """Load interned ids, they are cached in memory as intern tables are small compared to the rest."""
+        self._names = dict(self._connection.execute("SELECT name, id FROM package_names"))
+        self._indexes = dict(self._connection.execute("SELECT url, id FROM indexes"))
+        self._environments = dict(self._connection.execute("SELECT name, id FROM environments"))
+        self._package_versions = {
+            (name_id, version, index_id): idx
+            for idx, name_id, version, index_id in self._connection.execute(
+                "SELECT id, name_id, version, index_id FROM package_versions"
+            )
+        }
+        # Package versions with dependencies stored for an environment, other documents from the same
+        # environment reporting them are not walked again.
+        self._resolved = set(
+            self._connection.execute("SELECT DISTINCT package_version_id, environment_id FROM dependencies")
+        )
+
+    def close(self) -> None:
+        """Close the underlying database connection."""
+        self._connection.close()
+
+    def __enter__(self) -> "SolverStore":
+        """Use the store as a context manager."""
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """Close the store when leaving the context."""
+        self.close()
+
+    def _intern(self, cache: Dict[Any, int], table: str, columns: Tuple[str, ...], key: Any) -> int:
+        """Get id of a row in an intern table, insert it if it does not exist yet."""
+        idx = cache.get(key)
+        if idx is None:
+            values = key if isinstance(key, tuple) else (key,)
+            cursor = self._connection.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values
+            )
+            idx = cache[key] = cursor.lastrowid
+        return idx
+
+    def _name_id(self, package_name: str) -> int:
+        """Get id of a package name."""
+        return self._intern(self._names, "package_names", ("name",), canonicalize_name(package_name))
+
+    def _index_id(self, index_url: Optional[str]) -> int:
+        """Get id of an index, packages found in the solver environment have an empty index."""
+        return self._intern(self._indexes, "indexes", ("url",), (index_url or "").rstrip("/"))
+
+    def _package_version_id(self, package_name: str, version: str, index_url: Optional[str]) -> int:
+        """Get id of a package version."""
+        key = (self._name_id(package_name), version, self._index_id(index_url))
+        return self._intern(self._package_versions, "package_versions", ("name_id", "version", "index_id"), key)
+
+    def _add_document(self, document: Dict[str, Any]) -> bool:
+        """Add a single solver document, called within a transaction; return False if it is stored already."""
+        metadata = document.get("metadata") or {}
+        distribution = metadata.get("distribution") or {}
+        python = metadata.get("python") or {}
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO documents "
+            "(hostname, timestamp, analyzer_version, os_name, os_version, python_version) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                metadata["hostname"],
+                metadata["timestamp"],
+                metadata.get("analyzer_version"),
+                distribution.get("id"),
+                distribution.get("version"),
+                f"{python['major']}.{python['minor']}" if "major" in python else None,
+            ),
+        )
+        if not cursor.rowcount:
+            return False
+
+        document_id = cursor.lastrowid
+        environment_id = self._intern(self._environments, "environments", ("name",), solver_environment(metadata))
+        result = document.get("result") or {}
+        solved = {}
+        dependencies = {}
+        errors = []
+        unresolved = []
+
+        for entry in result.get("environment") or []:
+            solved[self._package_version_id(entry["package_name"], entry["package_version"], None)] = 1
+
+        for entry in result.get("tree") or []:
+            package_version_id = self._package_version_id(
+                entry["package_name"], entry["package_version"], entry.get("index_url")
+            )
+            solved.setdefault(package_version_id, 0)
+            if (package_version_id, environment_id) in self._resolved:
+                continue
+
+            self._resolved.add((package_version_id, environment_id))
+            for dependency in entry.get("dependencies") or []:
+                for resolved_versions in dependency.get("resolved_versions") or []:
+                    for version in resolved_versions.get("versions") or []:
+                        dependency_id = self._package_version_id(
+                            dependency["package_name"], version, resolved_versions.get("index")
+                        )
+                        dependencies[(package_version_id, dependency_id)] = dependency.get("required_version")
+
+        for entry in result.get("errors") or []:
+            package_version_id = self._package_version_id(entry["package_name"], entry["version"], entry.get("index"))
+            errors.append((document_id, package_version_id, entry.get("type"), json.dumps(entry.get("details"))))
+
+        for entry in result.get("unresolved") or []:
+            unresolved.append(
+                (
+                    document_id,
+                    self._name_id(entry["package_name"]),
+                    entry.get("version_spec"),
+                    self._index_id(entry.get("index")),
+                )
+            )
+
+        self._connection.executemany(
+            "INSERT INTO solved (document_id, package_version_id, environment) VALUES (?, ?, ?)",
+            [(document_id, package_version_id, environment) for package_version_id, environment in solved.items()],
+        )
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO dependencies "
+            "(package_version_id, environment_id, dependency_id, required_version) VALUES (?, ?, ?, ?)",
+            [
+                (source, environment_id, target, required_version)
+                for (source, target), required_version in dependencies.items()
+            ],
+        )
+        self._connection.executemany(
+            "INSERT INTO errors (document_id, package_version_id, type, details) VALUES (?, ?, ?, ?)", errors
+        )
+        self._connection.executemany(
+            "INSERT INTO unresolved (document_id, name_id, version_spec, index_id) VALUES (?, ?, ?, ?)", unresolved
+        )
+        return True
+
+    def ingest(self, documents: Iterable[Dict[str, Any]], batch_size: int = 100) -> Tuple[int, int]:
+        """Ingest solver documents in batches, return numbers of documents added and skipped."""
+        added = skipped = 0
+        documents = iter(documents)
+        while True:
+            batch = [document for _, document in zip(range(batch_size), documents)]
+            if not batch:
+                break
+
+            self._connection.execute("BEGIN")
+            try:
+                for document in batch:
+                    if not (document.get("metadata") or {}).get("hostname"):
+                        _LOGGER.warning("Document without solver metadata skipped")
+                        skipped += 1
+                    elif self._add_document(document):
+                        added += 1
+                    else:
+                        skipped += 1
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                # Caches were filled within the transaction, they must not outlive the rollback.
+                self._load_caches()
+                raise
+
+            _LOGGER.info("Ingested %d documents, %d skipped", added, skipped)
+
+        return added, skipped
+
+    def dependents(
+        self, package_name: str, version: Optional[str] = None, environment: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """Iterate over package versions which depend on the given package, optionally in the given environment."""
+        query = (
+            "SELECT dependent_name.name, dependent.version, dependent_index.url, dependency.version, "
+            "dependencies.required_version, environments.name "
+            "FROM package_names AS name "
+            "JOIN package_versions AS dependency ON dependency.name_id = name.id "
+            "JOIN dependencies ON dependencies.dependency_id = dependency.id "
+            "JOIN package_versions AS dependent ON dependent.id = dependencies.package_version_id "
+            "JOIN package_names AS dependent_name ON dependent_name.id = dependent.name_id "
+            "JOIN indexes AS dependent_index ON dependent_index.id = dependent.index_id "
+            "JOIN environments ON environments.id = dependencies.environment_id "
+            "WHERE name.name = ?"
+        )
+        parameters: List[Any] = [canonicalize_name(package_name)]
+        if version is not None:
+            query += " AND dependency.version = ?"
+            parameters.append(version)
+        if environment is not None:
+            query += " AND environments.name = ?"
+            parameters.append(environment)
+
+        for row in self._connection.execute(query, parameters):
+            name, dependent_version, index_url, dependency_version, required_version, environment_name = row
+            yield {
+                "package_name": name,
+                "package_version": dependent_version,
+                "index_url": index_url,
+                "dependency_version": dependency_version,
+                "required_version": required_version,
+                "environment": environment_name,
+            }
+
+    def unresolved(self, index_url: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Iterate over requirements solvers could not resolve, optionally only those on the given index."""
+        query = (
+            "SELECT package_names.name, unresolved.version_spec, indexes.url, documents.hostname, documents.timestamp "
+            "FROM unresolved "
+            "JOIN package_names ON package_names.id = unresolved.name_id "
+            "JOIN indexes ON indexes.id = unresolved.index_id "
+            "JOIN documents ON documents.id = unresolved.document_id"
+        )
+        parameters: List[Any] = []
+        if index_url is not None:
+            query += " WHERE indexes.url = ?"
+            parameters.append(index_url.rstrip("/"))
+
+        for name, version_spec, url, hostname, timestamp in self._connection.execute(query, parameters):
+            yield {
+                "package_name": name,
+                "version_spec": version_spec,
+                "index_url": url,
+                "hostname": hostname,
+                "timestamp": timestamp,
+            }
+
+    def stats(self) -> Dict[str, int]:
+        """Get numbers of rows stored in each table."""
+        tables = (
+            "documents",
+            "package_names",
+            "indexes",
+            "environments",
+            "package_versions",
+            "solved",
+            "dependencies",
+            "errors",
+            "unresolved",
+        )
+        return {table: self._connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables}
+
+
+@click.group()
+def cli():
+    """Ingest and query thoth-solver results stored in an embedded SQLite store."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("ingest")
+@click.option("--store", "-s", required=True, type=str, help="Path to the store database.")
+@click.option("--batch-size", type=int, default=100, show_default=True, help="Documents ingested per transaction.")
+@click.argument("paths", nargs=-1, required=True)
+def cli_ingest(store: str, batch_size: int, paths: List[str]):
+    """Ingest solver documents stored in JSON files or directories with them."""
+    with SolverStore(store) as solver_store:
+        solver_store.ingest(iter_solver_documents(paths), batch_size=batch_size)
+
+
+@cli.command("dependents")
+@click.option("--store", "-s", required=True, type=str, help="Path to the store database.")
+@click.option("--version", "-v", "package_version", type=str, help="Version of the package.")
+@click.option("--environment", "-e", type=str, help="Solver environment to query, e.g. fedora-29-py36.")
+@click.argument("package_name", type=str)
+def cli_dependents(store: str, package_version: Optional[str], environment: Optional[str], package_name: str):
+    """Print package versions which depend on the given package, as JSON lines."""
+    with SolverStore(store) as solver_store:
+        for entry in solver_store.dependents(package_name, package_version, environment):
+            sys.stdout.write(json.dumps(entry) + "\n")
+
+
+@cli.command("unresolved")
+@click.option("--store", "-s", required=True, type=str, help="Path to the store database.")
+@click.option("--index-url", "-u", type=str, help="Print only requirements not resolved on this index.")
+def cli_unresolved(store: str, index_url: Optional[str]):
+    """Print requirements solvers could not resolve, as JSON lines."""
+    with SolverStore(store) as solver_store:
+        for entry in solver_store.unresolved(index_url):
+            sys.stdout.write(json.dumps(entry) + "\n")
+
+
+@cli.command("stats")
+@click.option("--store", "-s", required=True, type=str, help="Path to the store database.")
+def cli_stats(store: str):
+    """Print numbers of rows stored in the store tables."""
+    with SolverStore(store) as solver_store:
+        json.dump(solver_store.stats(), sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+
+"""Validate Amun inspection specifications before they are submitted.
+
+The schema of specifications is written in a small subset of JSON schema and
+compiled into Python source code of a validator function - every check is a
+plain isinstance() call or comparison inlined in the generated code, so
+validating a specification does not walk the schema. Errors are reported with
+JSON paths of offending values, paths are built only once an error is found.
+Strings checked against a format (e.g. hashes in Pipfile.lock) are remembered
+once found valid, so a batch of specifications sharing a lock is cheap to check.
+
+Supported schema keywords:
+  type           - one of object, array, string, integer, number, boolean
+  properties     - schemas of known object keys
+  required       - object keys which must be present
+  values         - schema of values of any other object keys
+  items          - schema of array items
+  min_items      - minimum number of array items
+  pattern        - regular expression string values must match
+  format         - a named format of string values, see _FORMAT_CHECKS
+  variants       - schemas of a value of different types, e.g. a string or an object
+"""
+
+import re
+import ast
+import sys
+import json
+import logging
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Set
+from typing import Tuple
+
+import click
+import daiquiri
+
+from exceptions import InvalidSpecificationException
+
+_LOGGER = logging.getLogger(__name__)
+
+_RESOURCE_REQUESTS = {
+    "type": "object",
+    "properties": {
+        # Kubernetes quantities, e.g. 500m CPU or 1Gi memory.
+        "cpu": {"type": "string", "pattern": r"^[0-9]+(\.[0-9]+)?m?$"},
+        "memory": {"type": "string", "pattern": r"^[0-9]+(\.[0-9]+)?([EPTGMk]|[EPTGMK]i)?$"},
+        "hardware": {
+            "type": "object",
+            "properties": {
+                "cpu_family": {"type": "integer"},
+                "cpu_model": {"type": "integer"},
+                "physical_cpus": {"type": "integer"},
+                "processor": {"type": "string"},
+            },
+        },
+    },
+}
+_SOURCES = {
+    "type": "array",
+    "min_items": 1,
+    "items": {
+        "type": "object",
+        "required": ["name", "url"],
+        "properties": {
+            "name": {"type": "string", "pattern": r"^\S+$"},
+            "url": {"type": "string", "pattern": r"^https?://"},
+            "verify_ssl": {"type": "boolean"},
+        },
+    },
+}
+_PIPFILE_PACKAGES = {
+    "type": "object",
+    "values": {
+        "variants": [
+            {"type": "string"},
+            {"type": "object", "properties": {"version": {"type": "string"}, "index": {"type": "string"}}},
+        ]
+    },
+}
+_LOCKED_PACKAGES = {
+    "type": "object",
+    "values": {
+        "type": "object",
+        "properties": {
+            "version": {"type": "string", "pattern": r"^=="},
+            "hashes": {"type": "array", "items": {"type": "string", "format": "sha256-hash"}},
+            "index": {"type": "string"},
+            "markers": {"type": "string"},
+        },
+    },
+}
+
+AMUN_SPECIFICATION_SCHEMA = {
+    "type": "object",
+    "required": ["base", "script"],
+    "properties": {
+        "base": {"type": "string", "pattern": r"^\S+$"},
+        "identifier": {"type": "string", "pattern": r"^[a-zA-Z0-9._-]*$"},
+        "build": {"type": "object", "properties": {"requests": _RESOURCE_REQUESTS}},
+        "run": {"type": "object", "properties": {"requests": _RESOURCE_REQUESTS}},
+        "files": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "required": ["path", "content"],
+                "properties": {"path": {"type": "string", "pattern": r"^/"}, "content": {"type": "string"}},
+            },
+        },
+        "packages": {"type": "array", "items": {"type": "string", "pattern": r"^\S+$"}},
+        "python_packages": {"type": "array", "items": {"type": "string", "pattern": r"^\S+$"}},
+        "python": {
+            "type": "object",
+            "required": ["requirements"],
+            "properties": {
+                "requirements": {
+                    "type": "object",
+                    "required": ["source", "packages"],
+                    "properties": {
+                        "source": _SOURCES,
+                        "packages": _PIPFILE_PACKAGES,
+                        "dev-packages": _PIPFILE_PACKAGES,
+                        "requires": {"type": "object", "values": {"type": "string"}},
+                    },
+                },
+                "requirements_locked": {
+                    "type": "object",
+                    "required": ["_meta", "default"],
+                    "properties": {
+                        "_meta": {
+                            "type": "object",
+                            "required": ["sources"],
+                            "properties": {
+                                "hash": {
+                                    "type": "object",
+                                    "properties": {"sha256": {"type": "string", "format": "sha256"}},
+                                },
+                                "pipfile-spec": {"type": "integer"},
+                                "requires": {"type": "object", "values": {"type": "string"}},
+                                "sources": _SOURCES,
+                            },
+                        },
+                        "default": _LOCKED_PACKAGES,
+                        "develop": _LOCKED_PACKAGES,
+                    },
+                },
+            },
+        },
+        "script": {"type": "string", "pattern": r"\S"},
+    },
+}
+
+# Format -> expression checking a string value is in the format. Formats are checked using string methods
+# implemented in C instead of regular expressions - a single specification carries hundreds of hashes.
+_FORMAT_CHECKS = {
+    "sha256": "(len({value}) == 64 and not {value}.strip('0123456789abcdef'))",
+    "sha256-hash": (
+        "(len({value}) == 71 and {value}.startswith('sha256:') and not {value}[7:].strip('0123456789abcdef'))"
+    ),
+}
+
+_SEEN_MAX_SIZE = 1 << 16
+
+# Schema type -> expression checking a value of the type.
+_TYPE_CHECKS = {
+    "object": "isinstance({value}, dict)",
+    "array": "isinstance({value}, list)",
+    "string": "isinstance({value}, str)",
+    "integer": "(isinstance({value}, int) and not isinstance({value}, bool))",
+    "number": "(isinstance({value}, (int, float)) and not isinstance({value}, bool))",
+    "boolean": "isinstance({value}, bool)",
+}
+
+
+def _remember(seen: Set[str], value: str) -> None:
+    """Remember a string found valid, the set is bounded so that validating many batches does not grow memory."""
+    if len(seen) >= _SEEN_MAX_SIZE:
+        seen.clear()
+    seen.add(value)
+
+
+def _path_expression(path: Tuple[str, ...]) -> str:
+    """Build an expression concatenating parts of a path, adjacent string literals are joined at compile time."""
+    parts: List[str] = []
+    for part in path:
+        if parts and part.startswith("'") and parts[-1].startswith("'"):
+            parts[-1] = repr(ast.literal_eval(parts[-1]) + ast.literal_eval(part))
+        else:
+            parts.append(part)
+    return " + ".join(parts)
+
+
+class _CodeGenerator:
+    """Generate source code of a validator function out of a schema."""
+
+    def __init__(self) -> None:
+        self.lines: List[str] = []
+        self.patterns: Dict[str, str] = {}
+        self.formats: Dict[str, str] = {}
+        self._counter = 0
+
+    def _name(self, prefix: str) -> str:
+        """Get a new unique variable name."""
+        self._counter += 1
+        return f"{prefix}{self._counter}"
+
+    def _emit(self, indent: int, line: str) -> None:
+        self.lines.append("    " * indent + line)
+
+    def _error(self, indent: int, path: Tuple[str, ...], message: str) -> None:
+        """Emit code reporting an error at the given path."""
+        self._emit(indent, f"errors.append(({_path_expression(path)}, {message!r}))")
+
+    def generate(self, schema: Dict[str, Any], value: str, path: Tuple[str, ...], indent: int) -> None:
+        """Emit code validating the value given by an expression, path holds literals and expressions of its parts."""
+        if "variants" in schema:
+            keyword = "if"
+            for variant in schema["variants"]:
+                self._emit(indent, f"{keyword} {_TYPE_CHECKS[variant['type']].format(value=value)}:")
+                self._generate_typed(variant, value, path, indent + 1)
+                keyword = "elif"
+            types = " or ".join(variant["type"] for variant in schema["variants"])
+            self._emit(indent, "else:")
+            self._error(indent + 1, path, f"expected {types}")
+            return
+
+        self._emit(indent, f"if not {_TYPE_CHECKS[schema['type']].format(value=value)}:")
+        self._error(indent + 1, path, f"expected {schema['type']}")
+        self._emit(indent, "else:")
+        self._generate_typed(schema, value, path, indent + 1)
+
+    def _generate_typed(self, schema: Dict[str, Any], value: str, path: Tuple[str, ...], indent: int) -> None:
+        """Emit code validating a value already known to be of the type stated in the schema."""
+        start = len(self.lines)
+        if schema["type"] == "object":
+            self._generate_object(schema, value, path, indent)
+        elif schema["type"] == "array":
+            self._generate_array(schema, value, path, indent)
+        elif schema["type"] == "string":
+            self._generate_string(schema, value, path, indent)
+
+        if len(self.lines) == start:
+            self._emit(indent, "pass")
+
+    def _generate_string(self, schema: Dict[str, Any], value: str, path: Tuple[str, ...], indent: int) -> None:
+        """Emit code validating a string against a pattern or a format."""
+        if "format" in schema:
+            # Strings found valid are remembered, specifications of a batch share most of their hashes.
+            seen = self.formats.setdefault(schema["format"], f"_SEEN{len(self.formats)}")
+            self._emit(indent, f"if {value} not in {seen}:")
+            self._emit(indent + 1, f"if {_FORMAT_CHECKS[schema['format']].format(value=value)}:")
+            self._emit(indent + 2, f"_remember({seen}, {value})")
+            self._emit(indent + 1, "else:")
+            self._error(indent + 2, path, f"expected {schema['format']} format")
+
+        if "pattern" in schema:
+            prefix = schema["pattern"][1:]
+            if schema["pattern"].startswith("^") and re.escape(prefix) == prefix:
+                # A plain prefix, no need to run the regular expression engine.
+                self._emit(indent, f"if not {value}.startswith({prefix!r}):")
+            else:
+                pattern = self.patterns.setdefault(schema["pattern"], f"_PATTERN{len(self.patterns)}")
+                self._emit(indent, f"if {pattern}.search({value}) is None:")
+            self._error(indent + 1, path, f"does not match {schema['pattern']!r}")
+
+    def _generate_object(self, schema: Dict[str, Any], value: str, path: Tuple[str, ...], indent: int) -> None:
+        """Emit code validating keys and values of an object."""
+        for key in schema.get("required", ()):
+            self._emit(indent, f"if {key!r} not in {value}:")
+            self._error(indent + 1, path, f"missing required key {key!r}")
+
+        properties = schema.get("properties", {})
+        for key, subschema in properties.items():
+            item = self._name("v")
+            self._emit(indent, f"{item} = {value}.get({key!r}, _MISSING)")
+            self._emit(indent, f"if {item} is not _MISSING:")
+            self.generate(subschema, item, path + (repr("." + key),), indent + 1)
+
+        if "values" in schema:
+            key, item = self._name("k"), self._name("v")
+            self._emit(indent, f"for {key}, {item} in {value}.items():")
+            if properties:
+                self._emit(indent + 1, f"if {key} in {set(properties)!r}:")
+                self._emit(indent + 2, "continue")
+            self.generate(schema["values"], item, path + ("'.'", f"str({key})"), indent + 1)
+
+    def _generate_array(self, schema: Dict[str, Any], value: str, path: Tuple[str, ...], indent: int) -> None:
+        """Emit code validating items of an array."""
+        if "min_items" in schema:
+            self._emit(indent, f"if len({value}) < {schema['min_items']}:")
+            self._error(indent + 1, path, f"expected at least {schema['min_items']} items")
+
+        if "items" in schema:
+            idx, item = self._name("i"), self._name("v")
+            self._emit(indent, f"for {idx}, {item} in enumerate({value}):")
+            self.generate(schema["items"], item, path + ("'['", f"str({idx})", "']'"), indent + 1)
+
+
+def compile_validator(schema: Dict[str, Any]) -> Callable[[Any], List[Tuple[str, str]]]:
+    """Compile a schema into a function returning (path, message) errors found in a value."""
+    generator = _CodeGenerator()
+    generator.generate(schema, "value", ("'$'",), 1)
+    source = "\n".join(["def validate(value):", "    errors = []", *generator.lines, "    return errors"])
+    namespace: Dict[str, Any] = {"_MISSING": object(), "_remember": _remember}
+    namespace.update({name: re.compile(pattern) for pattern, name in generator.patterns.items()})
+    namespace.update({name: set() for name in generator.formats.values()})
+    exec(compile(source, "<spec_validator>", "exec"), namespace)
+    validate = namespace["validate"]
+    validate.source = source
+    return validate
+
+
+validate_amun_specification = compile_validator(AMUN_SPECIFICATION_SCHEMA)
+
+
+def validate_specifications(specifications: Iterable[Dict[str, Any]]) -> Dict[int, List[Tuple[str, str]]]:
+    """Validate a batch of specifications, return errors of invalid specifications keyed by their position."""
+    result = {}
+    for idx, specification in enumerate(specifications):
+        errors = validate_amun_specification(specification)
+        if errors:
+            result[idx] = errors
+
+    return result
+
+
+def check_specification(specification: Dict[str, Any]) -> None:
+    """Raise an exception listing all errors if the specification is not valid."""
+    errors = validate_amun_specification(specification)
+    if errors:
+        raise InvalidSpecificationException(
+            "Invalid inspection specification: " + "; ".join(f"{path}: {message}" for path, message in errors)
+        )
+
+
+@click.command()
+@click.option("--show-source", is_flag=True, help="Print source code of the compiled validator and exit.")
+@click.argument("paths", nargs=-1)
+def cli(show_source: bool, paths: List[str]):
+    """Validate inspection specifications stored in JSON files, exit with 1 if any of them is invalid."""
+    daiquiri.setup(level=logging.INFO)
+    if show_source:
+        print(validate_amun_specification.source)
+        return
+
+    invalid = 0
+    for path in paths:
+        with open(path) as specification_file:
+            errors = validate_amun_specification(json.load(specification_file))
+        for error_path, message in errors:
+            print(f"{path}: {error_path}: {message}")
+        invalid += bool(errors)
+
+    _LOGGER.info("%d of %d specifications are invalid", invalid, len(paths))
+    sys.exit(1 if invalid else 0)
+
+
+if __name__ == "__main__":
+    cli()
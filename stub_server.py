@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+"""A local stand-in for Amun API, Thoth management API, user API and Selinon API.
+
+The server implements contracts used by schedulers in this repository so their
+throughput and retry behaviour can be tested without talking to a live
+cluster. Responses can be delayed, fail randomly or be throttled; every request
+received is recorded.
+
+Implemented endpoints (relative to --prefix, /api/v1 by default):
+  POST /inspect, GET /inspect/<id>/status, GET /inspect/<id>/build/log,
+  GET /inspect/<id>/job/log, GET /inspect/<id>/specification,
+  POST /solver/python, POST /register-python-package-index, POST /analyze,
+  POST /run-flow
+and GET /top-pypi-packages-30-days.min.json serving a synthetic listing of
+popular packages.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import click
+import daiquiri
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class StubState:
+    """Configuration and state shared by request handlers."""
+
+    def __init__(
+        self,
+        *,
+        prefix: str = "/api/v1",
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        max_in_flight: int = 0,
+        retry_after: int = 1,
+        inspection_duration: float = 5.0,
+        popular_packages: int = 5000,
+        record_path: Optional[str] = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        """Initialize state of the stub server."""
+        self.prefix = prefix.rstrip("/")
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.inspection_duration = inspection_duration
+        self.popular_packages = popular_packages
+        self.inspections: Dict[str, Tuple[float, Any]] = {}
+        self.in_flight = 0
+        self.requests_served = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._record_file = open(record_path, "a") if record_path else None
+
+    def random(self) -> float:
+        """Get a random number, thread-safe."""
+        with self._lock:
+            return self._random.random()
+
+    def new_id(self, prefix: str) -> str:
+        """Generate a new id for a scheduled job."""
+        with self._lock:
+            return f"{prefix}-{self._random.getrandbits(64):016x}"
+
+    def enter(self) -> bool:
+        """Account a new request in flight, return False if the server is over its concurrency limit."""
+        with self._lock:
+            self.in_flight += 1
+            self.requests_served += 1
+            return not self.max_in_flight or self.in_flight <= self.max_in_flight
+
+    def leave(self) -> None:
+        """Account a finished request."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Record a served request."""
+        if self._record_file is None:
+            return
+
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            self._record_file.write(line)
+            self._record_file.flush()
+
+
+def _inspection_status(state: StubState, inspection_id: str) -> Optional[Dict[str, Any]]:
+    """Compute status of a simulated inspection based on time elapsed since it was scheduled."""
+    if inspection_id not in state.inspections:
+        return None
+
+    scheduled_at, _ = state.inspections[inspection_id]
+    elapsed = time.time() - scheduled_at
+    build_duration = state.inspection_duration / 2
+
+    if elapsed < build_duration:
+        return {"build": {"state": "running"}, "job": {}}
+
+    build = {"state": "terminated", "exit_code": 0, "reason": "Completed"}
+    if elapsed < state.inspection_duration:
+        return {"build": build, "job": {"state": "running"}}
+
+    return {"build": build, "job": {"state": "terminated", "exit_code": 0, "reason": "Completed"}}
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    """Handle requests sent to the stub server."""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "ThothStub/1.0"
+    # Headers and body are written separately, avoid delayed ACK stalls on keep-alive connections.
+    disable_nagle_algorithm = True
+    state: StubState
+
+    def log_message(self, format: str, *args: Any) -> None:
+        """Log requests on debug level only."""
+        _LOGGER.debug(format, *args)
+
+    def _send(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        """Send a JSON response."""
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _route(self, method: str, path: str, payload: Any) -> Tuple[int, Any]:
+        """Dispatch a request to the simulated endpoint."""
+        state = self.state
+
+        if method == "GET" and path.endswith("/top-pypi-packages-30-days.min.json"):
+            rows = [
+                {"project": f"package-{idx}", "download_count": 10 ** 9 - idx} for idx in range(state.popular_packages)
+            ]
+            return 200, {"rows": rows}
+
+        if not path.startswith(state.prefix + "/"):
+            return 404, {"error": f"Unknown endpoint {path!r}"}
+        path = path[len(state.prefix) :]
+
+        if method == "POST" and path == "/inspect":
+            inspection_id = state.new_id("inspect")
+            state.inspections[inspection_id] = (time.time(), payload)
+            return 202, {"inspection_id": inspection_id, "parameters": payload}
+
+        match = re.fullmatch(r"/inspect/([^/]+)/(status|build/log|job/log|specification)", path)
+        if method == "GET" and match:
+            inspection_id, resource = match.groups()
+            status = _inspection_status(state, inspection_id)
+            if status is None:
+                return 404, {"error": f"Inspection {inspection_id!r} not found"}
+            if resource == "status":
+                return 200, {"inspection_id": inspection_id, "status": status}
+            if resource == "specification":
+                return 200, {"inspection_id": inspection_id, "specification": state.inspections[inspection_id][1]}
+            if resource == "build/log" and status["build"].get("state") == "terminated":
+                return 200, {"inspection_id": inspection_id, "log": f"Build log of {inspection_id}\n"}
+            if resource == "job/log" and status["job"].get("state") == "terminated":
+                return 200, {"inspection_id": inspection_id, "log": {"exit_code": 0, "stdout": {}, "stderr": ""}}
+            return 404, {"error": f"Log for inspection {inspection_id!r} is not available yet"}
+
+        if method == "POST" and path == "/solver/python":
+            return 202, {"analysis_id": state.new_id("solver"), "parameters": payload}
+        if method == "POST" and path == "/register-python-package-index":
+            return 201, {"parameters": payload}
+        if method == "POST" and path == "/analyze":
+            return 202, {"analysis_id": state.new_id("package-extract")}
+        if method == "POST" and path == "/run-flow":
+            return 202, {"dispatcher_id": state.new_id("flow")}
+
+        return 404, {"error": f"Unknown endpoint {method} {path!r}"}
+
+    def _handle(self, method: str) -> None:
+        """Handle a request, simulating latency, failures and throttling."""
+        state = self.state
+        start = time.monotonic()
+        url = urlparse(self.path)
+
+        payload = None
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            body = self.rfile.read(length)
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                payload = None
+
+        accepted = state.enter()
+        try:
+            delay = state.latency + state.jitter * state.random()
+            if delay:
+                time.sleep(delay)
+
+            headers = {}
+            if not accepted or state.random() < state.throttle_rate:
+                status, body = 429, {"error": "Too many requests"}
+                headers["Retry-After"] = str(state.retry_after)
+            elif state.random() < state.error_rate:
+                status, body = 503, {"error": "Simulated failure"}
+            else:
+                status, body = self._route(method, url.path, payload)
+
+            self._send(status, body, headers)
+        finally:
+            state.leave()
+
+        state.record(
+            {
+                "timestamp": time.time(),
+                "method": method,
+                "path": url.path,
+                "query": parse_qs(url.query),
+                "status": status,
+                "duration": time.monotonic() - start,
+                "request_size": length,
+            }
+        )
+
+    def do_GET(self) -> None:
+        """Handle GET request."""
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        """Handle POST request."""
+        self._handle("POST")
+
+
+def create_server(host: str, port: int, state: StubState) -> ThreadingHTTPServer:
+    """Create a stub server bound to the given address."""
+    handler = type("StubRequestHandler", (_StubRequestHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+@click.command()
+@click.option("--host", type=str, default="127.0.0.1", show_default=True, help="Address to listen on.")
+@click.option("--port", "-p", type=int, default=8080, show_default=True, help="Port to listen on.")
+@click.option("--prefix", type=str, default="/api/v1", show_default=True, help="Path prefix of API endpoints.")
+@click.option("--latency", type=float, default=0.0, show_default=True, help="Base latency of responses in seconds.")
+@click.option("--jitter", type=float, default=0.0, show_default=True, help="Maximum random latency added in seconds.")
+@click.option(
+    "--error-rate", type=float, default=0.0, show_default=True, help="Ratio of requests answered with HTTP 503."
+)
+@click.option(
+    "--throttle-rate", type=float, default=0.0, show_default=True, help="Ratio of requests answered with HTTP 429."
+)
+@click.option(
+    "--max-in-flight",
+    type=int,
+    default=0,
+    show_default=True,
+    help="Answer with HTTP 429 if more requests are being served at the same time, 0 means unlimited.",
+)
+@click.option(
+    "--retry-after", type=int, default=1, show_default=True, help="Retry-After value sent with HTTP 429 responses."
+)
+@click.option(
+    "--inspection-duration",
+    type=float,
+    default=5.0,
+    show_default=True,
+    help="Time in seconds after which a scheduled inspection finishes.",
+)
+@click.option(
+    "--popular-packages",
+    type=int,
+    default=5000,
+    show_default=True,
+    help="Number of packages in the synthetic most popular packages listing.",
+)
+@click.option("--record", type=str, help="Record every request served as JSON lines into the given file.")
+@click.option("--seed", type=int, help="Seed for the random number generator to make runs reproducible.")
+def cli(
+    host: str,
+    port: int,
+    prefix: str,
+    latency: float,
+    jitter: float,
+    error_rate: float,
+    throttle_rate: float,
+    max_in_flight: int,
+    retry_after: int,
+    inspection_duration: float,
+    popular_packages: int,
+    record: Optional[str],
+    seed: Optional[int],
+):
+    """Run a local stand-in server for Thoth APIs."""
+    daiquiri.setup(level=logging.INFO)
+    state = StubState(
+        prefix=prefix,
+        latency=latency,
+        jitter=jitter,
+        error_rate=error_rate,
+        throttle_rate=throttle_rate,
+        max_in_flight=max_in_flight,
+        retry_after=retry_after,
+        inspection_duration=inspection_duration,
+        popular_packages=popular_packages,
+        record_path=record,
+        seed=seed,
+    )
+    server = create_server(host, port, state)
+    _LOGGER.info("Serving stub APIs on http://%s:%d%s", host, port, state.prefix)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        _LOGGER.info("Served %d requests", state.requests_served)
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
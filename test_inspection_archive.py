@@ -0,0 +1,17 @@
+"""Tests of the inspection archive."""
+
+from inspection_archive import archive_inspection_results
+from inspection_archive import extract_inspection_result
+
+
+def test_round_trip_keeps_line_endings(tmp_path):
+    """Build logs with carriage returns and without a trailing newline are extracted unchanged."""
+    reference_log = "Collecting numpy\r\nDownloading 10%\rDownloading 100%\r\nInstalled\n"
+    results = [
+        {"inspection_id": "inspection-1", "build_log": reference_log, "job_log": {"exit_code": 0}},
+        {"inspection_id": "inspection-2", "build_log": "Collecting numpy\r\nDownloading 50%\rFailed", "job_log": None},
+    ]
+
+    assert archive_inspection_results(str(tmp_path), results) == 2
+    for result in results:
+        assert extract_inspection_result(str(tmp_path), result["inspection_id"]) == result
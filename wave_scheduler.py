@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+"""Schedule inspections in waves packed to fit cluster quota declared per hardware class.
+
+A quota file is a JSON list of hardware classes, the first class whose
+hardware entries are all stated by inspection requests is used:
+
+    [
+        {
+            "name": "skylake-32",
+            "hardware": {"cpu_model": 94, "physical_cpus": 32},
+            "cpu": "16",
+            "memory": "64Gi",
+            "inspections": 8
+        },
+        {"name": "default", "hardware": {}, "cpu": "8", "memory": "32Gi"}
+    ]
+
+An inspection reserves cpu and memory stated in build and run requests of its
+specification (missing ones reserve nothing). The build and the run are
+executed one after the other, so an inspection reserves the larger of the two
+if both are placed into the same hardware class. The optional inspections
+entry caps the number of inspections running in the class at the same time.
+
+Pending inspections are packed first-fit, the ones reserving the largest share
+of their quota first, into a wave that is submitted at once. Inspections
+running are polled using Amun status API, the next wave is packed as soon as
+some of them finish and release their reservations.
+
+Once submitting an inspection fails, or the deadline given passes, no more
+waves are submitted. Inspections running are still waited for (up to the
+deadline) and ids of all inspections scheduled are reported in the exception
+raised, so their results can be collected later.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import click
+import daiquiri
+
+from amun_collector import is_finished
+from amun_collector import obtain_inspection_result
+from amun_collector import obtain_inspection_status
+from amun_collector import store_inspection_result
+from exceptions import UnschedulableInspectionException
+from exceptions import WaveSchedulingException
+from instrumentation import set_gauge
+from instrumentation import span
+
+_LOGGER = logging.getLogger(__name__)
+
+_CPU_RE = re.compile(r"^([0-9]+(?:\.[0-9]+)?)(m?)$")
+_MEMORY_RE = re.compile(r"^([0-9]+(?:\.[0-9]+)?)([EPTGMk]|[EPTGMK]i)?$")
+_MEMORY_UNITS = {
+    None: 1,
+    "k": 10 ** 3,
+    "M": 10 ** 6,
+    "G": 10 ** 9,
+    "T": 10 ** 12,
+    "P": 10 ** 15,
+    "E": 10 ** 18,
+    "Ki": 2 ** 10,
+    "Mi": 2 ** 20,
+    "Gi": 2 ** 30,
+    "Ti": 2 ** 40,
+    "Pi": 2 ** 50,
+    "Ei": 2 ** 60,
+}
+
+# Reservation of an inspection in a hardware class - (millicores, bytes of memory, inspections).
+Reservation = Tuple[int, int, int]
+
+
+def parse_cpu(quantity: Any) -> int:
+    """Parse Kubernetes CPU quantity (e.g. 2 or 500m), return millicores."""
+    match = _CPU_RE.match(str(quantity))
+    if not match:
+        raise ValueError(f"Invalid CPU quantity: {quantity!r}")
+    value, milli = match.groups()
+    return math.ceil(float(value) * (1 if milli else 1000))
+
+
+def parse_memory(quantity: Any) -> int:
+    """Parse Kubernetes memory quantity (e.g. 512Mi or 1G), return bytes."""
+    match = _MEMORY_RE.match(str(quantity))
+    if not match:
+        raise ValueError(f"Invalid memory quantity: {quantity!r}")
+    value, unit = match.groups()
+    return math.ceil(float(value) * _MEMORY_UNITS[unit])
+
+
+class Quota:
+    """Quota of a hardware class."""
+
+    __slots__ = ("name", "hardware", "cpu", "memory", "inspections")
+
+    def __init__(
+        self, name: str, hardware: Dict[str, Any], cpu: Any, memory: Any, inspections: Optional[int] = None
+    ) -> None:
+        """Initialize quota, cpu and memory are given as Kubernetes quantities."""
+        self.name = name
+        self.hardware = hardware
+        self.cpu = parse_cpu(cpu)
+        self.memory = parse_memory(memory)
+        self.inspections = inspections if inspections is not None else sys.maxsize
+
+    @property
+    def capacity(self) -> Reservation:
+        """Get capacity of the hardware class."""
+        return self.cpu, self.memory, self.inspections
+
+    def matches(self, hardware: Dict[str, Any]) -> bool:
+        """Check whether hardware requested by an inspection belongs to this hardware class."""
+        return all(hardware.get(key) == value for key, value in self.hardware.items())
+
+
+def load_quotas(path: str) -> List[Quota]:
+    """Load quotas of hardware classes from a JSON file."""
+    with open(path) as quota_file:
+        content = json.load(quota_file)
+
+    quotas = []
+    for idx, entry in enumerate(content):
+        try:
+            quotas.append(
+                Quota(
+                    name=entry.get("name") or f"class-{idx}",
+                    hardware=entry.get("hardware") or {},
+                    cpu=entry["cpu"],
+                    memory=entry["memory"],
+                    inspections=entry.get("inspections"),
+                )
+            )
+        except (KeyError, ValueError) as exc:
+            raise ValueError(f"Invalid quota entry #{idx} in {path!r}: {exc}") from exc
+
+    return quotas
+
+
+def inspection_reservations(specification: Dict[str, Any], quotas: List[Quota]) -> Dict[str, Reservation]:
+    """Compute reservations an inspection makes in hardware classes, keyed by names of hardware classes."""
+    reservations: Dict[str, Reservation] = {}
+    for phase in ("build", "run"):
+        requests = (specification.get(phase) or {}).get("requests") or {}
+        hardware = requests.get("hardware") or {}
+        quota = next((quota for quota in quotas if quota.matches(hardware)), None)
+        if quota is None:
+            raise UnschedulableInspectionException(f"No quota declared for {phase} hardware requested: {hardware}")
+
+        cpu = parse_cpu(requests.get("cpu", 0))
+        memory = parse_memory(requests.get("memory", 0))
+        if cpu > quota.cpu or memory > quota.memory or quota.inspections < 1:
+            raise UnschedulableInspectionException(
+                f"Inspection {phase} requests (cpu {requests.get('cpu')}, memory {requests.get('memory')}) "
+                f"do not fit quota of hardware class {quota.name!r}"
+            )
+
+        # Build and run are executed one after the other, the larger of them is reserved.
+        previous_cpu, previous_memory, _ = reservations.get(quota.name, (0, 0, 1))
+        reservations[quota.name] = (max(cpu, previous_cpu), max(memory, previous_memory), 1)
+
+    return reservations
+
+
+def _fits(reservations: Dict[str, Reservation], free: Dict[str, List[int]]) -> bool:
+    """Check whether reservations fit resources left free in hardware classes."""
+    return all(
+        all(amount <= left for amount, left in zip(reservation, free[name]))
+        for name, reservation in reservations.items()
+    )
+
+
+def _share(reservations: Dict[str, Reservation], capacities: Dict[str, Reservation]) -> float:
+    """Compute the largest share of a quota taken by reservations (dominant share)."""
+    return max(
+        amount / capacity
+        for name, reservation in reservations.items()
+        for amount, capacity in zip(reservation, capacities[name])
+        if capacity
+    )
+
+
+def pack_wave(
+    pending: List[Dict[str, Reservation]], free: Dict[str, List[int]], capacities: Dict[str, Reservation]
+) -> List[int]:
+    """Pack pending inspections first-fit decreasing into resources left free, return their indexes.
+
+    Resources reserved by inspections packed are subtracted from free ones.
+    """
+    order = sorted(range(len(pending)), key=lambda idx: -_share(pending[idx], capacities))
+    wave = []
+    for idx in order:
+        if not _fits(pending[idx], free):
+            continue
+        for name, reservation in pending[idx].items():
+            free[name] = [left - amount for left, amount in zip(free[name], reservation)]
+        wave.append(idx)
+
+    return sorted(wave)
+
+
+def _release(reservations: Dict[str, Reservation], free: Dict[str, List[int]]) -> None:
+    """Return reservations of an inspection to resources left free."""
+    for name, reservation in reservations.items():
+        free[name] = [left + amount for left, amount in zip(free[name], reservation)]
+
+
+@span("poll")
+def _poll(amun_api_url: str, inspection_id: str, output_dir: Optional[str], timeout: float) -> bool:
+    """Check whether an inspection finished, store its result if requested."""
+    if not is_finished(obtain_inspection_status(amun_api_url, inspection_id, timeout=timeout)):
+        return False
+
+    if output_dir:
+        store_inspection_result(output_dir, obtain_inspection_result(amun_api_url, inspection_id, timeout=timeout))
+    return True
+
+
+def schedule_in_waves(
+    amun_api_url: str,
+    specifications: List[Dict[str, Any]],
+    quotas: List[Quota],
+    submit: Callable[[Dict[str, Any]], str],
+    *,
+    on_scheduled: Optional[Callable[[str], None]] = None,
+    output_dir: Optional[str] = None,
+    concurrency: int = 16,
+    poll_interval: float = 30.0,
+    max_errors: int = 10,
+    timeout: float = 30.0,
+    deadline: Optional[float] = None,
+) -> List[str]:
+    """Submit inspections in waves fitting quotas and wait for them to finish, return ids of inspections scheduled.
+
+    Results of finished inspections are stored into the output directory, if given. The timeout applies to
+    each request polling Amun API, the deadline (in seconds) to the whole run. Once submitting an inspection
+    fails or the deadline passes, no further waves are submitted and WaveSchedulingException is raised
+    after inspections running finish or the deadline passes, whichever comes first.
+    """
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    capacities = {quota.name: quota.capacity for quota in quotas}
+    free = {name: list(capacity) for name, capacity in capacities.items()}
+    pending = [(specification, inspection_reservations(specification, quotas)) for specification in specifications]
+
+    inspection_ids = []
+    running: Dict[str, Dict[str, Reservation]] = {}
+    errors: Dict[str, int] = {}
+    wave_number = 0
+    error = None
+    expires_at = time.monotonic() + deadline if deadline is not None else None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while pending or running:
+            wave = pack_wave([reservations for _, reservations in pending], free, capacities)
+            if wave:
+                wave_number += 1
+                _LOGGER.info(
+                    "Submitting wave %d with %d inspections, %d running, %d pending",
+                    wave_number,
+                    len(wave),
+                    len(running),
+                    len(pending) - len(wave),
+                )
+                submitted = [pending[idx] for idx in wave]
+                packed = set(wave)
+                pending = [item for idx, item in enumerate(pending) if idx not in packed]
+                with span("wave"):
+                    futures = [(executor.submit(submit, spec), reservations) for spec, reservations in submitted]
+                    for future, reservations in futures:
+                        try:
+                            inspection_id = future.result()
+                        except Exception as exc:
+                            _LOGGER.error("Failed to schedule inspection: %s", exc)
+                            _release(reservations, free)
+                            error = error or exc
+                            continue
+
+                        running[inspection_id] = reservations
+                        inspection_ids.append(inspection_id)
+                        if on_scheduled:
+                            on_scheduled(inspection_id)
+
+            if error is not None and pending:
+                _LOGGER.error("Not submitting %d inspections pending as submitting failed", len(pending))
+                pending = []
+
+            set_gauge("inspections_running", len(running))
+            set_gauge("inspections_pending", len(pending))
+
+            if not running:
+                if pending:
+                    # Cannot happen as long as every inspection fits an empty quota on its own.
+                    raise UnschedulableInspectionException("Pending inspections do not fit quotas declared")
+                break
+
+            if expires_at is not None and time.monotonic() >= expires_at:
+                _LOGGER.error(
+                    "Deadline passed with %d inspections running and %d pending, giving up on inspections: %s",
+                    len(running),
+                    len(pending),
+                    ", ".join(running),
+                )
+                error = error or TimeoutError(f"Inspections did not finish within {deadline} seconds")
+                break
+
+            if expires_at is not None:
+                time.sleep(min(poll_interval, max(expires_at - time.monotonic(), 0.0)))
+            else:
+                time.sleep(poll_interval)
+            polled = {
+                inspection_id: executor.submit(_poll, amun_api_url, inspection_id, output_dir, timeout)
+                for inspection_id in running
+            }
+            for inspection_id, future in polled.items():
+                try:
+                    finished = future.result()
+                except Exception as exc:
+                    errors[inspection_id] = errors.get(inspection_id, 0) + 1
+                    if errors[inspection_id] < max_errors:
+                        _LOGGER.warning("Failed to poll inspection %r: %s", inspection_id, exc)
+                        continue
+                    _LOGGER.error(
+                        "Giving up on inspection %r after %d errors, releasing its reservation: %s",
+                        inspection_id,
+                        errors[inspection_id],
+                        exc,
+                    )
+                    finished = True
+
+                if finished:
+                    _LOGGER.info("Inspection %r finished", inspection_id)
+                    _release(running.pop(inspection_id), free)
+
+    if error is not None:
+        raise WaveSchedulingException(
+            f"Scheduling inspections in waves failed: {error}", inspection_ids, list(running)
+        ) from error
+
+    return inspection_ids
+
+
+@click.command()
+@click.option("--quota", "quota_path", required=True, type=str, help="JSON file with quotas of hardware classes.")
+@click.option(
+    "--specification",
+    "-s",
+    "specification_path",
+    type=str,
+    default="./inspection.json",
+    show_default=True,
+    help="Inspection specification for Amun API.",
+)
+def cli(quota_path: str, specification_path: str):
+    """Show how many inspections of the given specification fit quotas at the same time."""
+    daiquiri.setup(level=logging.INFO)
+    quotas = load_quotas(quota_path)
+    with open(specification_path) as specification_file:
+        specification = json.load(specification_file)
+
+    reservations = inspection_reservations(specification, quotas)
+    capacities = {quota.name: quota.capacity for quota in quotas}
+    fitting = min(
+        capacity // amount
+        for name, reservation in reservations.items()
+        for amount, capacity in zip(reservation, capacities[name])
+        if amount
+    )
+
+    for name, (cpu, memory, _) in reservations.items():
+        click.echo(f"{name}: cpu {cpu}m, memory {memory} bytes per inspection")
+    click.echo(f"Inspections running at the same time: {fitting}")
+
+
+if __name__ == "__main__":
+    cli()
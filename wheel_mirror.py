@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+"""Prefetch wheels of benchmarked frameworks into a local content-addressed store.
+
+Targets are read from a file with one `framework version [index_url]` triplet
+per line. Dependencies of each target are resolved using index metadata (see
+lock_resolver.py) and distribution files installable in the target environment
+are downloaded concurrently, together with their core metadata. Files are
+stored under their sha256 digest so the same file fetched for different
+targets or from different indexes is stored once:
+
+  files/<sha256>/<filename>           - a distribution file
+  files/<sha256>/<filename>.metadata  - its core metadata (PEP 658)
+  manifest.jsonl                      - project, file name and digests of stored files
+  find-links.html                     - all stored files, usable as pip --find-links
+  simple/<project>/index.html         - a PEP 503 simple index of stored files
+
+pip prefers files found using --find-links over equal files found on indexes,
+so installations using the store download nothing but index pages.
+"""
+
+import os
+import json
+import html
+import hashlib
+import logging
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import click
+import daiquiri
+from packaging.requirements import Requirement
+from packaging.utils import canonicalize_name
+
+from http_client import get_client
+from instrumentation import instrumentation_options
+from instrumentation import span
+from lock_resolver import DEFAULT_CACHE_DIR
+from lock_resolver import IndexClient
+from lock_resolver import Resolver
+from lock_resolver import TargetEnvironment
+from lock_resolver import read_wheel_metadata
+
+_LOGGER = logging.getLogger(__name__)
+
+_PYPI_INDEX_URL = "https://pypi.org/simple"
+_MANIFEST_FILE = "manifest.jsonl"
+_FIND_LINKS_FILE = "find-links.html"
+
+
+def read_targets(path: str) -> List[Tuple[str, str, str]]:
+    """Read (framework, version, index URL) targets, one per line; PyPI is used if no index is stated."""
+    targets = []
+    with open(path) as targets_file:
+        for line in targets_file:
+            line = line.split("#", maxsplit=1)[0].strip()
+            if not line:
+                continue
+            parts = line.split()
+            if len(parts) not in (2, 3):
+                raise ValueError(f"Expected 'framework version [index_url]', got {line!r}")
+            targets.append((parts[0], parts[1], parts[2] if len(parts) == 3 else _PYPI_INDEX_URL))
+
+    return targets
+
+
+def _file_path(store: str, sha256: str, filename: str) -> str:
+    """Get path to a stored distribution file."""
+    return os.path.join(store, "files", sha256, filename)
+
+
+def iter_manifest(store: str) -> Iterator[Dict[str, Any]]:
+    """Iterate over files recorded in the store manifest."""
+    manifest_path = os.path.join(store, _MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return
+
+    with open(manifest_path) as manifest_file:
+        for line in manifest_file:
+            yield json.loads(line)
+
+
+class WheelStore:
+    """A content-addressed store of distribution files and their core metadata, safe to be shared across threads."""
+
+    def __init__(self, path: str) -> None:
+        """Open (and create if needed) the store in the given directory."""
+        self.path = path
+        os.makedirs(os.path.join(path, "files"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._stored = {entry["sha256"] for entry in iter_manifest(path)}
+
+    def __contains__(self, sha256: str) -> bool:
+        """Check whether a file with the given digest is stored."""
+        return sha256 in self._stored
+
+    @span("mirror_download")
+    def fetch(self, project: str, file: Dict[str, Any]) -> Optional[str]:
+        """Download a distribution file into the store unless it is stored already, return its digest."""
+        expected = file["hashes"].get("sha256")
+        if expected and expected in self:
+            return expected
+
+        digest = hashlib.sha256()
+        tmp_dir = os.path.join(self.path, "files")
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, prefix=".download-", delete=False) as output_file:
+            try:
+                response = get_client().get(file["url"], stream=True)
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    digest.update(chunk)
+                    output_file.write(chunk)
+            except BaseException:
+                os.unlink(output_file.name)
+                raise
+
+        sha256 = digest.hexdigest()
+        if expected and sha256 != expected:
+            os.unlink(output_file.name)
+            raise ValueError(f"Digest of downloaded {file['filename']!r} does not match the digest stated by the index")
+
+        path = _file_path(self.path, sha256, file["filename"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(output_file.name, path)
+
+        metadata_sha256 = None
+        if file["filename"].endswith(".whl"):
+            with zipfile.ZipFile(path) as wheel:
+                metadata = read_wheel_metadata(wheel).encode("utf-8")
+            with open(path + ".metadata", "wb") as metadata_file:
+                metadata_file.write(metadata)
+            metadata_sha256 = hashlib.sha256(metadata).hexdigest()
+
+        self._record(
+            {
+                "project": canonicalize_name(project),
+                "filename": file["filename"],
+                "sha256": sha256,
+                "requires_python": file["requires_python"],
+                "metadata_sha256": metadata_sha256,
+            }
+        )
+        _LOGGER.info("Stored %r", file["filename"])
+        return sha256
+
+    def _record(self, entry: Dict[str, Any]) -> None:
+        """Record a stored file in the manifest."""
+        with self._lock:
+            if entry["sha256"] in self._stored:
+                return
+            with open(os.path.join(self.path, _MANIFEST_FILE), "a") as manifest_file:
+                manifest_file.write(json.dumps(entry) + "\n")
+            self._stored.add(entry["sha256"])
+
+
+def _link(store: str, entry: Dict[str, Any], relative_to: str) -> str:
+    """Create an anchor pointing to a stored file, relative to the given directory."""
+    href = os.path.relpath(_file_path(store, entry["sha256"], entry["filename"]), relative_to)
+    attributes = [f'href="{html.escape(href)}#sha256={entry["sha256"]}"']
+    if entry["requires_python"]:
+        attributes.append(f'data-requires-python="{html.escape(entry["requires_python"])}"')
+    if entry["metadata_sha256"]:
+        attributes.append(f'data-dist-info-metadata="sha256={entry["metadata_sha256"]}"')
+        attributes.append(f'data-core-metadata="sha256={entry["metadata_sha256"]}"')
+    return f'<a {" ".join(attributes)}>{html.escape(entry["filename"])}</a><br/>'
+
+
+def _write_page(path: str, title: str, links: List[str]) -> None:
+    """Write an HTML page with the given links atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    content = f"<!DOCTYPE html>\n<html><head><title>{html.escape(title)}</title></head><body>\n"
+    content += "\n".join(links) + "\n</body></html>\n"
+    with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path), delete=False) as page_file:
+        page_file.write(content)
+    os.replace(page_file.name, path)
+
+
+def write_indexes(store: str) -> int:
+    """Write find-links page and simple index of all stored files, return number of projects in the store."""
+    projects: Dict[str, List[Dict[str, Any]]] = {}
+    for entry in iter_manifest(store):
+        projects.setdefault(entry["project"], []).append(entry)
+
+    simple_dir = os.path.join(store, "simple")
+    find_links = []
+    for project, entries in sorted(projects.items()):
+        project_dir = os.path.join(simple_dir, project)
+        entries.sort(key=lambda entry: entry["filename"])
+        _write_page(
+            os.path.join(project_dir, "index.html"),
+            f"Links for {project}",
+            [_link(store, entry, project_dir) for entry in entries],
+        )
+        find_links.extend(_link(store, entry, store) for entry in entries)
+
+    _write_page(
+        os.path.join(simple_dir, "index.html"),
+        "Simple index",
+        [f'<a href="{html.escape(project)}/">{html.escape(project)}</a><br/>' for project in sorted(projects)],
+    )
+    _write_page(os.path.join(store, _FIND_LINKS_FILE), "Find links", find_links)
+    return len(projects)
+
+
+def find_links_path(store: str) -> str:
+    """Get path to the find-links page of the store, to be passed to pip as --find-links."""
+    return os.path.join(os.path.abspath(store), _FIND_LINKS_FILE)
+
+
+def prefetch(
+    store: str,
+    targets: List[Tuple[str, str, str]],
+    *,
+    python_version: str = "3.6",
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    workers: int = 16,
+) -> int:
+    """Download files needed to install the given targets into the store, return number of files fetched."""
+    wheel_store = WheelStore(store)
+    environment = TargetEnvironment(python_version)
+
+    files: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+    for framework, version, index_url in targets:
+        # Sources are set up the same way create_pipfile() sets them up for benchmark specifications.
+        sources = [{"name": "target", "url": index_url, "verify_ssl": True}]
+        if index_url.rstrip("/") != _PYPI_INDEX_URL:
+            sources.append({"name": "pypi", "url": _PYPI_INDEX_URL, "verify_ssl": True})
+
+        resolver = Resolver(IndexClient(sources, cache_dir), environment, workers=workers)
+        with span("mirror_resolve"):
+            candidates = resolver.resolve([(Requirement(f"{framework}=={version}"), "target")])
+
+        for candidate in candidates:
+            for file in candidate.installable_files(environment):
+                files.setdefault(file["url"], (candidate.name, file))
+        _LOGGER.info("Target %s==%s from %r needs %d releases", framework, version, index_url, len(candidates))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda item: wheel_store.fetch(*item), files.values()))
+
+    projects = write_indexes(store)
+    _LOGGER.info("Store %r holds files of %d projects, %d files needed by targets", store, projects, len(results))
+    return len(results)
+
+
+@click.group()
+def cli():
+    """Maintain a local store of wheels used to install benchmarked frameworks."""
+    daiquiri.setup(level=logging.INFO)
+
+
+@cli.command("prefetch")
+@click.option("--store", "-s", required=True, type=str, help="Directory of the wheel store.")
+@click.option(
+    "--targets",
+    "-t",
+    "targets_file",
+    required=True,
+    type=str,
+    help="A file with `framework version [index_url]' targets, one per line.",
+)
+@click.option(
+    "--python-version",
+    type=str,
+    default="3.6",
+    show_default=True,
+    help="Python version of the environment frameworks are installed into.",
+)
+@click.option("--cache-dir", type=str, default=DEFAULT_CACHE_DIR, show_default=True, help="Cache of index metadata.")
+@click.option("--workers", "-w", type=int, default=16, show_default=True, help="Number of concurrent downloads.")
+@instrumentation_options
+def cli_prefetch(store: str, targets_file: str, python_version: str, cache_dir: str, workers: int):
+    """Download wheels of targets and their dependencies into the store."""
+    prefetch(store, read_targets(targets_file), python_version=python_version, cache_dir=cache_dir, workers=workers)
+    _LOGGER.info("Use %r as pip find-links", find_links_path(store))
+    get_client().metrics.log_summary()
+
+
+@cli.command("index")
+@click.option("--store", "-s", required=True, type=str, help="Directory of the wheel store.")
+def cli_index(store: str):
+    """Regenerate the find-links page and the simple index of the store."""
+    _LOGGER.info("Indexed files of %d projects", write_indexes(store))
+
+
+if __name__ == "__main__":
+    cli()